@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import DISABLED_METRICS
+
+
+# خيوط إضافية (في Gradio وفي كل عامل) للردود المبنية على القواعد (الطوارئ، المتخصصين، المواعيد)،
+# حتى لا تنتظر هذه الردود خلف الرسائل التي تنتظر دورها في النموذج
+FAST_LANE_THREADS = 4
+
+
+class _TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class AdmissionController:
+    """
+    التحكم في قبول أعمال النموذج (توليد الرد) عند الضغط:
+    عدد محدد من الأدوار يعمل على النموذج في نفس الوقت، وقائمة انتظار محدودة بعدها، ومعدل محدد لكل جلسة
+    (token bucket). الدور الذي لا يجد مكانًا يُرفض فورًا (أو بعد أقصى زمن انتظار) ليحصل المستخدم على رد
+    "ضغط عالٍ" بدلًا من الانتظار الطويل. الردود المبنية على القواعد لا تمر من هنا أبدًا (المسار السريع).
+    """
+
+    RATE_LIMITED = "rate_limited"
+    QUEUE_FULL = "queue_full"
+    TIMEOUT = "timeout"
+
+    def __init__(self, max_concurrent=1, max_queue=16, max_wait_s=30.0, session_rate=None, session_burst=5,
+                 max_sessions=10000, metrics=None):
+        self.max_concurrent = max_concurrent  # أدوار تعمل على النموذج في نفس الوقت (حجم الدفعة مع التوليد بالدفعات)
+        self.max_queue = max_queue  # أقصى عدد من الأدوار المنتظرة بعد ذلك
+        self.max_wait_s = max_wait_s
+        self.session_rate = session_rate  # رسائل في الثانية لكل جلسة (None بدون حد)
+        self.session_burst = session_burst  # عدد الرسائل المسموح بها دفعة واحدة قبل تطبيق المعدل
+        self.max_sessions = max_sessions
+        self.metrics = metrics if metrics is not None else DISABLED_METRICS
+
+        self._condition = threading.Condition()
+        self.in_use = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = {self.RATE_LIMITED: 0, self.QUEUE_FULL: 0, self.TIMEOUT: 0}
+        self._buckets = OrderedDict()  # الجلسة -> _TokenBucket، مرتبة من الأقدم استخدامًا
+
+    def admit(self, session_id):
+        """
+        طلب مكان على النموذج لدور واحد. تُرجع None عند القبول (ويجب استدعاء release بعد انتهاء التوليد)،
+        أو سبب الرفض: RATE_LIMITED أو QUEUE_FULL أو TIMEOUT.
+        """
+        started = time.monotonic()
+        with self._condition:
+            if not self._take_token(session_id, started):
+                return self._reject(self.RATE_LIMITED)
+            if self.in_use >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    self._refund_token(session_id)
+                    return self._reject(self.QUEUE_FULL)
+                self.waiting += 1
+                try:
+                    deadline = started + self.max_wait_s
+                    while self.in_use >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._refund_token(session_id)
+                            return self._reject(self.TIMEOUT)
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_use += 1
+            self.admitted += 1
+        self.metrics.observe("chatbot_admission_wait_seconds", time.monotonic() - started)
+        return None
+
+    def release(self):
+        """إعادة المكان بعد انتهاء التوليد وإيقاظ أول دور منتظر."""
+        with self._condition:
+            self.in_use -= 1
+            self._condition.notify()
+
+    def _take_token(self, session_id, now):
+        """خصم رسالة من رصيد الجلسة بعد إضافة ما تراكم منذ آخر رسالة (يتم استدعاؤها مع القفل)."""
+        if self.session_rate is None:
+            return True
+        bucket = self._buckets.get(session_id)
+        if bucket is None:
+            bucket = self._buckets[session_id] = _TokenBucket(self.session_burst, now)
+            if len(self._buckets) > self.max_sessions:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(session_id)
+            bucket.tokens = min(self.session_burst, bucket.tokens + (now - bucket.updated) * self.session_rate)
+            bucket.updated = now
+        if bucket.tokens < 1:
+            return False
+        bucket.tokens -= 1
+        return True
+
+    def _refund_token(self, session_id):
+        """إعادة الرسالة إلى رصيد الجلسة عندما يُرفض الدور بسبب الضغط (وليس بسبب معدل الجلسة نفسها)."""
+        bucket = self._buckets.get(session_id)
+        if bucket is not None:
+            bucket.tokens = min(self.session_burst, bucket.tokens + 1)
+
+    def _reject(self, reason):
+        self.shed[reason] += 1
+        self.metrics.inc("chatbot_shed_total", reason=reason)
+        return reason
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "shed": dict(self.shed),
+            }
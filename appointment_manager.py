@@ -1,86 +1,77 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import base64
-import pickle
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-import os
+from appointment_outbox import AppointmentOutbox, GoogleSink
+from google_clients import GoogleClients
 
 class AppointmentManager:
-    def __init__(self):
-        # إعداد OAuth2 للوصول إلى Google Sheets
-        self.scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/spreadsheets",
-                      "https://www.googleapis.com/auth/drive.file", "https://www.googleapis.com/auth/drive"]
-        self.creds = ServiceAccountCredentials.from_json_keyfile_name('/path/to/credentials.json', self.scope)
-        self.client = gspread.authorize(self.creds)  # الاتصال بخدمة Google Sheets
-        self.sheet = self.client.open('MentalHealth').sheet1  # فتح الورقة الأولى في ملف Google Sheets
+    def __init__(self, sink=None, outbox_path="appointments_outbox.db", credentials_path='/path/to/credentials.json',
+                 token_path='token.pickle', sheet_name='MentalHealth', metrics=None):
+        """
+        sink: وجهة إرسال الحجوزات (افتراضيًا Google Sheets و Gmail). يمكن تمرير LocalSink للعمل دون اتصال.
+        لا تتم أي مصادقة هنا؛ يتم إنشاء عملاء Google عند أول استخدام (ويتم تجهيزهم في الخلفية).
+        """
+        self.clients = None
+        if sink is None:
+            self.clients = GoogleClients.shared(credentials_path, token_path, sheet_name)
+            self.clients.warm_up_async()
+            sink = GoogleSink(self)
+
+        # صندوق صادر محلي: يتم حفظ الحجوزات فورًا وإرسالها على دفعات في الخلفية
+        self.outbox = AppointmentOutbox(sink, path=outbox_path, metrics=metrics)
+
+    @property
+    def sheet(self):
+        """الورقة الأولى في ملف Google Sheets (يتم فتحها عند أول استخدام)."""
+        return self.clients.sheet
 
     def store_appointment_data(self, data):
         """
-        دالة لإضافة البيانات إلى Google Sheets
+        دالة لإضافة البيانات إلى Google Sheets (عبر الصندوق الصادر دون انتظار الشبكة)
         """
-        self.sheet.append_row(data)  # إضافة صف جديد من البيانات إلى الورقة
+        self.outbox.enqueue_row(data)  # إضافة صف جديد من البيانات إلى قائمة الانتظار
 
     def authenticate_gmail(self):
         """
-        دالة مصادقة للوصول إلى Gmail API
+        دالة مصادقة للوصول إلى Gmail API (يتم إعادة استخدام الخدمة وتجديد التوكن عند الحاجة فقط)
         """
-        creds = None
-        if os.path.exists('token.pickle'):
-            with open('token.pickle', 'rb') as token:
-                creds = pickle.load(token)  # تحميل التوكن من الملف إذا كان موجودًا
-
-        # إذا كانت بيانات المصادقة غير صالحة أو منتهية الصلاحية، يتم تجديدها أو طلبها من المستخدم
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())  # تجديد التوكن إذا كان منتهي الصلاحية
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    '/path/to/credentials.json', ['https://www.googleapis.com/auth/gmail.send'])
-                creds = flow.run_local_server(port=0)  # مصادقة عبر واجهة المستخدم
-
-            with open('token.pickle', 'wb') as token:
-                pickle.dump(creds, token)  # تخزين التوكن بعد التجديد
-
-        service = build('gmail', 'v1', credentials=creds)  # بناء خدمة Gmail API
-        return service
+        return self.clients.gmail()
     
-    def send_confirmation_email(self, service, to_email, appointment_details):
+    def build_confirmation_message(self, to_email, appointment_details):
         """
-        إرسال بريد إلكتروني لتأكيد الموعد باستخدام Gmail API
+        إنشاء رسالة تأكيد الموعد بتنسيق جاهز للإرسال عبر Gmail API
         """
-        try:
-            message = MIMEMultipart()  # إنشاء رسالة بريد إلكتروني
-            message['to'] = to_email
-            message['subject'] = "Appointment Confirmation"
-            
-            # إنشاء محتوى البريد الإلكتروني
-            body = f"""
-Dear {appointment_details['Patient Name']},
+        message = MIMEMultipart()  # إنشاء رسالة بريد إلكتروني
+        message['to'] = to_email
+        message['subject'] = "Appointment Confirmation"
+
+        # إنشاء محتوى البريد الإلكتروني
+        body = f"""
+Dear {appointment_details['name']},
 
 Your appointment has been confirmed.
 
-Date: {appointment_details['Date']}
-Time: {appointment_details['Time']}
-Specialist: {appointment_details['Specialty']}
-Location: {appointment_details['Location']}
-Phone: {appointment_details['Phone']}
-Condition: {appointment_details['Patient\'s Condition']}
-Additional Notes: {appointment_details['Additional Notes']}
+Date: {appointment_details['date']}
+Time: {appointment_details['time']}
+Specialist: {appointment_details['specialty']}
+Location: {appointment_details['location']}
+Phone: {appointment_details['phone']}
+Condition: {appointment_details['condition']}
+Additional Notes: {appointment_details['notes']}
 
 Thank you for booking with us!
 
 Best regards,
 Mental Health Support Team
 """
-            message.attach(MIMEText(body, 'plain'))  # إرفاق نص البريد
-            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()  # تحويل الرسالة إلى تنسيق قابل للإرسال
-            send_message = service.users().messages().send(userId="me", body={'raw': raw_message}).execute()  # إرسال الرسالة
-            print(f"Message sent to {to_email}, Message Id: {send_message['id']}")  # طباعة رسالة النجاح
-        except Exception as error:
-            print(f"An error occurred: {error}")  # طباعة الخطأ إذا حدث
+        message.attach(MIMEText(body, 'plain'))  # إرفاق نص البريد
+        return base64.urlsafe_b64encode(message.as_bytes()).decode()  # تحويل الرسالة إلى تنسيق قابل للإرسال
+
+    def send_confirmation_email(self, to_email, appointment_details):
+        """
+        إرسال بريد إلكتروني لتأكيد الموعد (عبر الصندوق الصادر دون انتظار الشبكة؛ الإرسال الفعلي في GoogleSink)
+        """
+        self.outbox.enqueue_email(to_email, dict(appointment_details))
 
     def detect_appointment_request(self, user_input):
         """
@@ -90,69 +81,76 @@ Mental Health Support Team
         
         return any(keyword in user_input.lower() for keyword in appointment_keywords)  # التحقق من وجود كلمات حجز الموعد في الإدخال
 
-    def ask_for_appointment_details(self, user_input):
+    def ask_for_appointment_details(self, user_input, state):
         """
         طلب تفاصيل الموعد من المستخدم بطريقة حوارية.
+        يتم حفظ التقدم في حالة الجلسة (state) حتى لا تختلط بيانات المستخدمين.
         """
+        collected_data = state.collected_data
+        # الرسالة التي بدأت الحجز (طلب الموعد أو الموافقة بعد قائمة المتخصصين) ليست الاسم
+        if not state.asked_for_name:
+            state.asked_for_name = True
+            return "Please provide your name."
+
         # تتبع جمع التفاصيل باستخدام معجم (collected_data) لتخزين المدخلات
-        if "name" not in self.collected_data:
-            self.collected_data["name"] = user_input
+        if "name" not in collected_data:
+            collected_data["name"] = user_input
             return "Please provide the specialty (e.g., Psychologist, Psychiatrist, etc.)."
         
-        if "specialty" not in self.collected_data:
-            self.collected_data["specialty"] = user_input
+        if "specialty" not in collected_data:
+            collected_data["specialty"] = user_input
             return "Please provide the appointment date (e.g., 2023-10-20)."
         
-        if "date" not in self.collected_data:
-            self.collected_data["date"] = user_input
+        if "date" not in collected_data:
+            collected_data["date"] = user_input
             return "Please provide the appointment time (e.g., 10:00 AM)."
         
-        if "time" not in self.collected_data:
-            self.collected_data["time"] = user_input
+        if "time" not in collected_data:
+            collected_data["time"] = user_input
             return "Please provide your email address."
         
-        if "email" not in self.collected_data:
-            self.collected_data["email"] = user_input
+        if "email" not in collected_data:
+            collected_data["email"] = user_input
             return "Please provide your phone number."
         
-        if "phone" not in self.collected_data:
-            self.collected_data["phone"] = user_input
+        if "phone" not in collected_data:
+            collected_data["phone"] = user_input
             return "Please provide your location."
         
-        if "location" not in self.collected_data:
-            self.collected_data["location"] = user_input
+        if "location" not in collected_data:
+            collected_data["location"] = user_input
             return "Please describe your condition (e.g., Anxiety, Stress)."
         
-        if "condition" not in self.collected_data:
-            self.collected_data["condition"] = user_input
+        if "condition" not in collected_data:
+            collected_data["condition"] = user_input
             return "Please provide any additional notes you may have."
         
-        if "notes" not in self.collected_data:
-            self.collected_data["notes"] = user_input
+        if "notes" not in collected_data:
+            collected_data["notes"] = user_input
             # بعد جمع جميع التفاصيل، نقوم بتخزينها
             appointment_data = [
-                self.collected_data["name"],
-                self.collected_data["specialty"],
-                self.collected_data["date"],
-                self.collected_data["time"],
-                self.collected_data["email"],
-                self.collected_data["phone"],
-                self.collected_data["location"],
-                self.collected_data["condition"],
-                self.collected_data["notes"]
+                collected_data["name"],
+                collected_data["specialty"],
+                collected_data["date"],
+                collected_data["time"],
+                collected_data["email"],
+                collected_data["phone"],
+                collected_data["location"],
+                collected_data["condition"],
+                collected_data["notes"]
             ]
-            # تخزين البيانات في Google Sheets
+            # تخزين البيانات في Google Sheets (يتم الإرسال في الخلفية)
             self.store_appointment_data(appointment_data)
             
-            # إرسال تأكيد بالبريد الإلكتروني للمريض
-            service = self.authenticate_gmail()
-            self.send_confirmation_email(service, self.collected_data["email"], self.collected_data)
+            # إضافة تأكيد بالبريد الإلكتروني للمريض إلى الصندوق الصادر
+            self.send_confirmation_email(collected_data["email"], collected_data)
             
             # إعادة تعيين collected_data بعد تخزين البيانات
-            self.collected_data = {}
-            self.asking_for_appointment = False
+            state.collected_data = {}
+            state.asking_for_appointment = False
+            state.asked_for_name = False
 
-            return "Your appointment has been successfully booked. A confirmation email has been sent."
+            return "Your appointment has been successfully booked. A confirmation email will be sent to you shortly."
 
         return "Sorry, something went wrong. Please try again."
 
@@ -0,0 +1,218 @@
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import DISABLED_METRICS
+
+
+class AppointmentOutbox:
+    """
+    صندوق صادر محلي دائم (SQLite) لبيانات الحجوزات ورسائل التأكيد.
+    يتم حفظ كل سجل فورًا على القرص، ثم يقوم خيط في الخلفية بإرسال السجلات على دفعات
+    إلى الوجهة (sink) مع إعادة المحاولة والتأخير المتزايد عند الفشل، حتى لا ينتظر دور المحادثة الشبكة.
+    """
+
+    ROW = "row"
+    EMAIL = "email"
+
+    def __init__(self, sink, path="appointments_outbox.db", batch_size=50, flush_interval=2.0,
+                 max_retries=8, base_backoff=1.0, max_backoff=300.0, start=True, metrics=None):
+        self.sink = sink  # الوجهة: Google Sheets/Gmail أو بديل محلي للاختبار
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics if metrics is not None else DISABLED_METRICS
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " kind TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt REAL NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " last_error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt)")
+        self._conn.commit()
+
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._worker = None
+        if start:
+            self.start()
+
+    def start(self):
+        """تشغيل خيط الإرسال في الخلفية."""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="appointment-outbox", daemon=True)
+            self._worker.start()
+
+    def enqueue_row(self, row):
+        """إضافة صف حجز إلى الصندوق الصادر (يُرسل لاحقًا إلى Google Sheets)."""
+        self._enqueue(self.ROW, row)
+
+    def enqueue_email(self, to_email, appointment_details):
+        """إضافة رسالة تأكيد إلى الصندوق الصادر (تُرسل لاحقًا عبر Gmail)."""
+        self._enqueue(self.EMAIL, {"to": to_email, "details": appointment_details})
+
+    def _enqueue(self, kind, payload):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO outbox (kind, payload, next_attempt) VALUES (?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+        self._wakeup.set()
+
+    def pending_count(self):
+        """عدد السجلات التي لم تُرسل بعد."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def failed_count(self):
+        """عدد السجلات التي فشلت بعد استنفاد جميع المحاولات."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'failed'").fetchone()[0]
+
+    def flush(self):
+        """
+        إرسال السجلات المستحقة على دفعات (صفوف ثم رسائل). تُرجع عدد السجلات المرسلة بنجاح.
+        """
+        sent = 0
+        for kind in (self.ROW, self.EMAIL):
+            while True:
+                with self._lock:
+                    batch = self._conn.execute(
+                        "SELECT id, payload, attempts FROM outbox"
+                        " WHERE kind = ? AND status = 'pending' AND next_attempt <= ?"
+                        " ORDER BY id LIMIT ?",
+                        (kind, time.time(), self.batch_size),
+                    ).fetchall()
+                if not batch:
+                    break
+                with self.metrics.span(f"sink_{kind}"):
+                    succeeded, failed = self._send(kind, batch)
+                if failed:
+                    self.metrics.inc("chatbot_sink_failures_total", len(failed), kind=kind)
+                self._record(succeeded, failed)
+                sent += len(succeeded)
+                if failed or len(batch) < self.batch_size:
+                    break
+        return sent
+
+    def _send(self, kind, batch):
+        """إرسال دفعة واحدة إلى الوجهة وإرجاع (السجلات الناجحة، السجلات الفاشلة مع الخطأ)."""
+        payloads = [json.loads(payload) for _, payload, _ in batch]
+        try:
+            if kind == self.ROW:
+                # إضافة جميع الصفوف في طلب واحد (append_rows)
+                self.sink.append_rows(payloads)
+                return batch, []
+            results = self.sink.send_emails([(p["to"], p["details"]) for p in payloads])
+        except Exception as error:
+            return [], [(item, error) for item in batch]
+        succeeded = [item for item, error in zip(batch, results) if error is None]
+        failed = [(item, error) for item, error in zip(batch, results) if error is not None]
+        return succeeded, failed
+
+    def _record(self, succeeded, failed):
+        """حذف السجلات المرسلة وجدولة إعادة المحاولة للسجلات الفاشلة مع تأخير متزايد."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE id = ?", [(item[0],) for item in succeeded])
+            for (record_id, _, attempts), error in failed:
+                attempts += 1
+                status = "failed" if attempts >= self.max_retries else "pending"
+                delay = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+                self._conn.execute(
+                    "UPDATE outbox SET attempts = ?, next_attempt = ?, status = ?, last_error = ? WHERE id = ?",
+                    (attempts, now + delay, status, str(error), record_id),
+                )
+            self._conn.commit()
+        for _, error in failed[:1]:
+            print(f"An error occurred while flushing the appointment outbox: {error}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as error:
+                print(f"An error occurred while flushing the appointment outbox: {error}")
+
+    def close(self, flush=True):
+        """إيقاف خيط الإرسال، مع محاولة إرسال أخيرة للسجلات المستحقة."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join(timeout=self.flush_interval + 1)
+        if flush:
+            self.flush()
+        with self._lock:
+            self._conn.close()
+
+
+class GoogleSink:
+    """الوجهة الحقيقية: Google Sheets للصفوف و Gmail API لرسائل التأكيد."""
+
+    def __init__(self, appointment_manager):
+        self.appointment_manager = appointment_manager
+
+    def append_rows(self, rows):
+        self.appointment_manager.sheet.append_rows(rows)
+
+    def send_emails(self, emails):
+        """
+        إرسال الرسائل في طلب Gmail مجمّع واحد (batch HTTP request).
+        تُرجع قائمة بالخطأ لكل رسالة (None عند النجاح).
+        """
+        service = self.appointment_manager.authenticate_gmail()
+        errors = [None] * len(emails)
+
+        def callback(request_id, response, exception):
+            errors[int(request_id)] = exception
+
+        batch = service.new_batch_http_request(callback=callback)
+        for i, (to_email, details) in enumerate(emails):
+            raw_message = self.appointment_manager.build_confirmation_message(to_email, details)
+            batch.add(service.users().messages().send(userId="me", body={"raw": raw_message}), request_id=str(i))
+        batch.execute()
+        return errors
+
+
+class LocalSink:
+    """
+    بديل محلي لـ Google Sheets و Gmail للاختبار دون اتصال: يكتب الصفوف في ملف CSV
+    والرسائل في ملف JSONL، مع إمكانية محاكاة زمن الشبكة.
+    """
+
+    def __init__(self, directory="local_outbox", latency=0.0):
+        self.directory = directory
+        self.latency = latency  # زمن الانتظار المحاكي لكل طلب (بالثواني)
+        os.makedirs(directory, exist_ok=True)
+        self.rows_path = os.path.join(directory, "appointments.csv")
+        self.emails_path = os.path.join(directory, "emails.jsonl")
+
+    def append_rows(self, rows):
+        time.sleep(self.latency)
+        with open(self.rows_path, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(rows)
+
+    def send_emails(self, emails):
+        time.sleep(self.latency)
+        with open(self.emails_path, "a", encoding="utf-8") as f:
+            for to_email, details in emails:
+                f.write(json.dumps({"to": to_email, "details": details}, ensure_ascii=False) + "\n")
+        return [None] * len(emails)
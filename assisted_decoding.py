@@ -0,0 +1,81 @@
+import threading
+
+from inference_backend import load_model
+
+
+class AssistedDecoding:
+    """
+    التوليد بمساعدة نموذج مسودة صغير (assisted / speculative decoding):
+    النموذج الصغير يقترح عدة توكنز متتالية، والنموذج الرئيسي يتحقق منها كلها في مرور واحد
+    ويقبل أطول جزء متفق عليه. مع الاختيار العشوائي (do_sample) يُستخدم قبول احتمالي يحافظ على
+    توزيع النموذج الرئيسي نفسه، ومع الاختيار الجشع تكون النتيجة مطابقة تمامًا للتوليد العادي.
+    يجب أن يستخدم نموذج المسودة نفس المحوّل (tokenizer)، مثل DialoGPT-small مع DialoGPT-medium.
+    ملاحظة: حلقة التوليد المساعد في transformers تمرر النص كاملًا في أول مرور (للنموذجين) حتى مع ذاكرة المقدمة،
+    لذلك تظهر الفائدة عندما يكون زمن توليد الرد أكبر من زمن قراءة النص الموجه.
+    """
+
+    def __init__(self, model, tokenizer, draft_model_name, backend="eager", device="cpu", num_assistant_tokens=5,
+                 schedule="heuristic", confidence_threshold=None):
+        from transformers import AutoTokenizer
+
+        if AutoTokenizer.from_pretrained(draft_model_name).get_vocab() != tokenizer.get_vocab():
+            raise ValueError(f"Draft model {draft_model_name} must use the same tokenizer as the main model.")
+        self.model = model
+        self.draft = load_model(draft_model_name, backend, device)
+        # عدد التوكنز المقترحة في كل خطوة؛ "heuristic" يزيده عند قبول جميع المقترحات ويقلله عند رفضها
+        self.draft.generation_config.num_assistant_tokens = num_assistant_tokens
+        self.draft.generation_config.num_assistant_tokens_schedule = schedule
+        if confidence_threshold is not None:
+            # إيقاف الاقتراح عندما تقل ثقة المسودة في التوكن التالي عن هذا الحد (0 = اقتراح العدد كاملًا دائمًا)
+            self.draft.generation_config.assistant_confidence_threshold = confidence_threshold
+
+        self._local = threading.local()  # عدادات المرور على النموذجين أثناء التوليد في هذا الخيط
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.new_tokens = 0
+        self.main_passes = 0
+        self.draft_passes = 0
+        self.model.register_forward_pre_hook(self._count(0))
+        self.draft.register_forward_pre_hook(self._count(1))
+
+    def _count(self, index):
+        def hook(module, args):
+            passes = getattr(self._local, "passes", None)
+            if passes is not None:
+                passes[index] += 1
+        return hook
+
+    def generate(self, input_ids, **generation_kwargs):
+        """generate للنموذج الرئيسي مع نموذج المسودة، وتسجيل عدد التوكنز الجديدة وعدد مرات تشغيل كل نموذج."""
+        self._local.passes = passes = [0, 0]
+        try:
+            outputs = self.model.generate(input_ids, assistant_model=self.draft, **generation_kwargs)
+        finally:
+            self._local.passes = None
+        with self._lock:
+            self.calls += 1
+            self.new_tokens += outputs.shape[-1] - input_ids.shape[-1]
+            self.main_passes += passes[0]
+            self.draft_passes += passes[1]
+        return outputs
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = self.new_tokens = self.main_passes = self.draft_passes = 0
+
+    def get_stats(self):
+        """
+        نسبة القبول = التوكنز المقترحة التي قبلها النموذج الرئيسي / جميع التوكنز المقترحة.
+        كل مرور للنموذج الرئيسي يضيف التوكنز المقبولة + توكنًا واحدًا منه، لذلك المقبول = الجديد - عدد المرورات.
+        """
+        with self._lock:
+            accepted = max(0, self.new_tokens - self.main_passes)
+            return {
+                "calls": self.calls,
+                "new_tokens": self.new_tokens,
+                "main_passes": self.main_passes,
+                "draft_tokens": self.draft_passes,
+                "accepted_tokens": accepted,
+                "acceptance_rate": accepted / self.draft_passes if self.draft_passes else 0.0,
+                "tokens_per_main_pass": self.new_tokens / self.main_passes if self.main_passes else 0.0,
+            }
@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+import torch
+
+from metrics import DISABLED_METRICS
+
+
+class BatchGenerator:
+    """
+    مُجدول دفعات ديناميكي: يجمع طلبات التوليد المتزامنة لبضعة أجزاء من الثانية
+    ثم يشغّل استدعاء generate واحدًا على الدفعة كاملة ويعيد لكل طلب رده الخاص.
+    """
+
+    def __init__(self, model, tokenizer, device, clean_fn, max_batch_size=8, max_wait_ms=10,
+                 stats_size=1000, metrics=None, **generation_kwargs):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.clean_fn = clean_fn  # دالة تنظيف الرد (clean_response)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.generation_kwargs = generation_kwargs
+        self.metrics = metrics if metrics is not None else DISABLED_METRICS
+
+        self.pad_token_id = tokenizer.pad_token_id
+        self.eos_token_id = tokenizer.eos_token_id
+
+        # إحصائيات كل دفعة (الحجم، الطول بعد الحشو، زمن الانتظار وزمن التوليد)
+        self.batch_stats = deque(maxlen=stats_size)
+        self.total_batches = 0
+        self.total_requests = 0
+
+        self._queue = Queue()
+        self._worker = threading.Thread(target=self._run, name="batch-generator", daemon=True)
+        self._worker.start()
+
+    def submit(self, input_ids):
+        """
+        إضافة طلب إلى الدفعة القادمة والانتظار حتى يصبح الرد جاهزًا.
+        تعيد (الرد بعد التنظيف، التوكنز الجديدة بشكل [1, n]).
+        """
+        return self.submit_async(input_ids).result()
+
+    def submit_async(self, input_ids):
+        """إضافة طلب دون انتظار، وإرجاع Future يحمل النتيجة."""
+        future = Future()
+        # نحتفظ بالتسلسل كمتجه أحادي البعد على الـ CPU لتسهيل الحشو لاحقًا
+        self._queue.put((input_ids.reshape(-1).cpu(), future, time.perf_counter()))
+        return future
+
+    def queue_depth(self):
+        """عدد الطلبات التي تنتظر دورها حاليًا."""
+        return self._queue.qsize()
+
+    def get_stats(self):
+        """ملخص إحصائيات الدفعات منذ بدء التشغيل."""
+        recent = list(self.batch_stats)
+        sizes = [s["batch_size"] for s in recent]
+        return {
+            "total_batches": self.total_batches,
+            "total_requests": self.total_requests,
+            "avg_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+            "max_batch_size": max(sizes) if sizes else 0,
+            "last_batch": recent[-1] if recent else None,
+        }
+
+    def _collect_batch(self):
+        """انتظار أول طلب ثم تجميع الطلبات اللاحقة حتى امتلاء الدفعة أو انتهاء مهلة الانتظار."""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _pad_left(self, sequences):
+        """حشو التسلسلات من اليسار وبناء قناع الانتباه المناسب."""
+        max_len = max(seq.shape[0] for seq in sequences)
+        input_ids = torch.full((len(sequences), max_len), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(sequences), max_len), dtype=torch.long)
+        for i, seq in enumerate(sequences):
+            input_ids[i, max_len - seq.shape[0]:] = seq
+            attention_mask[i, max_len - seq.shape[0]:] = 1
+        return input_ids.to(self.device), attention_mask.to(self.device)
+
+    def _trim_new_tokens(self, tokens):
+        """قص الحشو الذي يضيفه generate بعد أول توكن نهاية (EOS) للتسلسلات التي انتهت مبكرًا."""
+        eos_positions = (tokens == self.eos_token_id).nonzero()
+        if eos_positions.numel():
+            tokens = tokens[:eos_positions[0].item() + 1]
+        return tokens
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            sequences = [item[0] for item in batch]
+            futures = [item[1] for item in batch]
+            started = time.perf_counter()
+            self.metrics.observe("chatbot_batch_size", len(batch))
+            for item in batch:
+                self.metrics.observe("chatbot_batch_wait_seconds", started - item[2])
+            try:
+                input_ids, attention_mask = self._pad_left(sequences)
+                with self.metrics.span("batch_generate"), torch.no_grad():
+                    outputs = self.model.generate(input_ids, attention_mask=attention_mask, **self.generation_kwargs)
+                generated = outputs[:, input_ids.shape[1]:].cpu()
+
+                new_tokens = 0
+                for i, future in enumerate(futures):
+                    tokens = self._trim_new_tokens(generated[i])
+                    new_tokens += tokens.shape[0]
+                    with self.metrics.span("decode"):
+                        response = self.tokenizer.decode(tokens, skip_special_tokens=False)
+                    with self.metrics.span("clean"):
+                        response = self.clean_fn(response)
+                    future.set_result((response, tokens.unsqueeze(0).to(self.device)))
+            except Exception as error:
+                # إبلاغ جميع الطلبات في الدفعة بالخطأ بدلًا من تركها معلقة
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            finished = time.perf_counter()
+            self.total_batches += 1
+            self.total_requests += len(batch)
+            self.batch_stats.append({
+                "batch_size": len(batch),
+                "padded_length": input_ids.shape[1],
+                "new_tokens": new_tokens,
+                "max_wait_ms": (started - min(item[2] for item in batch)) * 1000,
+                "generate_ms": (finished - started) * 1000,
+            })
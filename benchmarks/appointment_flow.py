@@ -0,0 +1,60 @@
+"""
+التحقق من مسار حجز المواعيد من أول رسالة حتى الصف المحفوظ ورسالة التأكيد.
+
+التشغيل من جذر المشروع (دون اتصال: نموذج صغير بأوزان عشوائية و LocalSink بدلًا من Google Sheets و Gmail):
+    python -m benchmarks.appointment_flow
+
+يتم تنفيذ محادثتي حجز (طلب موعد مباشر، والموافقة بعد قائمة المتخصصين) ثم التحقق من أن الاسم المحفوظ
+في الصف وفي رسالة التأكيد هو الاسم الذي أدخله المستخدم، وليس الرسالة التي بدأت الحجز. الخروج بـ 1 عند الفشل.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+
+from appointment_outbox import LocalSink
+from benchmarks.load_test import build_stub_model
+
+
+DETAILS = ["Psychologist", "2024-06-02", "2:30 PM", "alex@example.com", "+1555020202", "Chicago", "Anxiety", "First visit"]
+
+# (الرسائل التي تبدأ الحجز، الاسم المتوقع)
+CONVERSATIONS = [
+    (["I need an appointment please"], "Alex Kim"),
+    (["Sometimes I want to hurt myself", "I am in New York", "yes"], "Sam Carter"),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stub-dir", default=os.path.join(tempfile.gettempdir(), "chatbot-load-test-model"))
+    args = parser.parse_args(argv)
+
+    from mental_health_chatbot import MentalHealthChatbot
+
+    work_dir = tempfile.mkdtemp(prefix="chatbot-appointment-flow-")
+    sink = LocalSink(os.path.join(work_dir, "sink"))
+    chatbot = MentalHealthChatbot(model_name=build_stub_model(args.stub_dir), appointment_sink=sink,
+                                  appointment_outbox_path=os.path.join(work_dir, "appointments_outbox.db"))
+    for i, (opening, name) in enumerate(CONVERSATIONS):
+        for message in opening + [name] + DETAILS:
+            reply, _ = chatbot.generate_response(message, session_id=f"appointment-{i}")
+            print(f"> {message}\n  {reply}")
+    chatbot.appointment_manager.outbox.close()
+
+    with open(sink.rows_path, newline="", encoding="utf-8") as f:
+        stored = [row[0] for row in csv.reader(f)]
+    with open(sink.emails_path, encoding="utf-8") as f:
+        greeted = [json.loads(line)["details"]["name"] for line in f]
+    expected = [name for _, name in CONVERSATIONS]
+    print(f"stored names: {stored}, e-mail names: {greeted}, expected: {expected}")
+    ok = stored == expected and greeted == expected
+    if not ok:
+        print("Appointment flow check failed: the stored name is not the name the user gave.")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
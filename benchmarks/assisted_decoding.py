@@ -0,0 +1,143 @@
+"""
+قياس التوليد المساعد بنموذج مسودة صغير مقارنة بالتوليد العادي.
+
+التشغيل من جذر المشروع:
+    python -m benchmarks.assisted_decoding --model adanal/dialogpt-finetuned --draft microsoft/DialoGPT-small
+                                           [--backend eager] [--num-assistant-tokens 5] [--repeats 2]
+
+يتحقق أولًا من أن التوليد الجشع (greedy) بمساعدة المسودة يطابق التوليد العادي توكنًا بتوكن (الجودة لا تتغير)؛
+الاختلاف عند توكن يكاد يتساوى فيه أعلى احتمالين (فرق أقل من --tie-tolerance) يُحسب تعادلًا عدديًا وليس خطأ،
+ثم يقيس زمن الرد وزمن كل توكن كما في المحادثة (المقدمة الثابتة من PrefixCache ثم رسالة المستخدم،
+مع نفس إعدادات الاختيار العشوائي)،
+مع نسبة قبول توكنز المسودة، ومتوسط طول الرد ونسبة الرد الاحتياطي للطريقتين. النتيجة بصيغة JSON.
+"""
+import argparse
+import json
+import sys
+import time
+
+import torch
+from transformers import AutoTokenizer
+
+from assisted_decoding import AssistedDecoding
+from inference_backend import SAMPLE_MESSAGES, load_model
+from prefix_cache import PrefixCache
+from prompt_engineering import PromptEngineering
+
+
+# نفس إعدادات التوليد في MentalHealthChatbot
+SAMPLING = dict(max_new_tokens=100, temperature=0.7, do_sample=True, top_p=0.9, top_k=50)
+
+
+class Prompts:
+    """مدخلات النموذج كما يبنيها روبوت المحادثة: توكنز المقدمة الثابتة (مع ذاكرتها) ثم رسالة المستخدم."""
+
+    def __init__(self, model, tokenizer, messages=SAMPLE_MESSAGES):
+        self.prompt_engineering = PromptEngineering()
+        self.prefix_cache = PrefixCache(model, tokenizer, "cpu")
+        self.prefix = self.prompt_engineering.prompt_prefix()
+        prefix_ids, _ = self.prefix_cache.get(self.prefix)
+        self.inputs = [
+            torch.cat([prefix_ids, tokenizer.encode(self.prompt_engineering.prepare_turn(message) + tokenizer.eos_token,
+                                                    return_tensors="pt")], dim=-1)
+            for message in messages
+        ]
+
+    def __iter__(self):
+        for input_ids in self.inputs:
+            _, past_key_values = self.prefix_cache.get(self.prefix)  # نسخة جديدة من ذاكرة المقدمة لكل توليد
+            yield input_ids, dict(past_key_values=past_key_values, attention_mask=torch.ones_like(input_ids))
+
+    def __len__(self):
+        return len(self.inputs)
+
+
+def check_greedy(model, assisted, tokenizer, prompts, max_new_tokens, tie_tolerance):
+    """
+    عدد النصوص التي يطابق فيها التوليد الجشع المساعد التوليد العادي تمامًا، وعدد الاختلافات الناتجة عن تعادل عددي:
+    التحقق من عدة توكنز في مرور واحد قد يغير آخر خانات الأرقام، فيتبدل الاختيار إذا تساوى أعلى احتمالين تقريبًا.
+    """
+    identical = near_ties = 0
+    greedy = dict(max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=tokenizer.eos_token_id)
+    for (input_ids, expected_kwargs), (_, actual_kwargs) in zip(prompts, prompts):
+        with torch.no_grad():
+            expected = model.generate(input_ids, **expected_kwargs, **greedy)
+            actual = assisted.generate(input_ids, **actual_kwargs, **greedy)
+        if torch.equal(expected, actual):
+            identical += 1
+            continue
+        length = min(expected.shape[-1], actual.shape[-1])
+        differences = (expected[0, :length] != actual[0, :length]).nonzero()
+        if len(differences):
+            position = differences[0].item()
+            with torch.no_grad():
+                top = model(expected[:, :position]).logits[0, -1].topk(2).values
+            near_ties += (top[0] - top[1]).item() < tie_tolerance
+    return identical, near_ties
+
+
+def run(generate, tokenizer, prompts, repeats, seed):
+    """زمن كل رد وعدد توكنزه ونسبة الرد الاحتياطي مع الاختيار العشوائي."""
+    latencies, tokens, fallbacks = [], 0, 0
+    for repeat in range(repeats):
+        for i, (input_ids, kwargs) in enumerate(prompts):
+            torch.manual_seed(seed + repeat * len(prompts) + i)
+            started = time.perf_counter()
+            with torch.no_grad():
+                outputs = generate(input_ids, pad_token_id=tokenizer.eos_token_id, **kwargs, **SAMPLING)
+            latencies.append(time.perf_counter() - started)
+            new_tokens = outputs[0, input_ids.shape[1]:]
+            tokens += new_tokens.shape[0]
+            reply = prompts.prompt_engineering.clean_response(tokenizer.decode(new_tokens, skip_special_tokens=False))
+            fallbacks += reply == PromptEngineering.FALLBACK_RESPONSE
+    return {
+        "replies": len(latencies),
+        "ms_per_reply": round(sum(latencies) * 1000 / len(latencies), 1),
+        "ms_per_token": round(sum(latencies) * 1000 / max(tokens, 1), 2),
+        "mean_reply_tokens": round(tokens / len(latencies), 1),
+        "fallback_rate": round(fallbacks / len(latencies), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="adanal/dialogpt-finetuned")
+    parser.add_argument("--draft", default="microsoft/DialoGPT-small")
+    parser.add_argument("--backend", choices=("eager", "int8"), default="eager")
+    parser.add_argument("--num-assistant-tokens", type=int, default=5)
+    parser.add_argument("--confidence-threshold", type=float, default=None,
+                        help="حد ثقة المسودة لإيقاف الاقتراح (الافتراضي من transformers)")
+    parser.add_argument("--greedy-tokens", type=int, default=40, help="طول التوليد الجشع في فحص التطابق")
+    parser.add_argument("--tie-tolerance", type=float, default=1e-2,
+                        help="أقصى فرق بين أعلى قيمتين (logits) ليُعتبر الاختلاف تعادلًا عدديًا")
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = load_model(args.model, args.backend)
+    assisted = AssistedDecoding(model, tokenizer, args.draft, args.backend, num_assistant_tokens=args.num_assistant_tokens,
+                                confidence_threshold=args.confidence_threshold)
+    prompts = Prompts(model, tokenizer)
+
+    identical, near_ties = check_greedy(model, assisted, tokenizer, prompts, args.greedy_tokens, args.tie_tolerance)
+    plain = run(model.generate, tokenizer, prompts, args.repeats, args.seed)
+    assisted.reset_stats()
+    speculative = run(assisted.generate, tokenizer, prompts, args.repeats, args.seed)
+
+    report = {
+        "model": args.model,
+        "draft": args.draft,
+        "backend": args.backend,
+        "greedy_identical": f"{identical}/{len(prompts)}",
+        "greedy_near_ties": near_ties,
+        "plain": plain,
+        "assisted": dict(speculative, **assisted.get_stats()),
+        "speedup": round(plain["ms_per_reply"] / speculative["ms_per_reply"], 2),
+    }
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if identical + near_ties == len(prompts) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+قياس أداء كاشف عبارات الطوارئ.
+
+التشغيل من جذر المشروع:
+    python -m benchmarks.crisis_detector [--phrases 5000] [--iterations 2000]
+
+يقارن زمن المطابقة بالطريقة القديمة (بحث نصي لكل كلمة) مع عدد كبير من العبارات.
+التحقق من الدقة (recall والاكتشاف الخاطئ) في benchmarks/test_crisis_detector.py، ويستخدم الرسائل أدناه.
+"""
+import argparse
+import random
+import string
+import time
+
+from emergency_response_handler import EmergencyResponseHandler
+from keyword_matcher import KeywordMatcher
+
+
+# رسائل يجب أن يتم اكتشافها كحالة طارئة
+CRISIS_MESSAGES = [
+    "I have been thinking about suicide",
+    "i keep thinking about SUICIDE lately",
+    "I feel suicidal tonight",
+    "Sometimes I want to   kill\tmyself",
+    "I want to kill myself.",
+    "I might hurt myself",
+    "I've been hurting myself again",
+    "I don't want to live anymore",
+    "I don’t want to live anymore",
+    "i dont want to live",
+    "I want to end my life",
+    "thinking about self-harm",
+    "I self harmed yesterday",
+    "I'm better off dead",
+    "I want to die",
+    "He talks about murder",
+    "I could harm someone",
+    "أفكر في الانتحار",
+    "أريد أن أقتل نفسي",
+    "أُرِيدُ أَنْ أَمُوتَ",
+    "لا أريد أن أعيش بعد الآن",
+    "أفكر بالانتحار",
+    "فكرت كثيرا في الانتحار وبالانتحار",
+    "ذهبت للانتحار",
+    "وأريد أن أموت",
+    "فأقتل نفسي",
+    "je veux mourir",
+    "quiero morir",
+]
+
+# رسائل عادية يجب ألا تُكتشف كحالة طارئة
+SAFE_MESSAGES = [
+    "I've been feeling really anxious lately and can't seem to shake it off.",
+    "I don't feel motivated to do anything anymore.",
+    "I feel like I'm not good enough compared to others.",
+    "I can't fall asleep because my mind won't stop racing.",
+    "I'm having problems communicating with my partner.",
+    "What are some healthy ways to deal with stress?",
+    "I love listening to music for harmony",
+    "The pharmacy was closed today",
+    "I want to live a happier life",
+    "أشعر بالقلق قبل الامتحانات",
+    "أفكر بالامتحان والنجاح",
+]
+
+
+def legacy_check(user_input, keywords):
+    """الطريقة السابقة: بحث نصي منفصل لكل كلمة بعد حذف المسافات."""
+    t = user_input.replace(" ", "")
+    return any(k in t for k in keywords)
+
+
+def random_phrases(count, seed=0):
+    """توليد عبارات عشوائية لمحاكاة قائمة كبيرة بعدة لغات."""
+    rng = random.Random(seed)
+    alphabets = [string.ascii_lowercase, "ابتثجحخدذرزسشصضطظعغفقكلمنهوي", "абвгдежзийклмнопрстуфхцчшщ"]
+    phrases = []
+    for i in range(count):
+        letters = alphabets[i % len(alphabets)]
+        words = ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(rng.randint(1, 4))]
+        phrases.append(" ".join(words))
+    return phrases
+
+
+def benchmark(num_phrases, iterations):
+    phrases = EmergencyResponseHandler.crisis_keywords + random_phrases(num_phrases)
+    started = time.perf_counter()
+    matcher = KeywordMatcher(phrases)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    messages = SAFE_MESSAGES + CRISIS_MESSAGES
+    started = time.perf_counter()
+    for i in range(iterations):
+        matcher.search(messages[i % len(messages)])
+    matcher_us = (time.perf_counter() - started) / iterations * 1e6
+
+    started = time.perf_counter()
+    for i in range(iterations):
+        legacy_check(messages[i % len(messages)], phrases)
+    legacy_us = (time.perf_counter() - started) / iterations * 1e6
+
+    print(f"phrases: {len(phrases)}, build: {build_ms:.1f} ms")
+    print(f"automaton: {matcher_us:.1f} us/message")
+    print(f"legacy substring scan: {legacy_us:.1f} us/message")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--phrases", type=int, default=5000, help="عدد العبارات العشوائية الإضافية")
+    parser.add_argument("--iterations", type=int, default=2000, help="عدد الرسائل في القياس")
+    args = parser.parse_args()
+
+    benchmark(args.phrases, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
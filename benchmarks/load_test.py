@@ -0,0 +1,327 @@
+"""
+اختبار الحمل وقياس أداء روبوت المحادثة بمحادثات متعددة الأدوار ومستخدمين متزامنين.
+
+التشغيل من جذر المشروع (دون اتصال: نموذج صغير بأوزان عشوائية و LocalSink بدلًا من Google Sheets و Gmail):
+    python -m benchmarks.load_test [--target chatbot interface] [--concurrency 4] [--conversations 8]
+                                   [--scenarios emergency specialist appointment free_chat]
+                                   [--output report.json] [--baseline previous.json --tolerance 0.2]
+
+أو مع نموذج حقيقي:
+    python -m benchmarks.load_test --model adanal/dialogpt-finetuned --backend int8 --batching
+
+كل مستخدم متزامن ينفذ محادثات كاملة بالتتابع في جلسة خاصة به، عبر MentalHealthChatbot.generate_response
+(target=chatbot) أو عبر ChatInterface.chat_interface كما تستدعيها Gradio (target=interface).
+النتيجة بصيغة JSON: زمن الأدوار p50/p95/p99 (لكل مسار أيضًا)، التوكنز في الثانية، الأدوار في الثانية،
+وأعلى استهلاك للذاكرة، وعدد الأدوار المرفوضة عند تفعيل التحكم في القبول (--max-model-queue / --session-rate).
+مع --baseline يتم مقارنة p95 وعدد الأدوار في الثانية بتقرير سابق، والخروج بـ 1 عند التراجع.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from appointment_outbox import LocalSink
+from metrics import peak_rss_mb
+
+
+# محادثات مكتوبة مسبقًا لكل مسار: قائمة (المسار المتوقع، رسالة المستخدم)
+# (رسائل المواعيد لا تحتوي على "no" لأنها تلغي الحجز، والمحادثة الحرة لا تحتوي على كلمات الحجز أو الطوارئ)
+SCENARIOS = {
+    "emergency": [
+        ("emergency", "I have been thinking about suicide lately"),
+        ("specialist", "I live far away from everyone"),
+        ("model", "I just feel tired of everything"),
+    ],
+    "specialist": [
+        ("emergency", "Sometimes I want to hurt myself"),
+        ("specialist", "I am in New York"),
+        ("appointment", "yes"),
+        ("appointment", "Sam Carter"),
+        ("appointment", "Psychiatrist"),
+        ("appointment", "2024-05-20"),
+        ("appointment", "10:00 AM"),
+        ("appointment", "sam@example.com"),
+        ("appointment", "+1555010101"),
+        ("appointment", "New York"),
+        ("appointment", "Stress"),
+        ("appointment", "Prefer mornings"),
+    ],
+    "appointment": [
+        ("appointment", "I need an appointment with a psychologist"),
+        ("appointment", "Alex Kim"),
+        ("appointment", "Psychologist"),
+        ("appointment", "2024-06-02"),
+        ("appointment", "2:30 PM"),
+        ("appointment", "alex@example.com"),
+        ("appointment", "+1555020202"),
+        ("appointment", "Chicago"),
+        ("appointment", "Anxiety"),
+        ("appointment", "First visit"),
+        ("model", "Thank you, that helps a lot."),
+    ],
+    "free_chat": [
+        ("model", "I've been feeling really anxious lately and can't seem to shake it off."),
+        ("model", "It gets worse at night when I try to sleep."),
+        ("model", "What are some healthy ways to deal with stress?"),
+        ("model", "I will try breathing exercises, thanks."),
+    ],
+}
+
+
+def build_stub_model(path, num_layers=2, hidden_size=64, num_positions=4096, seed=0):
+    """
+    حفظ نموذج GPT-2 صغير بأوزان عشوائية ومحوّل نصوص على مستوى البايت (لا يحتاج إلى تنزيل أي ملف)،
+    حتى يمكن قياس أداء المسارات كلها دون اتصال. السياق طويل (4096) لأن المقدمة الثابتة تُرمَّز بايتًا بايتًا.
+    """
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+    vocab = {char: i for i, char in enumerate(sorted(pre_tokenizers.ByteLevel.alphabet()))}
+    vocab["<|endoftext|>"] = eos_id = len(vocab)
+    backend = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    backend.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    backend.decoder = decoders.ByteLevel()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, eos_token="<|endoftext|>",
+                                        bos_token="<|endoftext|>", unk_token="<|endoftext|>")
+    torch.manual_seed(seed)
+    config = GPT2Config(vocab_size=len(vocab), n_positions=num_positions, n_embd=hidden_size, n_layer=num_layers,
+                        n_head=max(1, hidden_size // 32), bos_token_id=eos_id, eos_token_id=eos_id)
+    GPT2LMHeadModel(config).save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return path
+
+
+def percentiles(values):
+    """p50/p95/p99 بالملي ثانية (أقرب رتبة)."""
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    ordered = sorted(values)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.999999) - 1))] * 1000, 2)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+class LoadTest:
+    """
+    تشغيل المحادثات المكتوبة مسبقًا على روبوت المحادثة أو الواجهة بعدد محدد من المستخدمين المتزامنين
+    وتجميع زمن كل دور وعدد توكنز الرد.
+    """
+
+    def __init__(self, chatbot=None, interface=None, scenarios=tuple(SCENARIOS), concurrency=4, conversations=8):
+        self.interface = interface
+        self.chatbot = chatbot if chatbot is not None else interface.chatbot
+        self.tokenizer = self.chatbot.tokenizer
+        self.scenarios = list(scenarios)
+        self.concurrency = concurrency
+        self.conversations = conversations
+        self._session_ids = iter(range(sys.maxsize))
+        # ردود الرفض (الضغط العالي وتحديد المعدل) عند تفعيل التحكم في القبول
+        self._shed_replies = {getattr(self.chatbot, name, None) for name in ("HIGH_LOAD_RESPONSE", "RATE_LIMIT_RESPONSE")}
+        self._lock = threading.Lock()
+
+    def _new_session(self, target):
+        with self._lock:
+            return f"load-test-{target}-{next(self._session_ids)}"
+
+    def _chatbot_turn(self, session_id, message):
+        started = time.perf_counter()
+        reply, _ = self.chatbot.generate_response(message, session_id=session_id)
+        elapsed = time.perf_counter() - started
+        return reply, elapsed, elapsed
+
+    def _interface_turn(self, session_id, message, history):
+        # نفس الاستدعاء الذي تقوم به Gradio: مولّد يعيد التاريخ بعد كل جزء من الرد
+        request = types.SimpleNamespace(session_hash=session_id)
+        started = time.perf_counter()
+        first_chunk = None
+        for _ in self.interface.chat_interface(message, history, request):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - started
+        elapsed = time.perf_counter() - started
+        reply = history[-1][1]
+        if reply == self.interface.ERROR_RESPONSE:
+            raise RuntimeError(f"chat_interface returned the error response for {message!r}")
+        return reply, elapsed, first_chunk if first_chunk is not None else elapsed
+
+    def _run_conversation(self, target, scenario):
+        session_id = self._new_session(target)
+        history = []
+        turns = []
+        try:
+            for route, message in SCENARIOS[scenario]:
+                try:
+                    if target == "interface":
+                        reply, elapsed, first_chunk = self._interface_turn(session_id, message, history)
+                    else:
+                        reply, elapsed, first_chunk = self._chatbot_turn(session_id, message)
+                except Exception as error:
+                    turns.append({"scenario": scenario, "route": route, "error": repr(error)})
+                    continue
+                shed = reply in self._shed_replies
+                turns.append({
+                    "scenario": scenario,
+                    "route": route,
+                    "latency": elapsed,
+                    "first_chunk": first_chunk,
+                    "tokens": len(self.tokenizer.encode(reply)) if route == "model" and not shed else 0,
+                    "shed": shed,
+                })
+        finally:
+            self.chatbot.end_session(session_id)
+        return turns
+
+    def warm_up(self, target):
+        """دور واحد من المحادثة الحرة قبل القياس (أول استدعاء للنموذج أبطأ من المعتاد)."""
+        self._run_conversation(target, "free_chat")
+
+    def run(self, target):
+        """تشغيل جميع المحادثات على الهدف ("chatbot" أو "interface") وإرجاع ملخص النتائج."""
+        jobs = [self.scenarios[i % len(self.scenarios)] for i in range(self.conversations)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"load-test-{target}") as executor:
+            results = list(executor.map(lambda scenario: self._run_conversation(target, scenario), jobs))
+        wall = time.perf_counter() - started
+        return self.summarize([turn for turns in results for turn in turns], wall)
+
+    def summarize(self, turns, wall):
+        ok = [turn for turn in turns if "error" not in turn]
+        errors = [turn for turn in turns if "error" in turn]
+        tokens = sum(turn["tokens"] for turn in ok)
+        model_time = sum(turn["latency"] for turn in ok if turn["route"] == "model")
+        summary = {
+            "turns": len(turns),
+            "errors": len(errors),
+            "shed": sum(turn["shed"] for turn in ok),
+            "wall_s": round(wall, 3),
+            "turns_per_s": round(len(ok) / wall, 3) if wall else None,
+            # توكنز ردود النموذج في الثانية: على الزمن الكلي (مع التزامن) وعلى زمن أدوار النموذج فقط
+            "tokens_per_s": round(tokens / wall, 2) if wall else None,
+            "model_tokens_per_s": round(tokens / model_time, 2) if model_time else None,
+            "latency": percentiles([turn["latency"] for turn in ok]),
+            "first_chunk": percentiles([turn["first_chunk"] for turn in ok]),
+            "routes": {},
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        for route in sorted({turn["route"] for turn in ok}):
+            latencies = [turn["latency"] for turn in ok if turn["route"] == route]
+            summary["routes"][route] = dict(count=len(latencies), **percentiles(latencies))
+        if errors:
+            summary["error_samples"] = sorted({turn["error"] for turn in errors})[:5]
+        return summary
+
+
+def compare(report, baseline, tolerance):
+    """مقارنة النتائج بتقرير سابق: تراجع إذا زاد p95 أو نقص عدد الأدوار في الثانية بأكثر من tolerance."""
+    regressions = []
+    for target, current in report["targets"].items():
+        previous = baseline.get("targets", {}).get(target)
+        if not previous:
+            continue
+        old_p95, new_p95 = previous["latency"]["p95_ms"], current["latency"]["p95_ms"]
+        if old_p95 and new_p95 and new_p95 > old_p95 * (1 + tolerance):
+            regressions.append(f"{target}: p95 latency {old_p95} ms -> {new_p95} ms")
+        old_rate, new_rate = previous["turns_per_s"], current["turns_per_s"]
+        if old_rate and new_rate and new_rate < old_rate * (1 - tolerance):
+            regressions.append(f"{target}: turns/s {old_rate} -> {new_rate}")
+        if current["errors"] > previous.get("errors", 0):
+            regressions.append(f"{target}: errors {previous.get('errors', 0)} -> {current['errors']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", nargs="+", choices=("chatbot", "interface"), default=["chatbot"])
+    parser.add_argument("--scenarios", nargs="+", choices=tuple(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=4, help="عدد المستخدمين المتزامنين")
+    parser.add_argument("--conversations", type=int, default=8, help="عدد المحادثات لكل هدف")
+    parser.add_argument("--model", default=None, help="اسم أو مسار النموذج (افتراضيًا نموذج صغير بأوزان عشوائية)")
+    parser.add_argument("--stub-dir", default=os.path.join(tempfile.gettempdir(), "chatbot-load-test-model"))
+    parser.add_argument("--stub-layers", type=int, default=2)
+    parser.add_argument("--stub-width", type=int, default=64)
+    parser.add_argument("--backend", default="eager", choices=("eager", "int8", "onnx"))
+    parser.add_argument("--batching", action="store_true", help="تفعيل التوليد بالدفعات")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--response-cache", action="store_true")
+    parser.add_argument("--metrics", action="store_true", help="تفعيل قياسات المراحل (لقياس تكلفتها)")
+    parser.add_argument("--max-model-queue", type=int, default=None,
+                        help="تفعيل التحكم في القبول بقائمة انتظار محدودة لأدوار النموذج")
+    parser.add_argument("--max-queue-wait", type=float, default=30.0, help="أقصى انتظار لمكان على النموذج (بالثواني)")
+    parser.add_argument("--session-rate", type=float, default=None, help="معدل الرسائل لكل جلسة (رسالة/ثانية)")
+    parser.add_argument("--sink-latency", type=float, default=0.0, help="زمن محاكي لإرسال الحجوزات (بالثواني)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="ملف JSON للنتائج (بالإضافة إلى الطباعة)")
+    parser.add_argument("--baseline", default=None, help="تقرير JSON سابق للمقارنة")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="نسبة التراجع المسموح بها مقارنة بالتقرير السابق")
+    args = parser.parse_args(argv)
+
+    torch.manual_seed(args.seed)
+    work_dir = tempfile.mkdtemp(prefix="chatbot-load-test-")
+    model_name = args.model or build_stub_model(args.stub_dir, args.stub_layers, args.stub_width, seed=args.seed)
+    chatbot_kwargs = dict(
+        model_name=model_name,
+        backend=args.backend,
+        enable_batching=args.batching,
+        max_batch_size=args.max_batch_size,
+        response_cache=args.response_cache,
+        metrics=args.metrics,
+        max_model_queue=args.max_model_queue,
+        max_queue_wait_s=args.max_queue_wait,
+        session_rate=args.session_rate,
+        # الحجوزات تُكتب في ملفات محلية بدلًا من Google Sheets و Gmail
+        appointment_sink=LocalSink(os.path.join(work_dir, "sink"), latency=args.sink_latency),
+        appointment_outbox_path=os.path.join(work_dir, "appointments_outbox.db"),
+    )
+
+    started = time.perf_counter()
+    interface = chatbot = None
+    if "interface" in args.target:
+        from chat_interface import ChatInterface
+
+        interface = ChatInterface(prewarm_cache=False, background_load=False,
+                                  conversation_log_path=os.path.join(work_dir, "conversations.db"), **chatbot_kwargs)
+    else:
+        from mental_health_chatbot import MentalHealthChatbot
+
+        chatbot = MentalHealthChatbot(**chatbot_kwargs)
+    load_s = time.perf_counter() - started
+    load_test = LoadTest(chatbot, interface, args.scenarios, args.concurrency, args.conversations)
+
+    report = {
+        "config": dict(vars(args), model=model_name, torch_threads=torch.get_num_threads()),
+        "load_s": round(load_s, 3),
+        "startup": interface.startup_timings if interface is not None else None,
+        "targets": {},
+    }
+    for target in args.target:
+        load_test.warm_up(target)
+        report["targets"][target] = load_test.run(target)
+    load_test.chatbot.appointment_manager.outbox.close()
+    report["admission"] = load_test.chatbot.get_admission_stats()
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+    failed = any(summary["errors"] for summary in report["targets"].values())
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
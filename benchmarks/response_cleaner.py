@@ -0,0 +1,128 @@
+"""
+قياس أداء منظّف الردود مقارنة بالطريقة السابقة.
+
+التشغيل من جذر المشروع:
+    python -m benchmarks.response_cleaner [--iterations 2000] [--seed 0]
+
+يقارن زمن التنظيف الكامل وزمن تنظيف رد يصل جزءًا بعد جزء (الطريقة السابقة كانت تعيد تنظيف النص كاملًا
+مع كل جزء). الاختبارات الذهبية (مطابقة الناتج للطريقة السابقة) في benchmarks/test_response_cleaner.py،
+وتستخدم المرجع والردود الثابتة أدناه.
+"""
+import argparse
+import random
+import re
+import time
+
+from prompt_engineering import PromptEngineering
+
+
+def legacy_normalize(response):
+    """نسخة من PromptEngineering.normalize_response قبل التغيير (المرجع للاختبارات الذهبية)."""
+    response = response.replace("\xa0", " ").strip()
+    response = re.sub(r'<\|.*?\|>', '', response)
+    response = response.replace("\'", "")
+    response = re.sub(r'(\n)+', '\n', response)
+    response = re.sub(r"\b(I wish you|I hope that)\b", "", response)
+    response = re.sub(r"\bI will\b", "", response)
+    response = re.sub(r'\s+', ' ', response).strip()
+    return response
+
+
+def legacy_clean(response):
+    response = legacy_normalize(response)
+    if len(response) < 10 or not response:
+        return PromptEngineering.FALLBACK_RESPONSE
+    return response
+
+
+def legacy_clean_stream(chunks):
+    """نسخة من clean_stream قبل التغيير: إعادة تنظيف النص كاملًا مع كل جزء."""
+    raw = ""
+    emitted = ""
+    for chunk in chunks:
+        raw += chunk
+        complete = raw
+        last_line = raw.rfind("\n") + 1
+        closed_end = max([m.end() for m in re.finditer(r'<\|.*?\|>', raw)] + [last_line])
+        start = raw.find("<|", closed_end)
+        if start != -1:
+            complete = raw[:start]
+        cleaned = legacy_normalize(complete)
+        safe = cleaned[:max(cleaned.rfind(" ", 0, max(0, len(cleaned) - 12)), 0)]
+        if len(safe) >= 10 and len(safe) > len(emitted) and safe.startswith(emitted):
+            yield safe[len(emitted):]
+            emitted = safe
+    final = legacy_clean(raw)
+    if final.startswith(emitted) and len(final) > len(emitted):
+        yield final[len(emitted):]
+
+
+# ردود ثابتة تغطي كل خطوة من خطوات التنظيف والحالات الحدية
+GOLDEN_RESPONSES = [
+    "",
+    "   ",
+    "Okay.",
+    "I will",
+    "I hope that helps!",
+    "It's important to acknowledge these feelings rather than fighting them.",
+    "I understand.\xa0 I wish you the best.\n\n\nTake care<|endoftext|>",
+    "<|endoftext|>Hello there, how are you feeling today?<|endoftext|>",
+    "Unclosed <|template at the end of the reply without a close",
+    "Broken <|template\nacross lines|> stays in the reply",
+    "Nested <|a <|b|> c|> templates and <|>|> and <||>",
+    "I willing to help, but I will not I will. TWILL I will",
+    "I hope thatcher is fine, I hope that you are, and I wish youth well.",
+    "I\xa0will listen.\tI\nwish you\r\nwell, I hope  that you rest.",
+    "Don't worry; you're not alone. We'll figure this out together.",
+    "I'will keep going, I' will not, 'I will' with quotes.",
+    "_I will_ and 1I will and I will2 and éI will and I willé",
+    "أنا هنا لمساعدتك. I will listen to you. كيف تشعر اليوم؟",
+    "Have you tried deep breathing? Another line　with ideographic space.",
+    "Line one\n\n\nLine two\r\rLine three \x0b\x0c end",
+    "<|user|>\nI feel sad\n<|assistant|>\nI hope that you feel better soon. Try a short walk.",
+]
+
+
+def timed(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def benchmark(iterations, seed):
+    prompts = PromptEngineering()
+    rng = random.Random(seed)
+    reply = " ".join(GOLDEN_RESPONSES[5:] * 2)
+    # رد طويل يصل على شكل توكنز (2-6 أحرف لكل جزء) كما في التوليد المتدفق
+    long_reply = " ".join(GOLDEN_RESPONSES[5:] * 8)
+    chunks = []
+    position = 0
+    while position < len(long_reply):
+        size = rng.randint(2, 6)
+        chunks.append(long_reply[position:position + size])
+        position += size
+
+    legacy_us = timed(lambda: legacy_clean(reply), iterations)
+    new_us = timed(lambda: prompts.clean_response(reply), iterations)
+    stream_iterations = max(1, iterations // 100)
+    legacy_stream_ms = timed(lambda: list(legacy_clean_stream(chunks)), stream_iterations) / 1000
+    new_stream_ms = timed(lambda: list(prompts.clean_stream(chunks)), stream_iterations) / 1000
+
+    print(f"clean_response ({len(reply)} chars): legacy {legacy_us:.1f} us, precompiled {new_us:.1f} us "
+          f"({legacy_us / new_us:.1f}x)")
+    print(f"clean_stream ({len(long_reply)} chars, {len(chunks)} chunks): legacy {legacy_stream_ms:.2f} ms, "
+          f"incremental {new_stream_ms:.2f} ms ({legacy_stream_ms / new_stream_ms:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000, help="عدد مرات التنظيف في القياس")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    benchmark(args.iterations, args.seed)
+
+
+if __name__ == "__main__":
+    main()
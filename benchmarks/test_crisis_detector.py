@@ -0,0 +1,82 @@
+"""
+اختبارات دقة كاشف عبارات الطوارئ (بدون قياس زمن).
+
+التشغيل من جذر المشروع:
+    python -m benchmarks.test_crisis_detector
+أو مع pytest:
+    python -m pytest benchmarks/test_crisis_detector.py
+
+تتحقق من أن جميع الرسائل في CRISIS_MESSAGES يتم اكتشافها وأن الرسائل في SAFE_MESSAGES لا تُكتشف
+باستخدام crisis_keywords.txt الحالي، ومن سلوك KeywordMatcher مع "*" والسوابق العربية المتصلة،
+حتى يظهر أي تغيير في KeywordMatcher أو في ملف العبارات يكسر الاكتشاف. الخروج بـ 1 عند الفشل.
+"""
+import sys
+
+from benchmarks.crisis_detector import CRISIS_MESSAGES, SAFE_MESSAGES
+from emergency_response_handler import EmergencyResponseHandler
+from keyword_matcher import KeywordMatcher
+
+
+# (العبارات، الرسائل التي يجب أن تُطابق، الرسائل التي يجب ألا تُطابق)
+PREFIX_CASES = [
+    (["suicid*"], ["suicide", "I feel SUICIDAL", "suicidality is real"], ["presuicide", "sui generis"]),
+    (["self harm*"], ["self harming again", "self harm"], ["selfish harm", "self"]),
+    (["murder*"], ["murderous thoughts", "murder"], ["premurder"]),
+    (["harm"], ["I could harm someone"], ["harmony", "pharmacy"]),
+]
+
+# السوابق العربية المتصلة (و/ف/ب/ل و "ال")؛ الرسائل الممنوعة تبدأ بأحرف ليست سوابق
+PROCLITIC_CASES = [
+    (["انتحار"], ["بالانتحار", "للانتحار", "والانتحار", "فالانتحار", "الانتحار", "وبالانتحار"],
+     ["كالانتحار", "مانتحار", "انتحاري"]),
+    (["أريد أن أموت"], ["وأريد أن أموت", "فأريد أن أموت"], ["سأريد أن أموت"]),
+    (["أقتل نفسي"], ["فأقتل نفسي", "وأقتل نفسي", "لأقتل نفسي"], ["تأقتل نفسي"]),
+]
+
+
+def _check_matcher(matcher, matching, non_matching):
+    missed = [m for m in matching if matcher.search(m) is None]
+    wrong = [(m, matcher.search(m)) for m in non_matching if matcher.search(m) is not None]
+    return missed, wrong
+
+
+def test_crisis_messages_detected():
+    matcher = EmergencyResponseHandler.matcher()
+    missed, _ = _check_matcher(matcher, CRISIS_MESSAGES, ())
+    assert not missed, f"missed crisis messages: {missed}"
+
+
+def test_safe_messages_not_detected():
+    matcher = EmergencyResponseHandler.matcher()
+    _, wrong = _check_matcher(matcher, (), SAFE_MESSAGES)
+    assert not wrong, f"false positives: {wrong}"
+
+
+def test_prefix_wildcard():
+    for phrases, matching, non_matching in PREFIX_CASES:
+        missed, wrong = _check_matcher(KeywordMatcher(phrases), matching, non_matching)
+        assert not missed and not wrong, f"{phrases}: missed {missed}, false positives {wrong}"
+
+
+def test_arabic_proclitics():
+    for phrases, matching, non_matching in PROCLITIC_CASES:
+        missed, wrong = _check_matcher(KeywordMatcher(phrases), matching, non_matching)
+        assert not missed and not wrong, f"{phrases}: missed {missed}, false positives {wrong}"
+
+
+def main():
+    tests = [test_crisis_messages_detected, test_safe_messages_not_detected, test_prefix_wildcard,
+             test_arabic_proclitics]
+    failures = 0
+    for test in tests:
+        try:
+            test()
+            print(f"ok: {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"FAILED: {test.__name__}: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
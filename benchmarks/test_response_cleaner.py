@@ -0,0 +1,99 @@
+"""
+اختبارات ذهبية لمنظّف الردود (بدون قياس زمن).
+
+التشغيل من جذر المشروع:
+    python -m benchmarks.test_response_cleaner [--fuzz 20000] [--seed 0]
+أو مع pytest:
+    python -m pytest benchmarks/test_response_cleaner.py
+
+تتحقق من أن normalize_response و clean_response ينتجان نفس النص الذي كانت تنتجه الخطوات السبع السابقة،
+ومن أن مجموع أجزاء clean_stream (أي StreamingCleaner) يساوي clean_response للنص كاملًا مهما كان تقسيم الأجزاء،
+على مجموعة ثابتة من الردود وعلى نصوص عشوائية. الخروج بـ 1 عند أي اختلاف.
+"""
+import argparse
+import random
+import sys
+
+from benchmarks.response_cleaner import GOLDEN_RESPONSES, legacy_clean, legacy_normalize
+from prompt_engineering import PromptEngineering
+
+
+# أجزاء لتوليد نصوص عشوائية قريبة من الحالات الصعبة (قوالب مقسومة، عبارات، مسافات خاصة)
+FUZZ_PIECES = [
+    "I", "I ", " I", "will", " will", "wish", " you", "you", "hope", " that", "that", "I will", "I wish you",
+    "I hope that", "<|", "|>", "<", "|", ">", "endoftext", "'", "\xa0", " ", "  ", "\n", "\n\n", "\t", "\r\n",
+    "　", ".", ",", "!", "a", "b", "Z", "_", "1", "é", "ب", "It", "s", "Hello", "feel", "better", "x",
+]
+
+
+def random_text(rng, max_pieces=40):
+    return "".join(rng.choice(FUZZ_PIECES) for _ in range(rng.randint(0, max_pieces)))
+
+
+def random_chunks(rng, text):
+    """تقسيم النص إلى أجزاء عشوائية (بما فيها أجزاء فارغة وأجزاء بحرف واحد)."""
+    chunks = []
+    position = 0
+    while position < len(text):
+        size = rng.choice([0, 1, 1, 2, 3, 5, 8, 20])
+        chunks.append(text[position:position + size])
+        position += size
+    return chunks
+
+
+def find_mismatches(texts, rng):
+    """مقارنة كل نص بالمرجع؛ تعيد قائمة (الدالة، النص، المتوقع، الناتج)."""
+    prompts = PromptEngineering()
+    mismatches = []
+    for text in texts:
+        expected = legacy_clean(text)
+        if prompts.normalize_response(text) != legacy_normalize(text):
+            mismatches.append(("normalize_response", text, legacy_normalize(text), prompts.normalize_response(text)))
+        if prompts.clean_response(text) != expected:
+            mismatches.append(("clean_response", text, expected, prompts.clean_response(text)))
+        for chunks in ([text], list(text), random_chunks(rng, text)):
+            streamed = "".join(prompts.clean_stream(chunks))
+            if streamed != expected:
+                mismatches.append(("clean_stream", chunks, expected, streamed))
+                break
+    return mismatches
+
+
+def describe(mismatches, limit=10):
+    lines = [f"{len(mismatches)} mismatches"]
+    for name, text, expected, actual in mismatches[:limit]:
+        lines.append(f"  {name}: {text!r}\n    expected: {expected!r}\n    actual:   {actual!r}")
+    return "\n".join(lines)
+
+
+def test_golden_responses():
+    mismatches = find_mismatches(GOLDEN_RESPONSES, random.Random(0))
+    assert not mismatches, describe(mismatches)
+
+
+def test_fuzz(fuzz=2000, seed=0):
+    rng = random.Random(seed)
+    mismatches = find_mismatches([random_text(rng) for _ in range(fuzz)], rng)
+    assert not mismatches, describe(mismatches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fuzz", type=int, default=20000, help="عدد النصوص العشوائية")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failures = 0
+    for name, test in [("test_golden_responses", test_golden_responses),
+                       ("test_fuzz", lambda: test_fuzz(args.fuzz, args.seed))]:
+        try:
+            test()
+            print(f"ok: {name}")
+        except AssertionError as e:
+            failures += 1
+            print(f"FAILED: {name}: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
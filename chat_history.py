@@ -0,0 +1,107 @@
+import torch
+
+
+class TokenHistory:
+    """
+    تاريخ محادثة بميزانية توكنز ثابتة.
+    يتم حجز مخزن (buffer) بحجم سياق النموذج مرة واحدة، وتُكتب التوكنز الجديدة في مكانها
+    دون إعادة نسخ التاريخ كاملًا في كل دور. المقدمة الثابتة تبقى دائمًا في بداية المخزن،
+    وعند تجاوز الميزانية يتم حذف أقدم الأدوار.
+    """
+
+    def __init__(self, prefix_ids, capacity=1024, budget=924, device="cpu"):
+        self.capacity = capacity  # الحد الأقصى لعدد التوكنز (سياق النموذج)
+        self.budget = budget  # الحد المسموح لمدخلات التوليد حتى يبقى مكان للرد
+        self.device = device
+        self._buf = torch.empty(capacity, dtype=torch.long, device=device)
+        self._prefix = None
+        self._prefix_len = 0
+        self._len = 0
+        self._turn_starts = []  # بداية كل دور داخل المخزن (بعد المقدمة)
+        self.evicted_turns = 0
+        self.set_prefix(prefix_ids)
+
+    def set_prefix(self, prefix_ids):
+        """
+        وضع المقدمة الثابتة في بداية المخزن. إذا تغيّرت المقدمة (تعديل قالب النص الموجه)
+        يتم حذف الأدوار المحفوظة لأنها بُنيت على المقدمة القديمة.
+        """
+        if prefix_ids is self._prefix:
+            return
+        prefix = prefix_ids.reshape(-1)
+        if prefix.shape[0] >= self.budget:
+            raise ValueError("The prompt prefix is longer than the history token budget.")
+        self._prefix = prefix_ids
+        self._prefix_len = prefix.shape[0]
+        self._buf[:self._prefix_len] = prefix
+        self.reset()
+
+    def reset(self):
+        """حذف جميع الأدوار مع الإبقاء على المقدمة."""
+        self._len = self._prefix_len
+        self._turn_starts = []
+
+    def start_turn(self, ids):
+        """بدء دور جديد برسالة المستخدم (يُترك بعده مكان للرد ضمن الميزانية)."""
+        self._append(ids, self.budget, new_turn=True)
+
+    def cancel_turn(self):
+        """حذف الدور الأخير (رسالة مستخدم لم يتم الرد عليها، مثلًا عند رفضها بسبب الضغط)."""
+        if self._turn_starts:
+            self._len = self._turn_starts.pop()
+
+    def append(self, ids):
+        """إضافة توكنز إلى الدور الحالي (رد المساعد)."""
+        self._append(ids, self.capacity)
+
+    def ids(self):
+        """المقدمة مع التاريخ كاملًا بشكل [1, n] (عرض view دون نسخ)."""
+        return self._buf[:self._len].unsqueeze(0)
+
+    def turn_ids(self):
+        """التاريخ بدون المقدمة الثابتة بشكل [1, n]."""
+        return self._buf[self._prefix_len:self._len].unsqueeze(0)
+
+    def num_tokens(self):
+        """عدد توكنز الأدوار المحفوظة (بدون المقدمة)."""
+        return self._len - self._prefix_len
+
+    def _append(self, ids, limit, new_turn=False):
+        ids = ids.reshape(-1).to(self.device)
+        # إذا كانت الرسالة وحدها أطول من المساحة المتاحة بعد المقدمة، نحتفظ بآخر جزء منها فقط
+        room = limit - self._prefix_len
+        if ids.shape[0] > room:
+            ids = ids[-room:]
+        if self._len + ids.shape[0] > limit:
+            self._evict(self._len + ids.shape[0] - limit, keep_current_turn=not new_turn)
+        if new_turn:
+            self._turn_starts.append(self._len)
+        self._buf[self._len:self._len + ids.shape[0]] = ids
+        self._len += ids.shape[0]
+
+    def _evict(self, needed, keep_current_turn):
+        """
+        حذف أقدم الأدوار حتى تتوفر needed توكنز على الأقل.
+        نحذف ربع الميزانية الإضافي دفعة واحدة حتى لا يتكرر نقل المخزن في كل دور.
+        """
+        target = min(needed + self.budget // 4, self._len - self._prefix_len)
+        # عند إضافة رد المساعد لا نحذف رسالة المستخدم التي يجيب عليها
+        min_turns = 1 if keep_current_turn else 0
+        removed = 0
+        cut = self._prefix_len
+        while len(self._turn_starts) > min_turns and removed < target:
+            self._turn_starts.pop(0)
+            cut = self._turn_starts[0] if self._turn_starts else self._len
+            removed = cut - self._prefix_len
+            self.evicted_turns += 1
+        if removed < needed:
+            # لا توجد أدوار كاملة كافية للحذف: نحذف من بداية الأدوار مباشرة
+            cut = self._prefix_len + min(needed, self._len - self._prefix_len)
+            self._turn_starts = sorted(set(max(start, cut) for start in self._turn_starts))
+        removed = cut - self._prefix_len
+        if removed <= 0:
+            return
+        remaining = self._buf[cut:self._len].clone()
+        self._buf[self._prefix_len:self._prefix_len + remaining.shape[0]] = remaining
+        self._len -= removed
+        self._turn_starts = [start - removed for start in self._turn_starts]
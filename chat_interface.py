@@ -1,30 +1,209 @@
+import time
+
+_import_started = time.perf_counter()
+import threading
 import gradio as gr
-from mental_health_chatbot import MentalHealthChatbot  # استيراد الفئة الجديدة
+from conversation_log import ConversationLog
+from admission import FAST_LANE_THREADS
+from emergency_response_handler import EmergencyResponseHandler
+from worker_pool import WorkerPool
+# زمن استيراد الواجهة (Gradio)؛ torch و transformers والنموذج يتم تحميلها لاحقًا في الخلفية
+IMPORT_SECONDS = time.perf_counter() - _import_started
 
 class ChatInterface:
-    def __init__(self):
-        """إعداد الفئة للمحادثة مع نموذج الذكاء الاصطناعي"""
-        self.chatbot = MentalHealthChatbot()  # إنشاء كائن من فئة MentalHealthChatbot
-        self.model, self.tokenizer = self.chatbot.model, self.chatbot.tokenizer  # تحميل النموذج والمحولات
+    # الأسئلة التجريبية المعروضة في الواجهة (وتُستخدم أيضًا لتجهيز ذاكرة الردود مسبقًا)
+    EXAMPLE_QUESTIONS = [
+        "I've been feeling really anxious lately and can't seem to shake it off.",
+        "I don't feel motivated to do anything anymore.",
+        "I feel like I'm not good enough compared to others.",
+        "I can't fall asleep because my mind won't stop racing.",
+        "I'm having problems communicating with my partner.",
+        "What are some healthy ways to deal with stress?",
+        "I feel stuck in my current situation and don't know how to change.",
+    ]
+
+    # الرد الاحتياطي عند حدوث خطأ أثناء التوليد
+    ERROR_RESPONSE = "I'm here to support you. Could you please rephrase your question?"
+
+    # الرد أثناء تحميل النموذج (قبل أن تصبح الواجهة جاهزة)
+    LOADING_RESPONSE = "I'm still getting ready. Please send your message again in a moment."
+
+    def __init__(self, enable_batching=False, max_batch_size=8, max_wait_ms=10, model_name="adanal/dialogpt-finetuned",
+                 backend="eager", num_workers=1, response_cache=False, prewarm_cache=True, background_load=True,
+                 warm_up=False, conversation_log_path=None, history_window=20, max_model_queue=None,
+                 max_queue_wait_s=30.0, session_rate=None, session_burst=5, **chatbot_kwargs):
+        """
+        إعداد الفئة للمحادثة مع نموذج الذكاء الاصطناعي.
+        background_load: تحميل النموذج في خيط بالخلفية حتى تبدأ الواجهة فورًا (مع حالة جاهزية تظهر للمستخدم).
+        warm_up: توليد رد تجريبي بعد التحميل وقبل استقبال الرسائل.
+        conversation_log_path: ملف SQLite لسجل المحادثات الدائم (معطّل افتراضيًا؛ يحفظ نص المحادثات كاملًا دون تشفير،
+        فيجب وضعه في مكان محمي، مثل "conversations.db").
+        history_window: عدد الأدوار الأخيرة المعروضة والمحفوظة في الذاكرة؛ الأقدم يُقرأ من السجل عند الطلب
+        (مع السجل فقط؛ بدونه تُعرض المحادثة كاملة).
+        max_model_queue / max_queue_wait_s: أقصى عدد من الأدوار التي تنتظر النموذج وأقصى زمن انتظار (لكل عامل)؛
+        بعدها يحصل المستخدم على رد "ضغط عالٍ" (None بدون تحكم في القبول، وهو الافتراضي).
+        session_rate / session_burst: معدل الرسائل لكل جلسة (None بدون حد، وهو الافتراضي).
+        chatbot_kwargs: إعدادات إضافية تُمرر إلى MentalHealthChatbot (مثل appointment_sink=LocalSink() للعمل دون اتصال).
+        """
+        self.started = time.perf_counter()
+        self.max_batch_size = max_batch_size
+        # عدد الرسائل التي يمكن معالجتها بالتوازي (معروف قبل تحميل النموذج، لإعداد قائمة انتظار Gradio)
+        self.concurrency = num_workers * (max_batch_size if enable_batching else 1)
+        # خيوط Gradio: أماكن النموذج + الأدوار المنتظرة + المسار السريع للردود المبنية على القواعد،
+        # حتى لا ينتظر رد الطوارئ في قائمة Gradio خلف أدوار النموذج (التحكم في القبول يحدد عمل النموذج)
+        self.gradio_concurrency = self.concurrency
+        if max_model_queue is not None or session_rate is not None:
+            self.gradio_concurrency += num_workers * (max_model_queue or 0) + FAST_LANE_THREADS
+        self.num_workers = num_workers
+        self.warm_up = warm_up
+        self.history_window = history_window
+        self.conversation_log = ConversationLog(conversation_log_path, window=history_window) if conversation_log_path else None
+        self.chatbot = None
+        self.model = self.tokenizer = None
+        self.ready = threading.Event()  # يتم تعيينه بعد تحميل النموذج (والتوليد التجريبي إن طُلب)
+        self.load_error = None
+        self.startup_timings = {"import_s": round(IMPORT_SECONDS, 3)}
+        self.chatbot_kwargs = chatbot_kwargs
+        chatbot_kwargs.update(
+            model_name=model_name,
+            enable_batching=enable_batching,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            backend=backend,
+            response_cache=response_cache,
+            max_model_queue=max_model_queue,
+            max_queue_wait_s=max_queue_wait_s,
+            session_rate=session_rate,
+            session_burst=session_burst,
+            # تجهيز ردود الأسئلة التجريبية في الخلفية عند بدء التشغيل
+            prewarm_prompts=self.EXAMPLE_QUESTIONS if response_cache and prewarm_cache else None
+        )
+        if background_load:
+            threading.Thread(target=self._load, name="chatbot-loader", daemon=True).start()
+        else:
+            self._load()
+            if self.load_error is not None:
+                raise self.load_error
 
-    def chat_interface(self, message, history):
-        """واجهة المحادثة التي تظهر رسائل المستخدم والروبوت"""
+    def _load(self):
+        """تحميل روبوت المحادثة (والتوليد التجريبي إن طُلب) مع تسجيل زمن كل مرحلة."""
         try:
-            # توليد الرد باستخدام النموذج
-            emergency_response, bot_input_ids = self.chatbot.generate_response(message, history)
-            if emergency_response:
-                history.append([message, emergency_response])
-                return history, ""
+            started = time.perf_counter()
+            from mental_health_chatbot import MentalHealthChatbot  # torch و transformers تُستورد هنا
 
-            # إضافة المحادثة إلى التاريخ
-            history.append([message, bot_input_ids])
-            return history, ""
+            self.startup_timings["chatbot_import_s"] = round(time.perf_counter() - started, 3)
+            started = time.perf_counter()
+            if self.num_workers > 1:
+                # عدة عمليات تتشارك نسخة واحدة من الأوزان، وكل جلسة تُوجَّه إلى نفس العامل دائمًا
+                self.chatbot = WorkerPool(num_workers=self.num_workers, **self.chatbot_kwargs)
+            else:
+                self.chatbot = MentalHealthChatbot(**self.chatbot_kwargs)  # إنشاء كائن من فئة MentalHealthChatbot
+            self.model, self.tokenizer = self.chatbot.model, self.chatbot.tokenizer  # تحميل النموذج والمحولات
+            self.startup_timings["model_load_s"] = round(time.perf_counter() - started, 3)
+            if self.warm_up:
+                started = time.perf_counter()
+                self.chatbot.warm_up()
+                self.startup_timings["warm_up_s"] = round(time.perf_counter() - started, 3)
+        except Exception as error:
+            self.load_error = error
+            print(f"Failed to load the chatbot: {error}")
+            return
+        self.startup_timings["ready_s"] = round(time.perf_counter() - self.started, 3)
+        print(f"Chatbot ready: {self.startup_timings}")
+        self.ready.set()
+
+    def wait_until_ready(self, timeout=None):
+        """انتظار انتهاء التحميل؛ تُرجع True عند الجاهزية (وترفع خطأ التحميل إن فشل)."""
+        while not self.ready.wait(0.1):
+            if self.load_error is not None:
+                raise self.load_error
+            if timeout is not None and time.perf_counter() - self.started > timeout:
+                return False
+        return True
+
+    def status_text(self):
+        """حالة الجاهزية المعروضة في الواجهة."""
+        if self.load_error is not None:
+            return "⚠️ The assistant failed to start. Please try again later."
+        if not self.ready.is_set():
+            return "⏳ The assistant is starting up..."
+        return f"✅ Ready (started in {self.startup_timings['ready_s']:.1f}s)"
+
+    def _poll_status(self):
+        """حالة الجاهزية للمؤقت، مع إيقافه بعد انتهاء التحميل (بنجاح أو بفشل)."""
+        loading = self.load_error is None and not self.ready.is_set()
+        return self.status_text(), gr.Timer(active=loading)
+
+    @staticmethod
+    def _session_id(request):
+        """استخراج معرّف الجلسة من طلب Gradio حتى تكون لكل مستخدم حالة محادثة مستقلة"""
+        if request is not None and getattr(request, "session_hash", None):
+            return request.session_hash
+        return "default"
+
+    @classmethod
+    def _conversation_id(cls, request):
+        """
+        معرّف المحادثة في السجل: اسم المستخدم عند تفعيل تسجيل الدخول (ثابت بعد إعادة تحميل الصفحة أو إعادة التشغيل
+        فيمكن استئناف المحادثة)، وإلا معرّف الجلسة.
+        """
+        username = getattr(request, "username", None) if request is not None else None
+        return f"user:{username}" if username else cls._session_id(request)
+
+    def _log_turn(self, request, message, response):
+        """تسجيل الدور في السجل الدائم (دون انتظار القرص)، مع تعليم أدوار الطوارئ للمراجعة."""
+        if self.conversation_log is None:
+            return
+        crisis = EmergencyResponseHandler.matcher().search(message) is not None
+        self.conversation_log.append(self._conversation_id(request), message, response, crisis=crisis)
+
+    def resume_session(self, request: gr.Request = None):
+        """استعادة آخر أدوار المحادثة من السجل عند فتح الصفحة."""
+        if self.conversation_log is None:
+            return []
+        return [list(turn) for turn in self.conversation_log.recent(self._conversation_id(request))]
+
+    def load_earlier(self, history, request: gr.Request = None):
+        """إضافة الأدوار الأقدم من المعروضة حاليًا (تُقرأ من السجل على القرص عند الطلب فقط)."""
+        if self.conversation_log is None:
+            return history
+        older = self.conversation_log.older(self._conversation_id(request), len(history), self.history_window or 20)
+        return [list(turn) for turn in older] + history
+
+    def chat_interface(self, message, history, request: gr.Request = None):
+        """واجهة المحادثة التي تظهر رسائل المستخدم والروبوت (يتم عرض الرد تدريجيًا أثناء توليده)"""
+        # إضافة رسالة المستخدم إلى التاريخ مع رد فارغ يتم ملؤه أثناء التوليد
+        history.append([message, ""])
+        # مع السجل الدائم: عرض آخر history_window أدوار فقط؛ الأقدم محفوظ في السجل ويمكن عرضه
+        # بزر "Load earlier messages". بدون السجل تبقى المحادثة كاملة لأن الأدوار المحذوفة لا يمكن استعادتها
+        if self.conversation_log is not None and self.history_window and len(history) > self.history_window:
+            del history[:-self.history_window]
+        if not self.ready.is_set():
+            # النموذج ما زال قيد التحميل (أو فشل تحميله)
+            history[-1][1] = self.ERROR_RESPONSE if self.load_error is not None else self.LOADING_RESPONSE
+            self._log_turn(request, message, history[-1][1])
+            yield history, ""
+            return
+        try:
+            for chunk in self.chatbot.generate_response_stream(message, session_id=self._session_id(request)):
+                history[-1][1] += chunk
+                yield history, ""
 
         except Exception as e:
             # التعامل مع الأخطاء وتقديم رد احتياطي
-            error_response = "I'm here to support you. Could you please rephrase your question?"
-            history.append([message, error_response])
-            return history, ""
+            history[-1][1] = self.ERROR_RESPONSE
+            yield history, ""
+        finally:
+            # يتم التسجيل أيضًا إذا توقف المستخدم قبل اكتمال الرد (بالجزء الذي ظهر له)
+            self._log_turn(request, message, history[-1][1])
+
+    def clear_session(self, request: gr.Request = None):
+        """مسح المحادثة وحذف حالة الجلسة الخاصة بالمستخدم"""
+        if self.ready.is_set():
+            self.chatbot.end_session(self._session_id(request))
+        if self.conversation_log is not None:
+            self.conversation_log.end(self._conversation_id(request))
+        return [], ""
 
     def launch_interface(self):
         """إطلاق واجهة Gradio للمستخدمين للتفاعل مع نموذج المحادثة"""
@@ -69,6 +248,14 @@ class ChatInterface:
             </div>
             """)
 
+            # حالة الجاهزية (يتم تحديثها حتى ينتهي تحميل النموذج في الخلفية)
+            status = gr.Markdown(self.status_text())
+            if hasattr(gr, "Timer"):
+                timer = gr.Timer(2)
+                timer.tick(self._poll_status, None, [status, timer])
+            else:
+                demo.load(self.status_text, None, status, every=2)
+
             with gr.Row():
                 with gr.Column():
                     chatbot_interface = gr.Chatbot(
@@ -95,19 +282,14 @@ class ChatInterface:
                 with gr.Column(scale=1, min_width=100):
                     send_btn = gr.Button("Send", elem_classes="send-btn", size="lg")
                     clear = gr.Button("Clear", variant="secondary", elem_classes="clear-btn")
+                    earlier = None
+                    if self.conversation_log is not None:
+                        earlier = gr.Button("Load earlier messages", variant="secondary", size="sm")
 
             # إعداد الأسئلة التجريبية
             with gr.Row():
                 gr.Examples(
-                    examples=[
-                        ["I've been feeling really anxious lately and can't seem to shake it off."],
-                        ["I don't feel motivated to do anything anymore."],
-                        ["I feel like I'm not good enough compared to others."],
-                        ["I can't fall asleep because my mind won't stop racing."],
-                        ["I'm having problems communicating with my partner."],
-                        ["What are some healthy ways to deal with stress?"],
-                        ["I feel stuck in my current situation and don't know how to change."],
-                    ],
+                    examples=[[question] for question in self.EXAMPLE_QUESTIONS],
                     inputs=msg,
                     label="💡 Try these example questions:"
                 )
@@ -115,7 +297,16 @@ class ChatInterface:
             # ربط الأحداث للزر Send وإرسال الرسائل باستخدام Enter
             msg.submit(self.chat_interface, [msg, chatbot_interface], [chatbot_interface, msg])
             send_btn.click(self.chat_interface, [msg, chatbot_interface], [chatbot_interface, msg])
-            clear.click(lambda: ([], ""), None, [chatbot_interface, msg], queue=False)
+            clear.click(self.clear_session, None, [chatbot_interface, msg], queue=False)
+            if earlier is not None:
+                earlier.click(self.load_earlier, [chatbot_interface], chatbot_interface, queue=False)
+                # استئناف المحادثة المحفوظة عند فتح الصفحة
+                demo.load(self.resume_session, None, chatbot_interface)
+
+            # السماح بمعالجة عدة رسائل بالتوازي: مُجدول الدفعات أو العمليات تجمعها، والردود المبنية على القواعد
+            # لا تنتظر خلف أدوار النموذج
+            if self.gradio_concurrency > 1:
+                demo.queue(default_concurrency_limit=self.gradio_concurrency)
 
             # إطلاق الواجهة
             demo.launch(
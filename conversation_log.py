@@ -0,0 +1,221 @@
+import argparse
+import atexit
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class ConversationLog:
+    """
+    سجل دائم للمحادثات بالإضافة فقط (append-only) في SQLite بوضع WAL.
+    الكتابة لا تتم في مسار الرد: كل دور يوضع في قائمة انتظار، وخيط في الخلفية يكتب الأدوار على دفعات
+    في معاملة واحدة. في الذاكرة نحتفظ فقط بآخر window أدوار لعدد محدود من الجلسات (الأقدم استخدامًا يُحذف)،
+    والأدوار الأقدم تُقرأ من القرص عند الطلب (استئناف المحادثة أو عرض الرسائل السابقة أو المراجعة).
+    الأدوار التي تحتوي على كلمات الطوارئ تُعلَّم (crisis) حتى يمكن مراجعتها بسرعة.
+    """
+
+    TURN = "turn"
+    END = "end"  # علامة مسح المحادثة: الاستئناف يبدأ بعدها، والأدوار السابقة تبقى للمراجعة
+
+    def __init__(self, path="conversations.db", window=20, max_sessions=1000, batch_size=100, flush_interval=0.5,
+                 max_pending=10000):
+        self.path = path
+        self.window = window  # عدد الأدوار الأخيرة المحفوظة في الذاكرة لكل جلسة
+        self.max_sessions = max_sessions
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # أقصى انتظار لتجميع دفعة قبل الكتابة
+        self.dropped = 0  # أدوار لم تُسجَّل لأن قائمة الانتظار ممتلئة
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)  # للكتابة (خيط الخلفية فقط)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " session_id TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " kind TEXT NOT NULL DEFAULT 'turn',"
+            " user_message TEXT NOT NULL DEFAULT '',"
+            " response TEXT NOT NULL DEFAULT '',"
+            " crisis INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS turns_crisis ON turns (created) WHERE crisis = 1")
+        self._conn.commit()
+        # اتصال منفصل للقراءة: مع WAL لا تنتظر القراءة انتهاء الكتابة
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._read_lock = threading.Lock()
+
+        self._recent = OrderedDict()  # الجلسة -> deque لآخر الأدوار (user, response)، مرتبة من الأقدم استخدامًا
+        self._recent_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._writer = threading.Thread(target=self._run, name="conversation-log", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def append(self, session_id, user_message, response, crisis=False):
+        """تسجيل دور دون انتظار القرص (يُكتب لاحقًا على دفعة)."""
+        with self._recent_lock:
+            # الجلسة غير الموجودة في الذاكرة تُقرأ من القرص عند الطلب (recent)، فلا نبدأ لها نافذة ناقصة
+            turns = self._recent.get(session_id)
+            if turns is not None:
+                turns.append((user_message, response))
+                self._recent.move_to_end(session_id)
+        self._put((session_id, time.time(), self.TURN, user_message, response, int(crisis)))
+
+    def end(self, session_id):
+        """تسجيل مسح المحادثة: لا تُستعاد الأدوار السابقة عند الاستئناف."""
+        with self._recent_lock:
+            self._recent.pop(session_id, None)
+        self._put((session_id, time.time(), self.END, "", "", 0))
+
+    def _put(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # لا ننتظر القرص في مسار الرد: الدور لا يُسجَّل إذا تأخر القرص كثيرًا
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                print(f"Conversation log is falling behind; {self.dropped} turns were not recorded.")
+
+    def _remember(self, session_id, turns):
+        """وضع آخر الأدوار في الذاكرة مع حذف الجلسات الأقدم استخدامًا عند تجاوز الحد."""
+        self._recent[session_id] = deque(turns, maxlen=self.window)
+        self._recent.move_to_end(session_id)
+        while len(self._recent) > self.max_sessions:
+            self._recent.popitem(last=False)
+
+    def recent(self, session_id):
+        """
+        آخر الأدوار منذ آخر مسح للمحادثة (للاستئناف): من الذاكرة إن وُجدت، وإلا من القرص (ثم تُحفظ في الذاكرة).
+        """
+        with self._recent_lock:
+            turns = self._recent.get(session_id)
+            if turns is not None:
+                self._recent.move_to_end(session_id)
+                return list(turns)
+        turns = self.older(session_id, 0, self.window)
+        with self._recent_lock:
+            if session_id not in self._recent:
+                self._remember(session_id, turns)
+        return turns
+
+    def older(self, session_id, skip, limit=20):
+        """
+        أدوار أقدم منذ آخر مسح للمحادثة بترتيبها الزمني: تتخطى آخر skip أدوار (المعروضة حاليًا) وتُرجع limit قبلها.
+        """
+        self.flush()
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT user_message, response FROM turns"
+                " WHERE session_id = ? AND kind = 'turn' AND id > COALESCE("
+                "  (SELECT MAX(id) FROM turns WHERE session_id = ? AND kind = 'end'), 0)"
+                " ORDER BY id DESC LIMIT ? OFFSET ?",
+                (session_id, session_id, limit, skip),
+            ).fetchall()
+        return [tuple(row) for row in reversed(rows)]
+
+    def session(self, session_id):
+        """جميع سجلات الجلسة (بما فيها ما قبل المسح) للمراجعة."""
+        self.flush()
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT id, created, kind, user_message, response, crisis FROM turns WHERE session_id = ? ORDER BY id",
+                (session_id,),
+            ).fetchall()
+        return [dict(zip(("id", "created", "kind", "user_message", "response", "crisis"), row)) for row in rows]
+
+    def crisis_sessions(self, since=0.0, limit=100):
+        """الجلسات التي تحتوي على أدوار طوارئ منذ since: (الجلسة، عدد أدوار الطوارئ، أول وقت، آخر وقت)."""
+        self.flush()
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT session_id, COUNT(*), MIN(created), MAX(created) FROM turns"
+                " WHERE crisis = 1 AND created >= ? GROUP BY session_id ORDER BY MAX(created) DESC LIMIT ?",
+                (since, limit),
+            ).fetchall()
+        return [dict(zip(("session_id", "crisis_turns", "first", "last"), row)) for row in rows]
+
+    def pending_count(self):
+        """عدد السجلات التي لم تُكتب بعد."""
+        return self._queue.qsize()
+
+    def flush(self):
+        """انتظار كتابة جميع السجلات الموجودة في قائمة الانتظار (للقراءة والمراجعة، وليس في مسار الرد)."""
+        if self._writer.is_alive():
+            self._queue.join()
+
+    def _collect_batch(self):
+        """انتظار أول سجل ثم تجميع ما يصل بعده حتى امتلاء الدفعة أو انتهاء المهلة."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            records = [record for record in batch if record is not None]
+            try:
+                if records:
+                    with self._conn:
+                        self._conn.executemany(
+                            "INSERT INTO turns (session_id, created, kind, user_message, response, crisis)"
+                            " VALUES (?, ?, ?, ?, ?, ?)",
+                            records,
+                        )
+            except Exception as error:
+                print(f"An error occurred while writing the conversation log: {error}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if len(records) < len(batch):
+                return
+
+    def close(self):
+        """كتابة السجلات المتبقية وإغلاق قاعدة البيانات."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        with self._read_lock:
+            self._reader.close()
+        self._conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Review logged conversations.")
+    parser.add_argument("--db", default="conversations.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+    crisis = commands.add_parser("crisis", help="List sessions with crisis turns, most recent first.")
+    crisis.add_argument("--hours", type=float, default=None, help="Only the last N hours")
+    crisis.add_argument("--limit", type=int, default=100)
+    show = commands.add_parser("show", help="Print every record of one session.")
+    show.add_argument("session_id")
+    args = parser.parse_args(argv)
+
+    log = ConversationLog(args.db)
+    try:
+        if args.command == "crisis":
+            since = time.time() - args.hours * 3600 if args.hours else 0.0
+            result = log.crisis_sessions(since, args.limit)
+        else:
+            result = log.session(args.session_id)
+    finally:
+        log.close()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
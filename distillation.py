@@ -0,0 +1,145 @@
+import argparse
+import gc
+import json
+import os
+import sys
+
+from transformers import AutoTokenizer
+
+from evaluation import GENERATION_KWARGS, Evaluator, load_eval_conversations, load_messages
+from fine_tuning_trainer import FineTuningTrainer
+from inference_backend import BACKENDS
+
+
+def weights_mb(model_name):
+    """حجم الأوزان على القرص (للنماذج المحلية فقط)."""
+    if not os.path.isdir(model_name):
+        return None
+    names = [name for name in os.listdir(model_name) if name.endswith((".safetensors", ".bin"))]
+    return round(sum(os.path.getsize(os.path.join(model_name, name)) for name in names) / 2**20, 1)
+
+
+def evaluate(model_name, sequences, messages, args):
+    """perplexity على نفس أمثلة الاختبار، ثم سرعة التوليد وطول الردود ونسبة الرد الاحتياطي على نفس الرسائل."""
+    evaluator = Evaluator(model_name, args.backend, threads_per_worker=args.threads)
+    try:
+        generation_kwargs = dict(max_new_tokens=args.max_new_tokens)
+        if args.greedy:
+            generation_kwargs["do_sample"] = False
+        return {
+            "model": model_name,
+            "weights_mb": weights_mb(model_name),
+            "startup_s": round(evaluator.startup_seconds, 2),
+            "perplexity": evaluator.perplexity(sequences, args.eval_batch_size) if sequences else None,
+            "generation": evaluator.generation(messages, args.generation_batch_size, args.seed, args.samples,
+                                               **generation_kwargs),
+        }
+    finally:
+        evaluator.close()
+        gc.collect()
+
+
+def compare(teacher, student):
+    """نسب الطالب إلى المعلم: السرعة والحجم و perplexity ونسبة الرد الاحتياطي."""
+    def ratio(new, old):
+        return round(new / old, 3) if new is not None and old else None
+
+    teacher_perplexity = (teacher["perplexity"] or {}).get("perplexity")
+    student_perplexity = (student["perplexity"] or {}).get("perplexity")
+    return {
+        "generation_speedup": ratio(student["generation"]["tokens_per_s"], teacher["generation"]["tokens_per_s"]),
+        "scoring_speedup": ratio((student["perplexity"] or {}).get("tokens_per_s"),
+                                 (teacher["perplexity"] or {}).get("tokens_per_s")),
+        "weights_ratio": ratio(student["weights_mb"], teacher["weights_mb"]),
+        "startup_ratio": ratio(student["startup_s"], teacher["startup_s"]),
+        "perplexity_ratio": ratio(student_perplexity, teacher_perplexity),
+        "fallback_rate_delta": round(student["generation"]["fallback_rate"] - teacher["generation"]["fallback_rate"], 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Distill the fine-tuned model into a smaller student (KL on cached teacher logits + LM loss), "
+                    "then compare teacher and student latency and quality in a JSON report.")
+    parser.add_argument("--teacher", default="./dialogpt-finetuned")
+    parser.add_argument("--student", default="microsoft/DialoGPT-small")
+    parser.add_argument("--student-config", default=None,
+                        help='JSON config overrides for a narrower student, e.g. \'{"n_layer": 6}\'')
+    parser.add_argument("--output-dir", default="./dialogpt-distilled")
+    parser.add_argument("--alpha", type=float, default=0.5, help="Weight of the KL term (1 - alpha for the LM loss)")
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--top-k", type=int, default=32, help="Teacher tokens cached per position")
+    parser.add_argument("--max-length", type=int, default=250)
+    parser.add_argument("--max-steps", type=int, default=None)
+    parser.add_argument("--cache-dir", default="./tokenized_cache")
+    parser.add_argument("--skip-training", action="store_true", help="Only compare an already distilled student")
+    parser.add_argument("--backend", choices=BACKENDS, default="eager")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--eval-file", default=None,
+                        help="JSON/JSONL/CSV with Context and Response (defaults to the training eval split)")
+    parser.add_argument("--eval-limit", type=int, default=None, help="Score only the first N eval conversations (0 skips)")
+    parser.add_argument("--eval-batch-size", type=int, default=16)
+    parser.add_argument("--prompts", default=None, help="Text file with one message per line, or JSONL with 'message'")
+    parser.add_argument("--generation-batch-size", type=int, default=1, help="1 measures single-request latency")
+    parser.add_argument("--max-new-tokens", type=int, default=GENERATION_KWARGS["max_new_tokens"])
+    parser.add_argument("--greedy", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=3)
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    parser.add_argument("--max-perplexity-ratio", type=float, default=None,
+                        help="Fail if the student's perplexity exceeds the teacher's by more than this ratio")
+    args = parser.parse_args(argv)
+
+    training = None
+    if not args.skip_training:
+        trainer = FineTuningTrainer(
+            model_name=args.student,
+            max_length=args.max_length,
+            cache_dir=args.cache_dir,
+            max_steps=args.max_steps,
+            output_dir=args.output_dir,
+            teacher_name=args.teacher,
+            distill_alpha=args.alpha,
+            distill_temperature=args.temperature,
+            distill_top_k=args.top_k,
+            student_config=json.loads(args.student_config) if args.student_config else None,
+        )
+        train_dataset, eval_dataset = trainer.load_and_split_data()
+        trainer.train_model(train_dataset, eval_dataset)
+        training = trainer.throughput.summary()
+        del trainer
+        gc.collect()
+
+    # نفس أمثلة الاختبار ونفس الرسائل للنموذجين (المحوّل نفسه في المعلم والطالب)
+    sequences = None
+    if args.eval_limit != 0:
+        tokenizer = AutoTokenizer.from_pretrained(args.output_dir)
+        sequences = load_eval_conversations(tokenizer, args.eval_file, args.eval_limit, args.max_length)
+    messages = load_messages(args.prompts)
+    teacher = evaluate(args.teacher, sequences, messages, args)
+    student = evaluate(args.output_dir, sequences, messages, args)
+    report = {
+        "teacher": teacher,
+        "student": student,
+        "training": training,
+        "student_vs_teacher": compare(teacher, student),
+        "model_name": args.output_dir,
+    }
+    ratio = report["student_vs_teacher"]["perplexity_ratio"]
+    report["failures"] = []
+    if args.max_perplexity_ratio is not None and ratio is not None and ratio > args.max_perplexity_ratio:
+        report["failures"].append(f"perplexity ratio {ratio} > {args.max_perplexity_ratio}")
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    for failure in report["failures"]:
+        print(f"Distillation gate failed: {failure}")
+    if not report["failures"]:
+        print(f"Use MentalHealthChatbot(model_name={args.output_dir!r}) to serve the distilled model.")
+    return 1 if report["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,59 @@
+import os
+from keyword_matcher import KeywordMatcher
 
 
 class EmergencyResponseHandler:
     # قائمة الكلمات المفتاحية التي تشير إلى حالات الطوارئ مثل التفكير في الانتحار أو الأذى.
     crisis_keywords = ["Suicide", "Hurt myself", "Kill myself", "Harm", "Murder", "I don't want to live"]
 
+    # ملف العبارات الإضافية (عدة لغات) الذي يتم تحميله مع الكلمات المفتاحية
+    crisis_keywords_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "crisis_keywords.txt")
+
+    # آلة المطابقة المبنية مرة واحدة لجميع الكلمات والعبارات
+    _matcher = None
+
+    @classmethod
+    def load_keywords(cls, path=None):
+        """
+        بناء آلة المطابقة من الكلمات المفتاحية ومن ملف العبارات (txt أو json).
+        يمكن استدعاؤها مرة أخرى بملف مختلف لاستبدال القائمة أثناء التشغيل.
+        """
+        path = path or cls.crisis_keywords_file
+        if os.path.exists(path):
+            cls._matcher = KeywordMatcher.from_file(path, extra=cls.crisis_keywords)
+        else:
+            cls._matcher = KeywordMatcher(cls.crisis_keywords)
+        return cls._matcher
+
+    @classmethod
+    def matcher(cls):
+        """إرجاع آلة المطابقة، وبناؤها عند أول استخدام."""
+        if cls._matcher is None:
+            cls.load_keywords()
+        return cls._matcher
+
 
     @staticmethod
-    def check_and_respond(user_input, experts_db):
+    def check_and_respond(user_input, experts_db, locations=None):
         """
         دالة ثابتة للتحقق مما إذا كان الإدخال يحتوي على كلمات تشير إلى حالة طارئة.
         إذا تم العثور على كلمة من قائمة الكلمات الطارئة، يتم إرجاع رد طارئ مع معلومات حول المتخصصين.
         """
-        t = user_input.replace(" ", "")  # إزالة الفراغات من الإدخال لزيادة دقة البحث
-        if any(k in t for k in EmergencyResponseHandler.crisis_keywords):
+        # مطابقة جميع العبارات في مرور واحد على النص بعد توحيد حالة الأحرف والمسافات
+        if EmergencyResponseHandler.matcher().search(user_input) is not None:
             # إذا كان الإدخال يحتوي على أي كلمة من الكلمات الطارئة، يتم استدعاء دالة الرد الطارئ.
-            return EmergencyResponseHandler.emergency_reply(experts_db)
+            return EmergencyResponseHandler.emergency_reply(experts_db, locations)
         return None  # إذا لم يتم العثور على كلمات طارئة، يتم إرجاع None
 
 
     @staticmethod
-    def emergency_reply(experts_db):
+    def emergency_reply(experts_db, locations=None):
         """
         دالة ثابتة تقوم بإنشاء رد طارئ يحتوي على قائمة بأماكن المتخصصين المتاحة.
+        يمكن تمرير locations المحسوبة مسبقًا لتجنب المرور على قاعدة البيانات كاملة.
         """
-        locations = set(expert["location"] for expert in experts_db)  # استخراج جميع المواقع من قاعدة بيانات الخبراء
+        if locations is None:
+            locations = set(expert["location"] for expert in experts_db)  # استخراج جميع المواقع من قاعدة بيانات الخبراء
         emergency_message = (
             "I'm really sorry you're feeling this way. Your safety is important.\n"
             "I'm here to provide information, but I can't offer therapy.\n"
@@ -0,0 +1,327 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import torch
+from transformers import AutoTokenizer
+
+from fine_tuning_trainer import DATASET_NAME, DynamicPaddingCollator, FineTuningTrainer
+from inference_backend import BACKENDS, SAMPLE_MESSAGES, backend_path, load_model, save_shared_weights
+from metrics import peak_rss_mb
+from prompt_engineering import PromptEngineering
+
+
+# نفس إعدادات التوليد في MentalHealthChatbot
+GENERATION_KWARGS = dict(max_new_tokens=100, temperature=0.7, do_sample=True, top_p=0.9, top_k=50)
+
+# حالة العملية الحالية (في كل عامل من عمليات التقييم): النموذج والمحوّل وأداة بناء النص الموجه
+_state = {}
+
+
+def _init_worker(model_path, backend, tokenizer_path, shared_weights, threads, ready):
+    """تحميل النموذج مرة واحدة في العملية، ثم انتظار بقية العمليات (أو إلغاء الانتظار إذا فشل التحميل)."""
+    try:
+        if threads:
+            torch.set_num_threads(threads)
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+        tokenizer.pad_token = tokenizer.eos_token
+        _state.update(
+            model=load_model(model_path, backend, shared_weights=shared_weights),
+            tokenizer=tokenizer,
+            prompt_engineering=PromptEngineering(),
+        )
+    except Exception as error:
+        print(f"Evaluation worker failed to load the model: {error!r}")
+        if ready is not None:
+            ready.abort()
+        raise
+    if ready is not None:
+        ready.wait()
+
+
+def _score_batch(sequences):
+    """مجموع الخسارة (negative log-likelihood) وعدد التوكنز المتوقعة لدفعة من المحادثات المحولة إلى توكنز."""
+    started = time.perf_counter()
+    tokenizer = _state["tokenizer"]
+    batch = DynamicPaddingCollator(tokenizer)([{"input_ids": ids} for ids in sequences])
+    with torch.no_grad():
+        logits = _state["model"](input_ids=batch["input_ids"], attention_mask=batch["attention_mask"]).logits
+    # توقع التوكن التالي: logits للموضع i مقابل labels للموضع i + 1 (الحشو = -100 لا يدخل في الحساب)
+    labels = batch["labels"][:, 1:]
+    nll = torch.nn.functional.cross_entropy(
+        logits[:, :-1].float().reshape(-1, logits.shape[-1]), labels.reshape(-1), ignore_index=-100, reduction="sum")
+    return {
+        "nll": float(nll),
+        "tokens": int((labels != -100).sum()),
+        "seconds": time.perf_counter() - started,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _generate_batch(seed, messages, generation_kwargs):
+    """توليد الردود لدفعة من الرسائل (حشو من اليسار) وتنظيفها كما في المحادثة."""
+    started = time.perf_counter()
+    tokenizer = _state["tokenizer"]
+    prompt_engineering = _state["prompt_engineering"]
+    sequences = [tokenizer.encode(prompt_engineering.prepare_prompt(message) + tokenizer.eos_token) for message in messages]
+    length = max(len(ids) for ids in sequences)
+    input_ids = torch.full((len(sequences), length), tokenizer.pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(sequences), length), dtype=torch.long)
+    for i, ids in enumerate(sequences):
+        input_ids[i, length - len(ids):] = torch.as_tensor(ids, dtype=torch.long)
+        attention_mask[i, length - len(ids):] = 1
+
+    # بذرة لكل دفعة حتى تكون النتائج نفسها مهما كان عدد العمليات
+    torch.manual_seed(seed)
+    with torch.no_grad():
+        outputs = _state["model"].generate(input_ids, attention_mask=attention_mask,
+                                           pad_token_id=tokenizer.eos_token_id, **generation_kwargs)
+    results = []
+    for message, tokens in zip(messages, outputs[:, length:]):
+        # قص الحشو الذي يضيفه generate بعد أول eos للتسلسلات التي انتهت مبكرًا
+        eos_positions = (tokens == tokenizer.eos_token_id).nonzero()
+        if eos_positions.numel():
+            tokens = tokens[:eos_positions[0].item() + 1]
+        response = prompt_engineering.clean_response(tokenizer.decode(tokens, skip_special_tokens=False))
+        results.append({
+            "message": message,
+            "response": response,
+            "new_tokens": tokens.shape[0],
+            "words": len(response.split()),
+            "fallback": response == PromptEngineering.FALLBACK_RESPONSE,
+        })
+    return {"results": results, "seconds": time.perf_counter() - started, "peak_rss_mb": peak_rss_mb()}
+
+
+def length_stats(values):
+    """المتوسط و p50 و p90 والحد الأقصى (أقرب رتبة)."""
+    if not values:
+        return {"mean": None, "p50": None, "p90": None, "max": None}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+    return {"mean": round(sum(ordered) / len(ordered), 1), "p50": pick(0.5), "p90": pick(0.9), "max": ordered[-1]}
+
+
+def load_messages(path=None):
+    """رسائل المستخدم للتوليد: ملف نصي (رسالة في كل سطر) أو JSONL بحقل message، أو الرسائل النموذجية."""
+    if not path:
+        return list(SAMPLE_MESSAGES)
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if path.endswith(".jsonl"):
+        return [json.loads(line)["message"] for line in lines]
+    return lines
+
+
+def load_eval_conversations(tokenizer, eval_file=None, limit=None, max_length=250):
+    """
+    محادثات الاختبار محولة إلى توكنز بنفس صيغة التدريب (Context + eos + Response + eos، بحد max_length).
+    افتراضيًا نفس قسم الاختبار الذي يستخدمه FineTuningTrainer، أو ملف JSON/JSONL/CSV بحقلي Context و Response.
+    """
+    from datasets import load_dataset
+
+    if eval_file:
+        dataset = load_dataset("csv" if eval_file.endswith(".csv") else "json", data_files=eval_file)["train"]
+    else:
+        _, dataset = FineTuningTrainer.split_dataset(load_dataset(DATASET_NAME)["train"])
+    if limit is not None:
+        dataset = dataset.select(range(min(limit, len(dataset))))
+    eos = tokenizer.eos_token
+    texts = [context + eos + response + eos for context, response in zip(dataset["Context"], dataset["Response"])]
+    return tokenizer(texts, truncation=True, max_length=max_length)["input_ids"] if texts else []
+
+
+class Evaluator:
+    """
+    تقييم نقطة محفوظة (checkpoint) خارج المحادثة: perplexity على محادثات الاختبار، وتوليد الردود لملف رسائل
+    مع إحصائيات طول الرد ونسبة الرد الاحتياطي بعد clean_response وسرعة التوليد.
+    العمل يُقسم إلى دفعات كبيرة محشوة (مرتبة حسب الطول لتقليل الحشو) وتوزع على عدة عمليات،
+    كل عملية بنسخة من النموذج (أوزان مشتركة عبر mmap لـ eager و int8) وعدد محدد من خيوط torch.
+    """
+
+    def __init__(self, model_name, backend="eager", workers=1, threads_per_worker=None, onnx_dir=None,
+                 shared_weights_dir="./shared_weights", start_timeout=600):
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = max(1, workers)
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+        self.threads_per_worker = threads_per_worker or max(1, cores // self.workers)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        started = time.perf_counter()
+        model_path = backend_path(model_name, backend, onnx_dir)
+        self._pool = None
+        if self.workers == 1:
+            _init_worker(model_path, backend, model_name, None, self.threads_per_worker, None)
+        else:
+            shared_weights = save_shared_weights(model_name, shared_weights_dir) if backend in ("eager", "int8") else None
+            # spawn بدلًا من fork: لا يتم نسخ خيوط torch من العملية الرئيسية
+            context = multiprocessing.get_context("spawn")
+            ready = context.Barrier(self.workers + 1)
+            self._pool = context.Pool(self.workers, initializer=_init_worker,
+                                      initargs=(model_path, backend, model_name, shared_weights,
+                                                self.threads_per_worker, ready))
+            try:
+                ready.wait(timeout=start_timeout)
+            except threading.BrokenBarrierError:
+                self.close()
+                raise RuntimeError("Evaluation workers failed to load the model.")
+        self.startup_seconds = time.perf_counter() - started
+
+    def _map(self, fn, tasks):
+        """تنفيذ المهام بالترتيب في هذه العملية أو موزعة على العمليات."""
+        if self._pool is None:
+            return [fn(*task) for task in tasks]
+        return self._pool.starmap(fn, tasks, chunksize=1)
+
+    def perplexity(self, sequences, batch_size=16):
+        """perplexity = exp(مجموع الخسارة / عدد التوكنز) على جميع المحادثات (وليس متوسط الدفعات)."""
+        ordered = sorted(sequences, key=len)
+        tasks = [(ordered[i:i + batch_size],) for i in range(0, len(ordered), batch_size)]
+        started = time.perf_counter()
+        results = self._map(_score_batch, tasks)
+        elapsed = time.perf_counter() - started
+        nll = sum(r["nll"] for r in results)
+        tokens = sum(r["tokens"] for r in results)
+        return {
+            "examples": len(sequences),
+            "tokens": tokens,
+            "loss": round(nll / tokens, 4) if tokens else None,
+            "perplexity": round(math.exp(nll / tokens), 3) if tokens else None,
+            "seconds": round(elapsed, 2),
+            "tokens_per_s": round(tokens / elapsed, 1) if elapsed else None,
+            "peak_rss_mb": max((r["peak_rss_mb"] or 0 for r in results), default=None),
+        }
+
+    def generation(self, messages, batch_size=8, seed=0, samples=5, **generation_kwargs):
+        """توليد رد لكل رسالة وتلخيص طول الردود ونسبة الرد الاحتياطي والسرعة."""
+        generation_kwargs = dict(GENERATION_KWARGS, **generation_kwargs)
+        # ترتيب الرسائل حسب الطول حتى تكون الرسائل المتقاربة في نفس الدفعة (حشو أقل)
+        ordered = sorted(messages, key=len)
+        tasks = [(seed + i, ordered[start:start + batch_size], generation_kwargs)
+                 for i, start in enumerate(range(0, len(ordered), batch_size))]
+        started = time.perf_counter()
+        batches = self._map(_generate_batch, tasks)
+        elapsed = time.perf_counter() - started
+        results = [result for batch in batches for result in batch["results"]]
+        new_tokens = sum(r["new_tokens"] for r in results)
+        return {
+            "prompts": len(results),
+            "batch_size": batch_size,
+            "do_sample": generation_kwargs.get("do_sample", False),
+            "new_tokens": new_tokens,
+            "seconds": round(elapsed, 2),
+            "tokens_per_s": round(new_tokens / elapsed, 1) if elapsed else None,
+            "prompts_per_s": round(len(results) / elapsed, 2) if elapsed else None,
+            "response_tokens": length_stats([r["new_tokens"] for r in results]),
+            "response_words": length_stats([r["words"] for r in results]),
+            "fallback_rate": round(sum(r["fallback"] for r in results) / len(results), 3) if results else None,
+            "peak_rss_mb": max((b["peak_rss_mb"] or 0 for b in batches), default=None),
+            "samples": [{"message": r["message"], "response": r["response"]} for r in results[:samples]],
+        }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+def check_gates(report, max_perplexity=None, max_fallback_rate=None, baseline=None, tolerance=0.05):
+    """
+    شروط قبول النقطة المحفوظة: حدود مطلقة للـ perplexity ونسبة الرد الاحتياطي،
+    ومقارنة بتقرير سابق (تراجع إذا زادت perplexity أو نقصت السرعة بأكثر من tolerance، أو زادت نسبة الرد الاحتياطي).
+    """
+    failures = []
+    perplexity = (report.get("perplexity") or {}).get("perplexity")
+    generation = report.get("generation") or {}
+    if max_perplexity is not None and perplexity is not None and perplexity > max_perplexity:
+        failures.append(f"perplexity {perplexity} > {max_perplexity}")
+    fallback_rate = generation.get("fallback_rate")
+    if max_fallback_rate is not None and fallback_rate is not None and fallback_rate > max_fallback_rate:
+        failures.append(f"fallback rate {fallback_rate} > {max_fallback_rate}")
+    if baseline:
+        old_perplexity = (baseline.get("perplexity") or {}).get("perplexity")
+        if old_perplexity and perplexity and perplexity > old_perplexity * (1 + tolerance):
+            failures.append(f"perplexity {old_perplexity} -> {perplexity}")
+        old_generation = baseline.get("generation") or {}
+        old_rate = old_generation.get("fallback_rate")
+        if old_rate is not None and fallback_rate is not None and fallback_rate > old_rate + tolerance:
+            failures.append(f"fallback rate {old_rate} -> {fallback_rate}")
+        old_speed, new_speed = old_generation.get("tokens_per_s"), generation.get("tokens_per_s")
+        if old_speed and new_speed and new_speed < old_speed * (1 - tolerance):
+            failures.append(f"generation tokens/s {old_speed} -> {new_speed}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Evaluate a fine-tuned checkpoint offline: eval-split perplexity, response length, "
+                    "clean_response fallback rate and generation throughput, written as a JSON report.")
+    parser.add_argument("--model", default="./dialogpt-finetuned")
+    parser.add_argument("--backend", choices=BACKENDS, default="eager")
+    parser.add_argument("--onnx-dir", default=None, help="Defaults to <model>/onnx")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes, each with its own model copy")
+    parser.add_argument("--threads-per-worker", type=int, default=None)
+    parser.add_argument("--eval-file", default=None,
+                        help="JSON/JSONL/CSV with Context and Response (defaults to the training eval split)")
+    parser.add_argument("--eval-limit", type=int, default=None, help="Score only the first N eval conversations (0 skips)")
+    parser.add_argument("--eval-batch-size", type=int, default=16)
+    parser.add_argument("--max-length", type=int, default=250)
+    parser.add_argument("--prompts", default=None, help="Text file with one message per line, or JSONL with 'message'")
+    parser.add_argument("--generation-batch-size", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=GENERATION_KWARGS["max_new_tokens"])
+    parser.add_argument("--greedy", action="store_true", help="Greedy decoding instead of the chatbot's sampling")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=5, help="Responses to include in the report")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    parser.add_argument("--baseline", default=None, help="Earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.05)
+    parser.add_argument("--max-perplexity", type=float, default=None)
+    parser.add_argument("--max-fallback-rate", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    evaluator = Evaluator(args.model, args.backend, args.workers, args.threads_per_worker, args.onnx_dir)
+    try:
+        report = {
+            "model": args.model,
+            "backend": args.backend,
+            "workers": evaluator.workers,
+            "threads_per_worker": evaluator.threads_per_worker,
+            "startup_s": round(evaluator.startup_seconds, 2),
+            "perplexity": None,
+            "generation": None,
+        }
+        if args.eval_limit != 0:
+            sequences = load_eval_conversations(evaluator.tokenizer, args.eval_file, args.eval_limit, args.max_length)
+            report["perplexity"] = evaluator.perplexity(sequences, args.eval_batch_size)
+        generation_kwargs = dict(max_new_tokens=args.max_new_tokens)
+        if args.greedy:
+            generation_kwargs["do_sample"] = False
+        report["generation"] = evaluator.generation(load_messages(args.prompts), args.generation_batch_size, args.seed,
+                                                    args.samples, **generation_kwargs)
+    finally:
+        evaluator.close()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report["failures"] = check_gates(report, args.max_perplexity, args.max_fallback_rate, baseline, args.tolerance)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    for failure in report["failures"]:
+        print(f"Evaluation gate failed: {failure}")
+    return 1 if report["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,45 +1,475 @@
+import dataclasses
+import hashlib
+import math
+import os
+import time
+
+import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
-from transformers import Trainer, TrainingArguments
-from datasets import load_dataset
+from transformers import Trainer, TrainerCallback, TrainingArguments
+from transformers.trainer_utils import get_last_checkpoint
+from datasets import Dataset, DatasetDict, IterableDataset, Sequence, Value, load_dataset, load_from_disk
+from metrics import peak_rss_mb
+
+
+# مجموعة بيانات المحادثات المستخدمة في التدريب والتقييم
+DATASET_NAME = "Amod/mental_health_counseling_conversations"
+
+
+
+def is_eval_example(example):
+    """
+    التقسيم الثابت الوحيد إلى تدريب واختبار (حوالي 25% للاختبار)، في الوضع العادي والمتدفق والتقييم:
+    يعتمد على بصمة نص السؤال (Context) وليس على ترتيب الأمثلة أو بذرة عشوائية، فيعطي نفس التقسيم دائمًا،
+    وتبقى الردود المتعددة على نفس السؤال في نفس الجزء (لا يظهر سؤال التدريب في الاختبار).
+    """
+    digest = hashlib.sha1(example["Context"].encode("utf-8")).digest()
+    return digest[0] % 4 == 0
+
+
+def is_train_example(example):
+    return not is_eval_example(example)
+
+
+
+# دوال المعالجة على مستوى الوحدة (وليست methods) حتى لا يُنسخ FineTuningTrainer مع النموذج كاملًا
+# إلى كل عملية في datasets.map(num_proc=...) وعند حساب بصمة الكاش؛ المحول (tokenizer) يُمرَّر عبر fn_kwargs
+def tokenize_conversation(examples, tokenizer, max_length):
+    """
+    دالة لتحويل النصوص إلى توكنز (Tokens) قابلة للمعالجة بواسطة النموذج.
+    تعمل على دفعة من الأمثلة (batched=True) ودون حشو؛ الحشو يتم لاحقًا لكل دفعة تدريب.
+    """
+    eos = tokenizer.eos_token
+    texts = [context + eos + response + eos for context, response in zip(examples["Context"], examples["Response"])]
+    tokenized = tokenizer(texts, truncation=True, max_length=max_length)
+    # طول كل مثال يُستخدم في تجميع الأمثلة حسب الطول (group_by_length)
+    return {"input_ids": tokenized["input_ids"], "length": [len(ids) for ids in tokenized["input_ids"]]}
+
+
+def pack_conversations(examples, block_size):
+    """
+    دمج المحادثات المحولة (كل منها ينتهي بـ eos) في كتل متتالية بطول block_size.
+    في labels يتم إخفاء (-100) أول توكن في كل محادثة جديدة داخل الكتلة، حتى لا يتعلم النموذج
+    توقع بداية محادثة غير مرتبطة بعد نهاية المحادثة السابقة. آخر كتلة قد تكون أقصر ويتم حشوها لاحقًا.
+    """
+    input_ids, labels = [], []
+    for ids in examples["input_ids"]:
+        input_ids.extend(ids)
+        labels.append(-100 if labels else ids[0])
+        labels.extend(ids[1:])
+    blocks = range(0, len(input_ids), block_size)
+    return {
+        "input_ids": [input_ids[i:i + block_size] for i in blocks],
+        "labels": [labels[i:i + block_size] for i in blocks],
+    }
+
+
+
+class DynamicPaddingCollator:
+    """
+    تجميع الأمثلة في دفعة مع الحشو (padding) حتى أطول مثال في الدفعة فقط بدلًا من طول ثابت،
+    ووضع -100 في labels مكان توكنز الحشو حتى لا تدخل في حساب الخسارة.
+    (لا نعتمد على pad_token_id لأن الحشو هنا هو نفس توكن eos الذي يفصل بين أجزاء المحادثة)
+    """
+
+    def __init__(self, tokenizer, pad_to_multiple_of=8):
+        self.pad_token_id = tokenizer.pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        length = max(len(feature["input_ids"]) for feature in features)
+        if self.pad_to_multiple_of:
+            length = -(-length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        input_ids = torch.full((len(features), length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(features), length), dtype=torch.long)
+        labels = torch.full((len(features), length), -100, dtype=torch.long)
+        for i, feature in enumerate(features):
+            ids = torch.as_tensor(feature["input_ids"], dtype=torch.long)
+            input_ids[i, :len(ids)] = ids
+            attention_mask[i, :len(ids)] = 1
+            # الكتل المدمجة (packing) تحتوي على labels جاهزة مع إخفاء حدود المحادثات
+            labels[i, :len(ids)] = torch.as_tensor(feature["labels"], dtype=torch.long) if "labels" in feature else ids
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+
+
+
+
+class DistillationCollator(DynamicPaddingCollator):
+    """
+    نفس الحشو الديناميكي، مع إضافة أفضل top_k توكنز من المعلم (teacher) لكل موضع إذا كانت موجودة في الأمثلة:
+    teacher_indices و teacher_logprobs بشكل (الدفعة، الطول، top_k). أمثلة التقييم بدونها تُقيَّم بخسارة اللغة فقط.
+    """
+
+    def __call__(self, features):
+        batch = super().__call__(features)
+        if "teacher_indices" not in features[0]:
+            return batch
+        batch_size, length = batch["input_ids"].shape
+        top_k = len(features[0]["teacher_indices"]) // len(features[0]["input_ids"])
+        teacher_indices = torch.zeros((batch_size, length, top_k), dtype=torch.long)
+        teacher_logprobs = torch.zeros((batch_size, length, top_k), dtype=torch.float32)
+        for i, feature in enumerate(features):
+            n = len(feature["input_ids"])
+            teacher_indices[i, :n] = torch.as_tensor(feature["teacher_indices"], dtype=torch.long).view(n, top_k)
+            teacher_logprobs[i, :n] = torch.as_tensor(feature["teacher_logprobs"], dtype=torch.float32).view(n, top_k)
+        batch.update(teacher_indices=teacher_indices, teacher_logprobs=teacher_logprobs)
+        return batch
+
+
+
+
+class DistillationTrainer(Trainer):
+    """
+    تدريب نموذج الطالب (student) بخسارة مركبة: alpha * KL(المعلم || الطالب) + (1 - alpha) * خسارة اللغة.
+    توزيع المعلم محفوظ مسبقًا على القرص (أفضل top_k توكنز فقط لكل موضع)، فلا يتم تحميل المعلم أثناء التدريب.
+    يُعاد توزيع المعلم على هذه التوكنز بدرجة الحرارة temperature، ويُضرب KL في temperature^2 كالمعتاد.
+    احتمالات الطالب تبقى على المفردات كاملة، فالخسارة تدفعه أيضًا لوضع احتماله على توكنز المعلم الأولى.
+    """
+
+    def __init__(self, *args, alpha=0.5, temperature=2.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.alpha = alpha
+        self.temperature = temperature
+        # الخسارة هنا متوسط لكل دفعة، فيقسمها Trainer على عدد خطوات التجميع (gradient accumulation)
+        self.model_accepts_loss_kwargs = False
+
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        teacher_indices = inputs.pop("teacher_indices", None)
+        teacher_logprobs = inputs.pop("teacher_logprobs", None)
+        labels = inputs.pop("labels")
+        outputs = model(**inputs)
+        # توقع التوكن التالي: logits للموضع i مقابل labels للموضع i + 1 (الحشو وحدود المحادثات = -100)
+        logits = outputs.logits[:, :-1].float()
+        targets = labels[:, 1:]
+        loss = torch.nn.functional.cross_entropy(
+            logits.reshape(-1, logits.shape[-1]), targets.reshape(-1), ignore_index=-100)
+        if teacher_indices is not None:
+            mask = targets != -100
+            student = torch.log_softmax(logits[mask] / self.temperature, dim=-1)
+            student = student.gather(-1, teacher_indices[:, :-1][mask])
+            teacher = torch.log_softmax(teacher_logprobs[:, :-1][mask] / self.temperature, dim=-1)
+            kl = (teacher.exp() * (teacher - student)).sum(-1).mean() * self.temperature ** 2
+            loss = self.alpha * kl + (1 - self.alpha) * loss
+        return (loss, outputs) if return_outputs else loss
+
+
+
+
+class TokenThroughputCallback(TrainerCallback):
+    """
+    قياس سرعة التدريب بعدد التوكنز الحقيقية (بدون الحشو) في الثانية، ونسبة الحشو في الدفعات.
+    يتم العد من مدخلات النموذج نفسها أثناء التدريب فقط (وضع model.train)، فلا يدخل التقييم في الحساب.
+    """
+
+    def __init__(self):
+        self.tokens = 0  # التوكنز الحقيقية
+        self.padded_tokens = 0  # جميع التوكنز بما فيها الحشو
+        self.history = []
+        self._hook = None
+        self._start = self._last_time = None
+        self._last_tokens = self._last_padded = 0
+
+    def _count(self, module, args, kwargs):
+        if not module.training:
+            return
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        if input_ids is None:
+            return
+        attention_mask = kwargs.get("attention_mask")
+        self.tokens += int(attention_mask.sum()) if attention_mask is not None else input_ids.numel()
+        self.padded_tokens += input_ids.numel()
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        if model is not None and self._hook is None:
+            self._hook = model.register_forward_pre_hook(self._count, with_kwargs=True)
+        self._start = self._last_time = time.perf_counter()
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if not logs or "loss" not in logs:
+            return
+        now = time.perf_counter()
+        tokens = self.tokens - self._last_tokens
+        padded = self.padded_tokens - self._last_padded
+        entry = {
+            "step": state.global_step,
+            "tokens_per_second": round(tokens / max(now - self._last_time, 1e-9), 1),
+            "padding_ratio": round(1 - tokens / padded, 3) if padded else 0.0,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        self.history.append(entry)
+        print(f"Step {entry['step']}: {entry['tokens_per_second']} tokens/s, padding {entry['padding_ratio']:.1%}, "
+              f"peak RSS {entry['peak_rss_mb']} MB")
+        self._last_time, self._last_tokens, self._last_padded = now, self.tokens, self.padded_tokens
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self._hook is not None:
+            self._hook.remove()
+            self._hook = None
+        summary = self.summary()
+        print(f"Training throughput: {summary['tokens_per_second']} tokens/s over {summary['tokens']} tokens, "
+              f"padding {summary['padding_ratio']:.1%}, peak RSS {summary['peak_rss_mb']} MB")
+
+    def summary(self):
+        """ملخص السرعة منذ بداية التدريب."""
+        elapsed = time.perf_counter() - self._start if self._start is not None else 0.0
+        return {
+            "tokens": self.tokens,
+            "seconds": round(elapsed, 2),
+            "tokens_per_second": round(self.tokens / elapsed, 1) if elapsed else 0.0,
+            "padding_ratio": round(1 - self.tokens / self.padded_tokens, 3) if self.padded_tokens else 0.0,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
 
 
 
 class FineTuningTrainer:
-    def __init__(self, model_name="microsoft/DialoGPT-medium"):
+    def __init__(self, model_name="microsoft/DialoGPT-medium", max_length=250, num_proc=None,
+                 cache_dir="./tokenized_cache", packing=False, block_size=None, group_by_length=True,
+                 memory_lean=False, streaming=None, save_steps=None, max_steps=None, output_dir="./dialogpt-finetuned",
+                 resume=None, teacher_name=None, distill_alpha=0.5, distill_temperature=2.0, distill_top_k=32, student_config=None):
         """إعداد النموذج والمحولات (Tokenizer)"""
         self.model_name = model_name
+        self.output_dir = output_dir
+        # وضع التقطير (distillation): model_name هو الطالب (نموذج أصغر)، و teacher_name هو النموذج المدرب الأكبر
+        self.teacher_name = teacher_name
+        self.distill_alpha = distill_alpha  # وزن KL مقابل خسارة اللغة
+        self.distill_temperature = distill_temperature
+        self.distill_top_k = distill_top_k  # عدد توكنز المعلم المحفوظة لكل موضع
+        # الوضع الاقتصادي في الذاكرة: gradient checkpointing، قراءة البيانات كتدفق (streaming)، وحفظ نقاط دورية
+        self.memory_lean = memory_lean
+        self.streaming = memory_lean if streaming is None else streaming
+        # الحفظ كل save_steps خطوة (وإلا في نهاية كل epoch)، حتى يمكن الاستئناف بعد أي انقطاع
+        self.save_steps = save_steps or (200 if memory_lean else None)
+        self.max_steps = max_steps  # مطلوب مع البيانات المتدفقة إذا لم يكن عدد الأمثلة معروفًا
+        # استئناف التدريب من أحدث نقطة محفوظة في output_dir (افتراضيًا في الوضع الاقتصادي فقط)؛
+        # بدونه يبدأ التدريب من جديد حتى لو كان هناك تدريب سابق منتهٍ في نفس المجلد
+        self.resume = memory_lean if resume is None else resume
+        self._num_examples = None
+        self.max_length = max_length  # الحد الأقصى لطول كل محادثة بالتوكنز
+        # وضع الدمج: وضع عدة محادثات متتالية (مفصولة بـ eos) في كتل بطول block_size بدون حشو
+        self.packing = packing
+        self.block_size = block_size or max_length
+        # في الوضع العادي: تجميع الأمثلة المتقاربة في الطول في نفس الدفعة لتقليل الحشو
+        self.group_by_length = group_by_length
+        self.num_proc = num_proc or os.cpu_count()  # عدد العمليات المستخدمة في تحويل النصوص إلى توكنز
+        self.cache_dir = cache_dir  # مكان حفظ البيانات المحولة (Arrow) لإعادة استخدامها
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(model_name)
+        if student_config:
+            # إعدادات أصغر للطالب (مثل {"n_layer": 6}): الأوزان المطابقة تُحمّل من model_name والباقي يُهيأ من جديد
+            self.model = AutoModelForCausalLM.from_pretrained(model_name, ignore_mismatched_sizes=True, **student_config)
+        else:
+            self.model = AutoModelForCausalLM.from_pretrained(model_name)
         self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.data_collator = (DistillationCollator if teacher_name else DynamicPaddingCollator)(self.tokenizer)
 
 
 
 
     def load_and_split_data(self):
         """تحميل مجموعة البيانات وتقسيمها إلى تدريب واختبار"""
-        dataset = load_dataset("Amod/mental_health_counseling_conversations")
-        dataset = dataset["train"].train_test_split(test_size=0.25, seed=42)
-        train_dataset = dataset["train"]
-        eval_dataset = dataset["test"]
-        return train_dataset, eval_dataset
+        if self.streaming:
+            return self.stream_and_split_data()
+        return self.split_dataset(load_dataset(DATASET_NAME)["train"])
+
+
+
+
+    @staticmethod
+    def split_dataset(dataset):
+        """التقسيم إلى تدريب واختبار حسب is_eval_example؛ يستخدمه التقييم أيضًا حتى يُقاس على نفس أمثلة الاختبار."""
+        return dataset.filter(is_train_example), dataset.filter(is_eval_example)
+
+
+
+
+    def stream_and_split_data(self):
+        """
+        قراءة مجموعة البيانات كتدفق دون تحميلها كاملة في الذاكرة، بنفس التقسيم (is_eval_example)،
+        مع خلط أمثلة التدريب داخل مخزن مؤقت محدود.
+        """
+        dataset = load_dataset(DATASET_NAME, split="train", streaming=True)
+        splits = dataset.info.splits
+        if splits and "train" in splits:
+            self._num_examples = splits["train"].num_examples
+        train_dataset = dataset.filter(is_train_example)
+        eval_dataset = dataset.filter(is_eval_example)
+        return train_dataset.shuffle(seed=42, buffer_size=1000), eval_dataset
+
+
+
+
+    def cache_path(self, train_dataset, eval_dataset):
+        """
+        مسار البيانات المحولة على القرص، مرتبط بالمحول (tokenizer) والطول الأقصى والبيانات نفسها،
+        حتى لا تُستخدم نسخة قديمة بعد تغيير أي منها.
+        """
+        key = "|".join([
+            self.tokenizer.name_or_path,
+            type(self.tokenizer).__name__,
+            str(len(self.tokenizer)),
+            str(self.tokenizer.eos_token),
+            str(self.max_length),
+            f"packed-{self.block_size}" if self.packing else "unpacked",
+            train_dataset._fingerprint,
+            eval_dataset._fingerprint,
+        ])
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+
+
+
+
+    def prepare_datasets(self, train_dataset, eval_dataset):
+        """
+        تحويل البيانات إلى توكنز مرة واحدة (datasets.map على دفعات وبعدة عمليات) وحفظها بصيغة Arrow.
+        في التشغيلات اللاحقة يتم تحميلها من القرص مباشرة (memory-mapped) دون إعادة المعالجة.
+        """
+        if isinstance(train_dataset, IterableDataset):
+            # البيانات المتدفقة تُحوّل أثناء القراءة فقط (بدون كاش على القرص)
+            return self._prepare_stream(train_dataset), self._prepare_stream(eval_dataset)
+
+        path = self.cache_path(train_dataset, eval_dataset)
+        if os.path.isdir(path):
+            tokenized = load_from_disk(path)
+            return tokenized["train"], tokenized["eval"]
+
+        tokenized = DatasetDict({"train": train_dataset, "eval": eval_dataset}).map(
+            tokenize_conversation,
+            fn_kwargs={"tokenizer": self.tokenizer, "max_length": self.max_length},
+            batched=True,
+            num_proc=self.num_proc,
+            remove_columns=train_dataset.column_names,
+            desc="Tokenizing conversations",
+        )
+        if self.packing:
+            tokenized = tokenized.map(
+                pack_conversations,
+                fn_kwargs={"block_size": self.block_size},
+                batched=True,
+                num_proc=self.num_proc,
+                remove_columns=["input_ids", "length"],
+                desc="Packing conversations",
+            )
+        tokenized.save_to_disk(path)
+        # إعادة التحميل من القرص حتى تكون البيانات memory-mapped من ملف الكاش نفسه
+        tokenized = load_from_disk(path)
+        return tokenized["train"], tokenized["eval"]
 
 
 
 
-    def tokenize_conversation(self, example):
-        """دالة لتحويل النصوص إلى توكنز (Tokens) قابلة للمعالجة بواسطة النموذج"""
-        text = example["Context"] + self.tokenizer.eos_token + example["Response"] + self.tokenizer.eos_token
-        tokenized = self.tokenizer(text, truncation=True, max_length=250, padding='max_length', return_tensors='pt')
-        return {"input_ids": tokenized["input_ids"].squeeze(), "labels": tokenized["input_ids"].squeeze()}
+    def teacher_cache_path(self, dataset):
+        """
+        ملف توقعات المعلم على القرص، مرتبط بالمعلم (ووقت تعديل أوزانه المحلية) و top_k والبيانات المحولة نفسها،
+        حتى لا تُستخدم توقعات قديمة بعد إعادة تدريب المعلم أو تغيير البيانات.
+        """
+        weights = [os.path.join(self.teacher_name, name) for name in ("model.safetensors", "pytorch_model.bin")]
+        key = "|".join([
+            self.teacher_name,
+            *(str(os.path.getmtime(path)) for path in weights if os.path.isfile(path)),
+            str(self.distill_top_k),
+            dataset._fingerprint,
+        ])
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"teacher-{digest}.arrow")
+
+
+
+
+    def cache_teacher_logits(self, dataset, batch_size=4):
+        """
+        حساب أفضل top_k توكنز (log-probabilities) من المعلم لكل موضع في كل مثال مرة واحدة وحفظها بصيغة Arrow،
+        حتى لا يُعاد تشغيل المعلم في كل epoch أو عند استئناف التدريب. التشغيلات اللاحقة تقرأ الملف مباشرة
+        (memory-mapped) دون تحميل المعلم.
+        """
+        if isinstance(dataset, IterableDataset):
+            raise ValueError("Distillation needs a map-style dataset; streaming is not supported.")
+        path = self.teacher_cache_path(dataset)
+        if os.path.isfile(path):
+            return Dataset.from_file(path)
+
+        teacher = AutoModelForCausalLM.from_pretrained(self.teacher_name)
+        teacher.eval()
+        if teacher.config.vocab_size != self.model.config.vocab_size:
+            raise ValueError(f"Teacher vocabulary ({teacher.config.vocab_size}) does not match the student "
+                             f"({self.model.config.vocab_size}); distillation needs the same tokenizer.")
+        collator = DynamicPaddingCollator(self.tokenizer)
+
+        def top_k(examples):
+            batch = collator([{"input_ids": ids} for ids in examples["input_ids"]])
+            with torch.no_grad():
+                logits = teacher(input_ids=batch["input_ids"], attention_mask=batch["attention_mask"]).logits
+            values, indices = torch.log_softmax(logits.float(), dim=-1).topk(self.distill_top_k, dim=-1)
+            lengths = [len(ids) for ids in examples["input_ids"]]
+            return {
+                "teacher_indices": [indices[i, :n].reshape(-1).to(torch.int32).numpy() for i, n in enumerate(lengths)],
+                "teacher_logprobs": [values[i, :n].reshape(-1).half().numpy() for i, n in enumerate(lengths)],
+            }
+
+        features = dataset.features.copy()
+        features["teacher_indices"] = Sequence(Value("int32"))
+        features["teacher_logprobs"] = Sequence(Value("float16"))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        dataset = dataset.map(
+            top_k,
+            batched=True,
+            batch_size=batch_size,
+            features=features,
+            cache_file_name=path,
+            new_fingerprint=os.path.basename(path)[:-len(".arrow")],  # بدون حساب بصمة الدالة (تحتوي على المعلم)
+            desc="Caching teacher logits",
+        )
+        del teacher
+        return dataset
+
+
+
+
+    def _prepare_stream(self, dataset):
+        dataset = dataset.map(tokenize_conversation, fn_kwargs={"tokenizer": self.tokenizer, "max_length": self.max_length},
+                              batched=True, remove_columns=["Context", "Response"])
+        if self.packing:
+            dataset = dataset.map(pack_conversations, fn_kwargs={"block_size": self.block_size},
+                                  batched=True, remove_columns=["input_ids", "length"])
+        return dataset
+
+
+
+
+    def _streaming_max_steps(self, args):
+        """عدد خطوات التدريب مع البيانات المتدفقة (تقريبي، من عدد الأمثلة المعروف في وصف مجموعة البيانات)."""
+        if self.max_steps:
+            return self.max_steps
+        if not self._num_examples:
+            raise ValueError("max_steps is required when streaming a dataset of unknown size.")
+        train_examples = self._num_examples - math.ceil(self._num_examples / 4)
+        examples_per_step = args["per_device_train_batch_size"] * args["gradient_accumulation_steps"]
+        return math.ceil(train_examples / examples_per_step) * args["num_train_epochs"]
 
 
 
 
     def train_model(self, train_dataset, eval_dataset):
         """إعدادات التدريب وبدء عملية fine-tuning"""
-        training_args = TrainingArguments(
-            output_dir="./dialogpt-finetuned",
-            overwrite_output_dir=True,
+        if "input_ids" not in (train_dataset.column_names or ()):
+            # البيانات ما زالت نصوصًا: تحويلها إلى توكنز (أو تحميلها من الكاش)
+            train_dataset, eval_dataset = self.prepare_datasets(train_dataset, eval_dataset)
+        if self.teacher_name:
+            # التقييم يبقى بخسارة اللغة فقط حتى تكون قابلة للمقارنة مع المعلم
+            train_dataset = self.cache_teacher_logits(train_dataset)
+        streaming = isinstance(train_dataset, IterableDataset)
+
+        # تجميع الأمثلة حسب الطول (غير مطلوب مع الدمج لأن الكتل متساوية الطول تقريبًا)
+        # الاسم تغيّر بين إصدارات transformers: group_by_length أو train_sampling_strategy
+        sampling = {}
+        if self.group_by_length and not self.packing and not streaming:
+            if "train_sampling_strategy" in {field.name for field in dataclasses.fields(TrainingArguments)}:
+                sampling = {"train_sampling_strategy": "group_by_length", "length_column_name": "length"}
+            else:
+                sampling = {"group_by_length": True, "length_column_name": "length"}
+
+        args = dict(
+            output_dir=self.output_dir,
             num_train_epochs=3,
             per_device_train_batch_size=2,
             gradient_accumulation_steps=8,
@@ -49,16 +479,47 @@ class FineTuningTrainer:
             save_strategy="epoch",
             save_total_limit=2,
         )
+        if not self.resume and "overwrite_output_dir" in {field.name for field in dataclasses.fields(TrainingArguments)}:
+            args["overwrite_output_dir"] = True
+        if self.save_steps:
+            # حفظ نقطة استئناف (checkpoint) كل save_steps خطوة بدلًا من نهاية كل epoch فقط
+            args.update(eval_strategy="steps", eval_steps=self.save_steps, save_strategy="steps", save_steps=self.save_steps)
+        if streaming:
+            # مع البيانات المتدفقة يجب تحديد عدد الخطوات لأن طول البيانات غير معروف مسبقًا
+            args["max_steps"] = self._streaming_max_steps(args)
+        elif self.max_steps:
+            args["max_steps"] = self.max_steps
+        if self.memory_lean:
+            # إعادة حساب التفعيلات أثناء backward بدلًا من حفظها: ذاكرة أقل مقابل وقت حساب أكثر
+            args["gradient_checkpointing"] = True
+            self.model.config.use_cache = False
+        trainer_class, distillation = Trainer, {}
+        if self.teacher_name:
+            # أعمدة المعلم ليست من مدخلات النموذج، فلا يحذفها Trainer قبل الوصول إلى DistillationCollator
+            args["remove_unused_columns"] = False
+            trainer_class = DistillationTrainer
+            distillation = dict(alpha=self.distill_alpha, temperature=self.distill_temperature)
+        training_args = TrainingArguments(**args, **sampling)
+        self.throughput = TokenThroughputCallback()
 
-        trainer = Trainer(
+        trainer = trainer_class(
             model=self.model,
             args=training_args,
             train_dataset=train_dataset,
             eval_dataset=eval_dataset,
-            data_collator=None
+            data_collator=self.data_collator,
+            callbacks=[self.throughput],
+            **distillation,
         )
 
-        trainer.train()
-        trainer.save_model("./dialogpt-finetuned")
-        self.tokenizer.save_pretrained("./dialogpt-finetuned")
+        # استئناف التدريب من أحدث نقطة محفوظة إذا توقف التشغيل السابق قبل الانتهاء
+        last_checkpoint = None
+        if self.resume and os.path.isdir(self.output_dir):
+            last_checkpoint = get_last_checkpoint(self.output_dir)
+        if last_checkpoint is not None:
+            print(f"Resuming training from {last_checkpoint}")
+
+        trainer.train(resume_from_checkpoint=last_checkpoint)
+        trainer.save_model(self.output_dir)
+        self.tokenizer.save_pretrained(self.output_dir)
         return trainer
@@ -0,0 +1,115 @@
+import os
+import pickle
+import threading
+
+
+class GoogleClients:
+    """
+    عملاء Google Sheets و Gmail يتم إنشاؤهم عند أول استخدام فقط ثم إعادة استخدامهم.
+    يتم حفظ نسخة واحدة لكل مجموعة إعدادات (pool) حتى لا تتكرر المصادقة بين الكائنات،
+    مع تجديد التوكن عند انتهاء صلاحيته بدلًا من إعادة بناء الخدمة في كل حجز.
+    مكتبات Google تُستورد عند أول استخدام فقط حتى لا تبطئ بدء التشغيل (ولا تلزم مع LocalSink).
+    """
+
+    SHEETS_SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/spreadsheets",
+                    "https://www.googleapis.com/auth/drive.file", "https://www.googleapis.com/auth/drive"]
+    GMAIL_SCOPE = ["https://www.googleapis.com/auth/gmail.send"]
+
+    _pool = {}
+    _pool_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, credentials_path='/path/to/credentials.json', token_path='token.pickle', sheet_name='MentalHealth'):
+        """إرجاع العملاء المشتركين لهذه الإعدادات (وإنشاؤهم مرة واحدة فقط)."""
+        key = (credentials_path, token_path, sheet_name)
+        with cls._pool_lock:
+            clients = cls._pool.get(key)
+            if clients is None:
+                clients = cls._pool[key] = cls(credentials_path, token_path, sheet_name)
+            return clients
+
+    def __init__(self, credentials_path, token_path, sheet_name):
+        self.credentials_path = credentials_path
+        self.token_path = token_path
+        self.sheet_name = sheet_name
+        self._sheets_lock = threading.Lock()
+        self._gmail_lock = threading.Lock()
+        self._sheets_creds = None
+        self._sheet = None
+        self._gmail_creds = None
+        self._gmail_service = None
+
+    @property
+    def sheet(self):
+        """الورقة الأولى في ملف Google Sheets (مع إعادة المصادقة إذا انتهت صلاحية التوكن)."""
+        with self._sheets_lock:
+            if self._sheet is None or getattr(self._sheets_creds, "access_token_expired", False):
+                import gspread
+                from oauth2client.service_account import ServiceAccountCredentials
+
+                # إعداد OAuth2 للوصول إلى Google Sheets
+                self._sheets_creds = ServiceAccountCredentials.from_json_keyfile_name(
+                    self.credentials_path, self.SHEETS_SCOPE)
+                client = gspread.authorize(self._sheets_creds)  # الاتصال بخدمة Google Sheets
+                self._sheet = client.open(self.sheet_name).sheet1  # فتح الورقة الأولى في ملف Google Sheets
+            return self._sheet
+
+    def gmail(self):
+        """خدمة Gmail API، تُبنى مرة واحدة ويتم تجديد التوكن فقط عند انتهاء صلاحيته."""
+        with self._gmail_lock:
+            if self._gmail_service is None:
+                from googleapiclient.discovery import build
+
+                self._gmail_creds = self._load_gmail_creds()
+                self._gmail_service = build('gmail', 'v1', credentials=self._gmail_creds)  # بناء خدمة Gmail API
+            elif not self._gmail_creds.valid:
+                self._refresh_gmail_creds(self._gmail_creds)
+            return self._gmail_service
+
+    def _load_gmail_creds(self):
+        creds = None
+        if os.path.exists(self.token_path):
+            with open(self.token_path, 'rb') as token:
+                creds = pickle.load(token)  # تحميل التوكن من الملف إذا كان موجودًا
+
+        # إذا كانت بيانات المصادقة غير صالحة أو منتهية الصلاحية، يتم تجديدها أو طلبها من المستخدم
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                self._refresh_gmail_creds(creds)
+            else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+
+                flow = InstalledAppFlow.from_client_secrets_file(self.credentials_path, self.GMAIL_SCOPE)
+                creds = flow.run_local_server(port=0)  # مصادقة عبر واجهة المستخدم
+                self._save_token(creds)
+        return creds
+
+    def _refresh_gmail_creds(self, creds):
+        from google.auth.transport.requests import Request
+
+        creds.refresh(Request())  # تجديد التوكن إذا كان منتهي الصلاحية
+        self._save_token(creds)
+
+    def _save_token(self, creds):
+        with open(self.token_path, 'wb') as token:
+            pickle.dump(creds, token)  # تخزين التوكن بعد التجديد
+
+    def warm_up_async(self):
+        """
+        تجهيز العملاء في الخلفية حتى يكون أول حجز سريعًا، دون تأخير بدء تشغيل روبوت المحادثة.
+        الأخطاء هنا لا توقف التشغيل؛ سيتم إعادة المحاولة عند أول استخدام فعلي.
+        """
+        def warm_up():
+            setups = [("Google Sheets", lambda: self.sheet)]
+            # لا نبدأ مصادقة Gmail التفاعلية في الخلفية؛ فقط نحمّل التوكن المحفوظ إن وُجد
+            if os.path.exists(self.token_path):
+                setups.append(("Gmail", self.gmail))
+            for name, setup in setups:
+                try:
+                    setup()
+                except Exception as error:
+                    print(f"{name} client setup failed, will retry on first use: {error}")
+
+        thread = threading.Thread(target=warm_up, name="google-clients-warm-up", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,502 @@
+import argparse
+import ctypes
+import gc
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from torch import nn
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer, GenerationConfig
+from transformers.modeling_outputs import CausalLMOutputWithPast
+
+
+# الخلفيات المتاحة لتشغيل النموذج
+BACKENDS = ("eager", "int8", "onnx")
+ONNX_FILE = "model.onnx"
+
+
+def load_model(model_name, backend="eager", device="cpu", shared_weights=None):
+    """
+    تحميل النموذج حسب الخلفية المختارة:
+    eager: النموذج الأصلي بدقة fp32 في PyTorch.
+    int8: نفس النموذج مع تكميم طبقات Linear ديناميكيًا إلى int8 (CPU فقط).
+    onnx: الرسم البياني المُصدَّر (model.onnx) عبر ONNX Runtime على CPU؛ model_name هنا هو مجلد التصدير.
+    shared_weights: ملف أوزان محفوظ بـ save_shared_weights يُقرأ بـ mmap (لـ eager و int8)،
+    حتى تتشارك عدة عمليات نفس نسخة الأوزان في الذاكرة.
+    """
+    if backend in ("eager", "int8"):
+        if shared_weights:
+            model = load_shared_model(model_name, shared_weights)
+        else:
+            model = AutoModelForCausalLM.from_pretrained(model_name)
+        if backend == "int8":
+            return quantize_int8(model, keep_mapped=bool(shared_weights))
+        model.to(device)
+        return model.eval()
+    if backend == "onnx":
+        return OnnxCausalLM(model_name)
+    raise ValueError(f"Unknown inference backend: {backend} (expected one of {', '.join(BACKENDS)})")
+
+
+def save_shared_weights(model_name, directory="./shared_weights"):
+    """
+    حفظ أوزان النموذج مرة واحدة في ملف واحد يمكن قراءته بـ mmap (torch.load(mmap=True)) من عدة عمليات.
+    تُرجع مسار الملف؛ اسم الملف مرتبط بالنموذج وبوقت تعديل وحجم ملفات أوزانه المحلية، فيُعاد إنشاؤه
+    بعد إعادة التدريب في نفس المجلد بدلًا من استخدام الأوزان القديمة (ويُحذف الملف القديم لنفس النموذج).
+    """
+    os.makedirs(directory, exist_ok=True)
+    prefix = hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:16] + "-"
+    signature = hashlib.sha1("|".join(_weights_signature(model_name)).encode("utf-8")).hexdigest()[:8]
+    path = os.path.join(directory, prefix + signature + ".pt")
+    if not os.path.exists(path):
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name.endswith(".pt"):
+                # العمليات التي ما زالت تستخدم الملف القديم بـ mmap لا تتأثر بحذفه
+                os.remove(os.path.join(directory, name))
+        model = AutoModelForCausalLM.from_pretrained(model_name)
+        # المعاملات والـ buffers معًا (بما فيها غير المحفوظة في state_dict)؛ الأوزان المشتركة تظهر مرة واحدة
+        tensors = {name: tensor.detach() for name, tensor in model.named_parameters()}
+        tensors.update({name: tensor for name, tensor in model.named_buffers()})
+        temporary = path + ".tmp"
+        torch.save(tensors, temporary)
+        os.replace(temporary, path)
+    return path
+
+
+def _weights_signature(model_name):
+    """وقت التعديل والحجم لملفات الأوزان في مجلد النموذج المحلي (قائمة فارغة لأسماء النماذج على Hub)."""
+    if not os.path.isdir(model_name):
+        return []
+    names = sorted(name for name in os.listdir(model_name) if name.endswith((".safetensors", ".bin")))
+    return [f"{name}:{os.path.getmtime(os.path.join(model_name, name))}:{os.path.getsize(os.path.join(model_name, name))}"
+            for name in names]
+
+
+def load_shared_model(model_name, weights_path):
+    """
+    بناء النموذج بدون أوزان (على meta) ثم ربط معاملاته مباشرة بالتنسورات المقروءة بـ mmap من weights_path.
+    صفحات الملف للقراءة فقط وتبقى في ذاكرة النظام المشتركة، فلا تُنسخ الأوزان في كل عملية.
+    """
+    config = AutoConfig.from_pretrained(model_name)
+    with torch.device("meta"):
+        model = AutoModelForCausalLM.from_config(config)
+    tensors = torch.load(weights_path, mmap=True, weights_only=True)
+    for name, tensor in tensors.items():
+        module_name, _, attribute = name.rpartition(".")
+        module = model.get_submodule(module_name)
+        if attribute in module._parameters:
+            module._parameters[attribute] = nn.Parameter(tensor, requires_grad=False)
+        else:
+            module._buffers[attribute] = tensor
+    model.tie_weights()
+    missing = [name for name, tensor in list(model.named_parameters()) + list(model.named_buffers()) if tensor.is_meta]
+    if missing:
+        raise ValueError(f"Shared weights file {weights_path} is missing tensors: {', '.join(missing[:5])}")
+    try:
+        model.generation_config = GenerationConfig.from_pretrained(model_name)
+    except OSError:
+        pass  # لا يوجد generation_config.json؛ تبقى الإعدادات المشتقة من config
+    return model.eval()
+
+
+def conv1d_to_linear(model):
+    """
+    استبدال طبقات Conv1D الخاصة بـ GPT-2 (الأوزان بشكل [in, out]) بطبقات nn.Linear مكافئة،
+    لأن التكميم الديناميكي في PyTorch يتعامل مع nn.Linear فقط.
+    """
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if type(child).__name__ != "Conv1D":
+                continue
+            in_features, out_features = child.weight.shape
+            linear = nn.Linear(in_features, out_features)
+            linear.weight = nn.Parameter(child.weight.detach().t().contiguous())
+            linear.bias = nn.Parameter(child.bias.detach())
+            setattr(parent, name, linear)
+    return model
+
+
+def quantize_int8(model, keep_mapped=False):
+    """
+    تكميم طبقات Linear داخل كتل المحول إلى int8 ديناميكيًا.
+    lm_head لا يتم تكميمه لأنه يشارك أوزانه مع طبقة التضمين؛ تكميمه يضيف نسخة ثانية بدلًا من توفير الذاكرة.
+    keep_mapped: الأوزان محمّلة من ملف الأوزان المشترك (save_shared_weights)؛ الأوزان غير المكممة (التضمين،
+    LayerNorm...) تبقى مرتبطة بالملف وتتشاركها العمليات، والأوزان المكممة فقط خاصة بكل عملية.
+    """
+    model = conv1d_to_linear(model.to("cpu").eval())
+    qconfig = torch.ao.quantization.default_dynamic_qconfig
+    spec = {
+        name: qconfig for name, module in model.named_modules()
+        if isinstance(module, nn.Linear) and name != "lm_head"
+    }
+    # inplace: بدون نسخة كاملة من النموذج (deepcopy) تنقل جميع الأوزان إلى ذاكرة خاصة بالعملية
+    model = torch.ao.quantization.quantize_dynamic(model, spec, dtype=torch.qint8, inplace=True)
+    if not keep_mapped:
+        # نسخ الأوزان المتبقية (التضمين، LayerNorm...) خارج ملف safetensors المحمّل بـ mmap حتى يُغلق الملف
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            tensor.data = tensor.data.clone()
+    # إعادة الذاكرة المحررة من أوزان fp32 (بعد تحويل Conv1D والتكميم) إلى نظام التشغيل
+    _release_memory()
+    return model
+
+
+def _release_memory():
+    """تحرير الذاكرة غير المستخدمة وإعادتها إلى نظام التشغيل (malloc_trim متاح مع glibc فقط)."""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class _KeyValueExport(nn.Module):
+    """غلاف للتصدير: past_key_values كمدخلات ومخرجات منفصلة لكل طبقة بدلًا من كائن cache."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.num_layers = model.config.num_hidden_layers
+
+    def forward(self, input_ids, attention_mask, position_ids, *past):
+        from transformers import DynamicCache
+
+        cache = DynamicCache(tuple((past[2 * i], past[2 * i + 1]) for i in range(self.num_layers)))
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                             past_key_values=cache, use_cache=True)
+        present = []
+        for keys, values in _past_tensors(outputs.past_key_values):
+            present += [keys, values]
+        return (outputs.logits, *present)
+
+
+def _past_tensors(past):
+    """past_key_values كقائمة (keys, values) لكل طبقة، أيًا كان شكلها (tuple أو DynamicCache)."""
+    if past is None:
+        return []
+    if hasattr(past, "to_legacy_cache"):
+        return list(past.to_legacy_cache())
+    if hasattr(past, "layers"):
+        return [(layer.keys, layer.values) for layer in past.layers]
+    return list(past)
+
+
+def _past_names(num_layers, kind="past"):
+    return [f"{kind}.{i}.{part}" for i in range(num_layers) for part in ("key", "value")]
+
+
+def export_onnx(model_dir, output_dir=None, opset=17, quantize=False):
+    """
+    تصدير النموذج المدرب إلى ONNX مع ذاكرة الانتباه (past_key_values) كمدخلات ومخرجات،
+    وحفظ الإعدادات والمحول (tokenizer) في نفس المجلد حتى يكون مستقلًا بذاته.
+    مع quantize=True يتم تكميم أوزان MatMul في الرسم البياني إلى int8 عبر ONNX Runtime.
+    """
+    output_dir = output_dir or os.path.join(model_dir, "onnx")
+    os.makedirs(output_dir, exist_ok=True)
+    model = AutoModelForCausalLM.from_pretrained(model_dir).eval()
+    config = model.config
+    heads = config.num_attention_heads
+    head_dim = config.hidden_size // heads
+
+    input_ids = torch.ones(1, 3, dtype=torch.long)
+    past = [torch.zeros(1, heads, 4, head_dim) for _ in range(2 * config.num_hidden_layers)]
+    attention_mask = torch.ones(1, 7, dtype=torch.long)
+    position_ids = torch.arange(4, 7).unsqueeze(0)
+
+    past_names = _past_names(config.num_hidden_layers)
+    present_names = _past_names(config.num_hidden_layers, "present")
+    dynamic_axes = {
+        "input_ids": {0: "batch", 1: "sequence"},
+        "attention_mask": {0: "batch", 1: "total_sequence"},
+        "position_ids": {0: "batch", 1: "sequence"},
+        "logits": {0: "batch", 1: "sequence"},
+    }
+    dynamic_axes.update({name: {0: "batch", 2: "past_sequence"} for name in past_names})
+    dynamic_axes.update({name: {0: "batch", 2: "total_sequence"} for name in present_names})
+
+    export_kwargs = dict(
+        input_names=["input_ids", "attention_mask", "position_ids", *past_names],
+        output_names=["logits", *present_names],
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+    )
+    path = os.path.join(output_dir, ONNX_FILE)
+    export_path = os.path.join(output_dir, "model-fp32.onnx") if quantize else path
+    with torch.no_grad():
+        try:
+            # المُصدِّر المعتمد على التتبع (tracing) يدعم past_key_values الديناميكية مباشرة
+            torch.onnx.export(_KeyValueExport(model), (input_ids, attention_mask, position_ids, *past), export_path,
+                              dynamo=False, **export_kwargs)
+        except TypeError:
+            # إصدارات PyTorch الأقدم لا تقبل المعامل dynamo
+            torch.onnx.export(_KeyValueExport(model), (input_ids, attention_mask, position_ids, *past), export_path,
+                              **export_kwargs)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(export_path, path, weight_type=QuantType.QInt8)
+        os.remove(export_path)
+
+    config.save_pretrained(output_dir)
+    if model.generation_config is not None:
+        model.generation_config.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(model_dir).save_pretrained(output_dir)
+    return output_dir
+
+
+class OnnxCausalLM:
+    """
+    تشغيل النموذج المُصدَّر عبر ONNX Runtime على CPU بواجهة مشابهة لنموذج transformers:
+    الاستدعاء المباشر (مع past_key_values) و generate مع نفس إعدادات العينة و streamer.
+    """
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(path, ONNX_FILE), options, providers=["CPUExecutionProvider"])
+        self.config = AutoConfig.from_pretrained(path)
+        self.device = torch.device("cpu")
+        self.num_layers = self.config.num_hidden_layers
+        self.num_heads = self.config.num_attention_heads
+        self.head_dim = self.config.hidden_size // self.num_heads
+        self._past_names = _past_names(self.num_layers)
+
+    def to(self, device):
+        return self  # ONNX Runtime هنا على CPU فقط
+
+    def eval(self):
+        return self
+
+    def _run(self, input_ids, attention_mask, position_ids, past):
+        feeds = {
+            "input_ids": input_ids.cpu().numpy(),
+            "attention_mask": attention_mask.cpu().numpy(),
+            "position_ids": position_ids.cpu().numpy(),
+        }
+        feeds.update(zip(self._past_names, past))
+        logits, *present = self.session.run(None, feeds)
+        return logits, present
+
+    def _past_arrays(self, past_key_values, batch_size):
+        past = []
+        for keys, values in _past_tensors(past_key_values):
+            past += [keys.detach().cpu().numpy(), values.detach().cpu().numpy()]
+        if not past:
+            empty = np.zeros((batch_size, self.num_heads, 0, self.head_dim), dtype=np.float32)
+            past = [empty] * (2 * self.num_layers)
+        return past
+
+    @staticmethod
+    def _position_ids(attention_mask, length):
+        # نفس طريقة transformers: المواقع تُحسب من قناع الانتباه حتى مع الحشو من اليسار
+        position_ids = attention_mask.long().cumsum(-1) - 1
+        position_ids = position_ids.masked_fill(attention_mask == 0, 1)
+        return position_ids[:, -length:]
+
+    def __call__(self, input_ids, attention_mask=None, past_key_values=None, use_cache=True, **kwargs):
+        past = self._past_arrays(past_key_values, input_ids.shape[0])
+        if attention_mask is None:
+            attention_mask = torch.ones(input_ids.shape[0], past[0].shape[2] + input_ids.shape[1], dtype=torch.long)
+        position_ids = self._position_ids(attention_mask, input_ids.shape[1])
+        logits, present = self._run(input_ids, attention_mask, position_ids, past)
+        past_key_values = tuple(
+            (torch.from_numpy(present[2 * i]), torch.from_numpy(present[2 * i + 1])) for i in range(self.num_layers))
+        return CausalLMOutputWithPast(logits=torch.from_numpy(logits), past_key_values=past_key_values)
+
+    @staticmethod
+    def _select(logits, do_sample, temperature, top_k, top_p):
+        """اختيار التوكن التالي: greedy أو عينة مع temperature ثم top_k ثم top_p (بنفس ترتيب transformers)."""
+        if not do_sample:
+            return logits.argmax(-1)
+        logits = logits / temperature
+        if top_k:
+            kth = torch.topk(logits, min(top_k, logits.shape[-1])).values[..., -1:]
+            logits = logits.masked_fill(logits < kth, -float("inf"))
+        if top_p < 1.0:
+            sorted_logits, sorted_indices = torch.sort(logits, descending=False)
+            cumulative = sorted_logits.softmax(-1).cumsum(-1)
+            remove = cumulative <= (1 - top_p)
+            remove[..., -1:] = False
+            logits = logits.scatter(1, sorted_indices, sorted_logits.masked_fill(remove, -float("inf")))
+        return torch.multinomial(logits.softmax(-1), num_samples=1).squeeze(1)
+
+    @torch.no_grad()
+    def generate(self, input_ids, attention_mask=None, past_key_values=None, max_new_tokens=20, do_sample=False,
+                 temperature=1.0, top_k=50, top_p=1.0, pad_token_id=None, eos_token_id=None, streamer=None, **kwargs):
+        """توليد حتى max_new_tokens أو حتى ينتهي كل تسلسل بـ eos؛ تُرجع المدخلات مع التوكنز الجديدة."""
+        input_ids = input_ids.cpu()
+        batch_size = input_ids.shape[0]
+        eos_token_id = self.config.eos_token_id if eos_token_id is None else eos_token_id
+        pad_token_id = eos_token_id if pad_token_id is None else pad_token_id
+        past = self._past_arrays(past_key_values, batch_size)
+        # مع ذاكرة المقدمة يتم تمرير الجزء غير المحسوب فقط
+        step_ids = input_ids[:, past[0].shape[2]:]
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        attention_mask = attention_mask.cpu()
+
+        if streamer is not None:
+            streamer.put(input_ids)
+        sequences = input_ids
+        finished = torch.zeros(batch_size, dtype=torch.bool)
+        for _ in range(max_new_tokens):
+            position_ids = self._position_ids(attention_mask, step_ids.shape[1])
+            logits, past = self._run(step_ids, attention_mask, position_ids, past)
+            next_tokens = self._select(torch.from_numpy(logits[:, -1, :]), do_sample, temperature, top_k, top_p)
+            next_tokens = next_tokens.masked_fill(finished, pad_token_id)
+            sequences = torch.cat([sequences, next_tokens[:, None]], dim=-1)
+            if streamer is not None:
+                streamer.put(next_tokens)
+            finished |= next_tokens == eos_token_id
+            if finished.all():
+                break
+            step_ids = next_tokens[:, None]
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones(batch_size, 1)], dim=-1)
+        if streamer is not None:
+            streamer.end()
+        return sequences
+
+
+# رسائل مستخدم نموذجية لفحص التطابق وقياس السرعة، تمر عبر نفس قالب النص الموجه المستخدم في المحادثة
+SAMPLE_MESSAGES = [
+    "I have been feeling really anxious about my exams lately.",
+    "I can't sleep at night and I feel tired all day.",
+    "My family doesn't understand what I'm going through.",
+    "How can I stop overthinking everything?",
+    "I feel lonely since I moved to a new city.",
+]
+
+
+def sample_prompts(messages=SAMPLE_MESSAGES):
+    from prompt_engineering import PromptEngineering
+
+    prompt_engineering = PromptEngineering()
+    return [prompt_engineering.prepare_prompt(message) for message in messages]
+
+
+def backend_path(model_dir, backend, onnx_dir=None):
+    """مسار تحميل الخلفية: مجلد التصدير لـ onnx، ومجلد النموذج نفسه لغيرها."""
+    if backend == "onnx":
+        return onnx_dir or os.path.join(model_dir, "onnx")
+    return model_dir
+
+
+def check_parity(model_dir, backend, prompts=None, max_new_tokens=20, onnx_dir=None):
+    """
+    مقارنة الخلفية المختارة مع النموذج الأصلي (eager) على نصوص نموذجية:
+    أكبر فرق في logits التوكن التالي، نسبة تطابق التوكن الأعلى احتمالًا، ونسبة تطابق التوليد الجشع (greedy).
+    """
+    prompts = prompts or sample_prompts()
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    reference = load_model(model_dir, "eager")
+    candidate = load_model(backend_path(model_dir, backend, onnx_dir), backend)
+
+    results = []
+    for prompt in prompts:
+        input_ids = tokenizer.encode(prompt, return_tensors="pt")
+        with torch.no_grad():
+            expected = reference(input_ids).logits[0, -1]
+            actual = candidate(input_ids).logits[0, -1]
+        greedy = dict(max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=tokenizer.eos_token_id)
+        expected_tokens = reference.generate(input_ids, attention_mask=torch.ones_like(input_ids), **greedy)[0, input_ids.shape[1]:]
+        actual_tokens = candidate.generate(input_ids, attention_mask=torch.ones_like(input_ids), **greedy)[0, input_ids.shape[1]:]
+        length = min(len(expected_tokens), len(actual_tokens))
+        matching = int((expected_tokens[:length] == actual_tokens[:length]).cumprod(0).sum()) if length else 0
+        results.append({
+            "max_logit_diff": float((expected - actual).abs().max()),
+            "top1_match": bool(expected.argmax() == actual.argmax()),
+            "greedy_match": matching / max(len(expected_tokens), 1),
+        })
+
+    return {
+        "backend": backend,
+        "prompts": len(results),
+        "max_logit_diff": max(r["max_logit_diff"] for r in results),
+        "top1_agreement": sum(r["top1_match"] for r in results) / len(results),
+        "greedy_agreement": sum(r["greedy_match"] for r in results) / len(results),
+        "per_prompt": results,
+    }
+
+
+def _rss_mb():
+    """استهلاك الذاكرة الحالي (RSS) بالميجابايت إن أمكن قياسه."""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def measure(model_dir, backend, prompts=None, max_new_tokens=32, onnx_dir=None):
+    """
+    قياس زمن التحميل وزمن كل توكن والذاكرة لخلفية واحدة (شغّلها في عملية مستقلة لكل خلفية).
+    الذاكرة تُقاس بعد التوليد لأن أوزان safetensors تُقرأ بـ mmap ولا تظهر في RSS قبل استخدامها.
+    """
+    prompts = prompts or sample_prompts()
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    model = load_model(backend_path(model_dir, backend, onnx_dir), backend)
+    load_seconds = time.perf_counter() - started
+
+    tokens = 0
+    started = time.perf_counter()
+    for prompt in prompts:
+        input_ids = tokenizer.encode(prompt, return_tensors="pt")
+        outputs = model.generate(input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=max_new_tokens,
+                                 do_sample=False, pad_token_id=tokenizer.eos_token_id)
+        tokens += outputs.shape[1] - input_ids.shape[1]
+    elapsed = time.perf_counter() - started
+    rss_after = _rss_mb()
+    return {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 2),
+        "model_rss_mb": None if rss_before is None else round(rss_after - rss_before, 1),
+        "rss_mb": rss_after,
+        "ms_per_token": round(elapsed * 1000 / max(tokens, 1), 2),
+        "tokens": tokens,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert, check and benchmark the chatbot inference backends.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert = commands.add_parser("convert", help="Export the fine-tuned model to ONNX (the int8 backend quantizes on load).")
+    convert.add_argument("--model", default="./dialogpt-finetuned")
+    convert.add_argument("--output", default=None, help="Defaults to <model>/onnx")
+    convert.add_argument("--opset", type=int, default=17)
+    convert.add_argument("--quantize", action="store_true", help="Also quantize the exported graph's weights to int8")
+
+    for name, help_text in (("parity", "Compare a backend against eager on sample prompts."),
+                            ("bench", "Measure load time, RSS and per-token latency of one backend.")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--model", default="./dialogpt-finetuned")
+        command.add_argument("--backend", choices=BACKENDS, default="int8")
+        command.add_argument("--onnx-dir", default=None, help="Defaults to <model>/onnx")
+        command.add_argument("--max-new-tokens", type=int, default=20 if name == "parity" else 32)
+    commands.choices["parity"].add_argument("--min-top1", type=float, default=0.8,
+                                            help="Exit with status 1 below this next-token agreement")
+
+    args = parser.parse_args(argv)
+    if args.command == "convert":
+        print(f"Exported ONNX model to {export_onnx(args.model, args.output, args.opset, args.quantize)}")
+        return 0
+    if args.command == "parity":
+        report = check_parity(args.model, args.backend, max_new_tokens=args.max_new_tokens, onnx_dir=args.onnx_dir)
+        print(json.dumps(report, indent=2))
+        return 0 if report["top1_agreement"] >= args.min_top1 else 1
+    print(json.dumps(measure(args.model, args.backend, max_new_tokens=args.max_new_tokens, onnx_dir=args.onnx_dir), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import json
+import re
+from collections import deque
+
+
+# أحرف التشكيل العربية والتطويل، تُحذف قبل المطابقة
+_ARABIC_MARKS = re.compile("[\u064B-\u065F\u0670\u0640]")
+# أي تسلسل من غير أحرف الكلمات يتحول إلى مسافة واحدة
+_NON_WORD = re.compile(r"[\W_]+")
+# السوابق العربية المتصلة المسموح بها قبل العبارة داخل نفس الكلمة (و/ف/ب/ل وأداة التعريف "ال")،
+# مثل "بالانتحار" و "وأريد أن أموت"؛ النص هنا بعد التوحيد
+_PROCLITICS = frozenset([
+    "ال", "و", "وال", "ف", "فال", "ب", "بال", "وب", "وبال", "فب", "فبال",
+    "ل", "لل", "ول", "ولل", "فل", "فلل",
+])
+# توحيد أشكال الألف والفواصل العليا
+_CHAR_MAP = str.maketrans({"\u0623": "\u0627", "\u0625": "\u0627", "\u0622": "\u0627", "\u2019": "", "\u2018": "", "'": ""})
+
+
+def normalize_text(text):
+    """
+    توحيد النص قبل المطابقة: تجاهل حالة الأحرف والفواصل العليا والتشكيل،
+    وتحويل المسافات وعلامات الترقيم المتتالية إلى مسافة واحدة.
+    """
+    text = text.casefold().translate(_CHAR_MAP)
+    text = _ARABIC_MARKS.sub("", text)
+    return _NON_WORD.sub(" ", text).strip()
+
+
+class KeywordMatcher:
+    """
+    مطابقة عدة كلمات وعبارات دفعة واحدة باستخدام خوارزمية Aho-Corasick.
+    يتم بناء الآلة مرة واحدة، ثم تمر المطابقة على النص مرة واحدة (زمن خطي في طول النص)
+    مهما كان عدد العبارات.
+
+    العبارة يجب أن تبدأ وتنتهي عند حدود كلمة؛ العبارة التي تنتهي بـ "*" تطابق أي كلمة تبدأ بها
+    (مثل "suicid*" التي تطابق suicide و suicidal). قبل العبارة يُسمح بسابقة عربية متصلة
+    (و/ف/ب/ل و "ال"، مثل "بالانتحار").
+    """
+
+    def __init__(self, phrases=()):
+        self._goto = [{}]  # انتقالات كل حالة
+        self._fail = [0]  # رابط الفشل لكل حالة
+        self._out = [[]]  # العبارات المنتهية في كل حالة: (الطول، يتطلب حدًا في النهاية، القيمة)
+        self.size = 0
+        for phrase in phrases:
+            if isinstance(phrase, tuple):
+                self._add(*phrase)
+            else:
+                self._add(phrase, phrase)
+        self._build()
+
+    @classmethod
+    def from_file(cls, path, extra=()):
+        """
+        تحميل العبارات من ملف: JSON (قائمة أو {"phrases": [...]}) أو ملف نصي بعبارة في كل سطر
+        (الأسطر الفارغة والتي تبدأ بـ # يتم تجاهلها).
+        """
+        with open(path, encoding="utf-8") as f:
+            if path.endswith(".json"):
+                data = json.load(f)
+                phrases = data["phrases"] if isinstance(data, dict) else data
+            else:
+                phrases = [line.strip() for line in f]
+        phrases = [p for p in phrases if p and not p.startswith("#")]
+        return cls(list(extra) + phrases)
+
+    def _add(self, phrase, payload):
+        prefix_match = phrase.endswith("*")
+        key = normalize_text(phrase.rstrip("*"))
+        if not key:
+            return
+        state = 0
+        for char in key:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(key), not prefix_match, payload))
+        self.size += 1
+
+    def _build(self):
+        """حساب روابط الفشل بترتيب BFS ودمج مخرجات كل حالة مع مخرجات حالة الفشل الخاصة بها."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def finditer(self, text, normalized=False):
+        """إرجاع (البداية، النهاية، القيمة) لكل عبارة موجودة في النص (بعد التوحيد)."""
+        if not normalized:
+            text = normalize_text(text)
+        goto, fail, out = self._goto, self._fail, self._out
+        length = len(text)
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for size, needs_end, payload in out[state]:
+                start = i - size + 1
+                # التحقق من حدود الكلمة (النص الموحّد لا يحتوي إلا أحرف كلمات ومسافات مفردة)
+                if start > 0 and text[start - 1] != " ":
+                    word_start = text.rfind(" ", 0, start) + 1
+                    if text[word_start:start] not in _PROCLITICS:
+                        continue
+                if needs_end and i + 1 < length and text[i + 1] != " ":
+                    continue
+                yield start, i + 1, payload
+
+    def search(self, text):
+        """إرجاع قيمة أول عبارة موجودة في النص، أو None."""
+        for _, _, payload in self.finditer(text):
+            return payload
+        return None
+
+    def __contains__(self, text):
+        return self.search(text) is not None
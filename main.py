@@ -8,5 +8,8 @@ trainer = FineTuningTrainer(model_name="microsoft/DialoGPT-medium")
 # تحميل البيانات وتقسيمها
 train_dataset, eval_dataset = trainer.load_and_split_data()
 
+# تحويل البيانات إلى توكنز مرة واحدة (أو تحميلها من الكاش على القرص)
+train_dataset, eval_dataset = trainer.prepare_datasets(train_dataset, eval_dataset)
+
 # تدريب النموذج
 trainer.train_model(train_dataset, eval_dataset)
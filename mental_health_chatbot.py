@@ -1,138 +1,535 @@
+import threading
+from collections import OrderedDict
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoTokenizer, TextIteratorStreamer
 from emergency_response_handler import EmergencyResponseHandler
 from specialist_manager import SpecialistManager
 from appointment_manager import AppointmentManager
 from prompt_engineering import PromptEngineering
+from batch_generator import BatchGenerator
+from session_store import SessionStore
+from prefix_cache import PrefixCache
+from chat_history import TokenHistory
+from inference_backend import load_model
+from assisted_decoding import AssistedDecoding
+from response_cache import ResponseCache
+from admission import AdmissionController
+from metrics import Metrics
 
 
 class MentalHealthChatbot:
-    def __init__(self, model_name="adanal/dialogpt-finetuned"):
+    # الرد في حالة رفض تقديم معلومات الموعد
+    DECLINE_APPOINTMENT_RESPONSE = (
+        "I understand that you may not want to provide your information right now, and we completely respect that.\n"
+        "Providing these details helps us schedule an appointment with the specialist more accurately.\n"
+        "If you need more time or would prefer to cancel the booking, we are here to assist you at any time.\n"
+        "If you'd like any further assistance, we can direct you to support lines or additional help."
+    )
+
+    # الرد عندما يكون النموذج مشغولًا بالكامل (قائمة الانتظار ممتلئة أو طال الانتظار)
+    HIGH_LOAD_RESPONSE = (
+        "I'm sorry, I'm talking with a lot of people right now and couldn't answer in time. "
+        "Please send your message again in a moment. "
+        "If you are in danger or thinking about harming yourself, please contact your local emergency number "
+        "or a crisis helpline right away."
+    )
+
+    # الرد عند إرسال رسائل كثيرة متتالية من نفس الجلسة
+    RATE_LIMIT_RESPONSE = (
+        "I want to give each of your messages proper attention. Please give me a moment before sending the next one."
+    )
+
+    # الحد الأقصى لعدد الردود الجاهزة المحفوظة توكنزها
+    CANNED_CACHE_SIZE = 256
+
+    def __init__(self, model_name="adanal/dialogpt-finetuned", enable_batching=False, max_batch_size=8, max_wait_ms=10,
+                 session_ttl_seconds=1800, max_sessions=1000, specialists_source=None, appointment_sink=None,
+                 backend="eager", shared_weights=None, appointment_outbox_path="appointments_outbox.db",
+                 response_cache=False, response_cache_size=512, response_cache_ttl=3600, prewarm_prompts=None,
+                 metrics=False, metrics_port=None, slow_turn_ms=None, draft_model_name=None, num_assistant_tokens=5,
+                 max_model_queue=None, max_queue_wait_s=30.0, session_rate=None, session_burst=5):
         # تحميل النموذج والمحول من Hugging Face
+        # backend: "eager" (PyTorch fp32)، "int8" (تكميم ديناميكي)، أو "onnx" (model_name هو مجلد التصدير)
+        self.backend = backend
+        # قياسات زمن المراحل والعدادات (معطّلة افتراضيًا؛ metrics_port يفعّلها ويشغّل نقطة /metrics)
+        self.metrics = Metrics(enabled=metrics or metrics_port is not None, slow_turn_ms=slow_turn_ms)
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(model_name)
-        
-        # تحديد الجهاز الذي سيعمل عليه النموذج (GPU أو CPU)
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model.to(self.device)
+
+        # تحديد الجهاز الذي سيعمل عليه النموذج (GPU أو CPU)؛ خلفيتا int8 و onnx تعملان على CPU فقط
+        self.device = torch.device("cuda" if torch.cuda.is_available() and backend == "eager" else "cpu")
+        # shared_weights: ملف أوزان يُقرأ بـ mmap ومشترك بين عدة عمليات (انظر WorkerPool)
+        self.model = load_model(model_name, backend, self.device, shared_weights=shared_weights)
+        self.model_id = f"{model_name}:{backend}"  # جزء من مفتاح ذاكرة الردود
 
         # تعيين token padding إذا لم يكن موجودًا
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
 
-        # متغيرات الحالة للتحكم في تدفق المحادثة
-        self.ask_to_location = False
-        self.asking_for_appointment = False
-        
+        # حالة المحادثة لكل مستخدم على حدة (الأعلام، تاريخ التوكنز، تقدم الحجز)
+        self.sessions = SessionStore(ttl_seconds=session_ttl_seconds, max_sessions=max_sessions)
+
         # تهيئة الأدوات المساعدة مثل معالجة الاستجابات الطارئة وإدارة المتخصصين
-        self.prompt_engineering = PromptEngineering()
-        self.specialist_manager = SpecialistManager()
-        self.appointment_manager = AppointmentManager()
+        self.specialist_manager = SpecialistManager(specialists_source)  # تحميل دليل المختصين وفهارسه مرة واحدة
+        self.prompt_engineering = PromptEngineering(self.specialist_manager)
+        self.appointment_manager = AppointmentManager(sink=appointment_sink, outbox_path=appointment_outbox_path,
+                                                      metrics=self.metrics)
+        self.emergency_handler = EmergencyResponseHandler()
+        self.emergency_handler.matcher()  # بناء آلة مطابقة عبارات الطوارئ مرة واحدة عند بدء التشغيل
+
+        # إعدادات التوليد المشتركة بين التوليد الفردي والتوليد بالدفعات
+        self.generation_kwargs = dict(
+            max_new_tokens=100,
+            temperature=0.7,
+            do_sample=True,
+            top_p=0.9,
+            top_k=50,
+            pad_token_id=self.tokenizer.eos_token_id,
+        )
+
+        # مُجدول الدفعات الديناميكي (اختياري) لخدمة عدة مستخدمين في استدعاء generate واحد
+        self.batch_generator = None
+        if enable_batching:
+            self.batch_generator = BatchGenerator(
+                self.model, self.tokenizer, self.device,
+                clean_fn=self.prompt_engineering.clean_response,
+                max_batch_size=max_batch_size,
+                max_wait_ms=max_wait_ms,
+                metrics=self.metrics,
+                **self.generation_kwargs
+            )
+
+        # التحكم في القبول (اختياري): عدد محدد من أدوار النموذج في نفس الوقت، قائمة انتظار بحد max_model_queue،
+        # ومعدل رسائل لكل جلسة (session_rate رسالة/ثانية بعد session_burst رسائل). الأدوار المرفوضة تحصل على رد
+        # HIGH_LOAD_RESPONSE أو RATE_LIMIT_RESPONSE، والردود المبنية على القواعد لا تنتظر النموذج أبدًا.
+        self.admission = None
+        if max_model_queue is not None or session_rate is not None:
+            self.admission = AdmissionController(
+                max_concurrent=max_batch_size if enable_batching else 1,
+                max_queue=max_model_queue if max_model_queue is not None else float("inf"),
+                max_wait_s=max_queue_wait_s,
+                session_rate=session_rate,
+                session_burst=session_burst,
+                metrics=self.metrics,
+            )
+
+        # التوليد بمساعدة نموذج مسودة صغير بنفس المحوّل (اختياري، للتوليد الفردي على eager و int8)
+        self.assisted = None
+        if draft_model_name:
+            if backend == "onnx" or enable_batching:
+                print("Assisted decoding is only available for single-request eager or int8 generation; ignoring the draft model.")
+            else:
+                self.assisted = AssistedDecoding(self.model, self.tokenizer, draft_model_name, backend, self.device,
+                                                 num_assistant_tokens=num_assistant_tokens)
+
+        # حساب ذاكرة الانتباه للمقدمة الثابتة مرة واحدة عند بدء التشغيل
+        self.prefix_cache = PrefixCache(self.model, self.tokenizer, self.device)
+        self.prefix_cache.get(self.prompt_engineering.prompt_prefix())
+
+        # ميزانية التوكنز لتاريخ المحادثة: سياق النموذج ناقص المساحة المحجوزة للرد
+        self.max_context = getattr(self.model.config, "n_positions", None) or getattr(
+            self.model.config, "max_position_embeddings", 1024)
+        self.history_budget = self.max_context - self.generation_kwargs["max_new_tokens"]
+
+        # توكنز الردود الجاهزة (الطوارئ، المواعيد...) محسوبة مسبقًا حتى لا تنتظر هذه الردود المحوّل
+        self._canned_ids = OrderedDict()
+        self._encode_canned(EmergencyResponseHandler.emergency_reply(
+            self.specialist_manager.experts_db, self.specialist_manager.locations))
+        self._encode_canned(self.DECLINE_APPOINTMENT_RESPONSE)
+        self._encode_canned(self.HIGH_LOAD_RESPONSE)
+        self._encode_canned(self.RATE_LIMIT_RESPONSE)
+
+        # ذاكرة ردود النموذج للرسائل المتكررة في بداية المحادثة (اختيارية)
+        self.response_cache = None
+        if response_cache:
+            self.response_cache = ResponseCache(max_entries=response_cache_size, ttl_seconds=response_cache_ttl)
+            if prewarm_prompts:
+                self.prewarm_response_cache(prewarm_prompts)
+
+        self._register_metrics()
+        if metrics_port is not None:
+            self.metrics.serve(metrics_port)
+
+    def _register_metrics(self):
+        """القيم اللحظية التي تُقرأ فقط عند طلب /metrics."""
+        self.metrics.register("chatbot_sessions", "gauge", "Active chat sessions.", lambda: len(self.sessions))
+        self.metrics.register("chatbot_session_tokens", "gauge", "Tokens stored in all session histories.",
+                              self.sessions.total_tokens)
+        self.metrics.register("chatbot_outbox_pending", "gauge", "Appointment records waiting to be sent.",
+                              self.appointment_manager.outbox.pending_count)
+        if self.batch_generator is not None:
+            self.metrics.register("chatbot_batch_queue_depth", "gauge", "Requests waiting for the next batch.",
+                                  self.batch_generator.queue_depth)
+        if self.admission is not None:
+            self.metrics.register("chatbot_admission_queue_depth", "gauge", "Model turns waiting for a free slot.",
+                                  lambda: self.admission.waiting)
+            self.metrics.register("chatbot_admission_in_use", "gauge", "Model turns currently generating.",
+                                  lambda: self.admission.in_use)
+        if self.assisted is not None:
+            assist = self.assisted.get_stats
+            self.metrics.register("chatbot_draft_tokens_total", "counter", "Tokens proposed by the draft model.",
+                                  lambda: assist()["draft_tokens"])
+            self.metrics.register("chatbot_draft_accepted_tokens_total", "counter",
+                                  "Draft tokens accepted by the main model.", lambda: assist()["accepted_tokens"])
+            self.metrics.register("chatbot_draft_acceptance_rate", "gauge", "Share of draft tokens accepted.",
+                                  lambda: assist()["acceptance_rate"])
+        if self.response_cache is not None:
+            stats = self.response_cache.get_stats
+            self.metrics.register("chatbot_response_cache_hits_total", "counter", "Response cache hits.",
+                                  lambda: stats()["hits"])
+            self.metrics.register("chatbot_response_cache_misses_total", "counter", "Response cache misses.",
+                                  lambda: stats()["misses"])
+            self.metrics.register("chatbot_response_cache_entries", "gauge", "Entries in the response cache.",
+                                  lambda: stats()["entries"])
 
-    def _encode_and_concat(self, text, bot_input_ids):
+    def prewarm_response_cache(self, prompts, background=True):
         """
-        دالة مساعدة لتحويل النص إلى توكنز ودمجها مع مدخلات المحادثة السابقة.
+        توليد الردود لقائمة رسائل شائعة (مثل الأسئلة التجريبية في الواجهة) وحفظها في ذاكرة الردود،
+        في خيط بالخلفية افتراضيًا حتى لا يتأخر بدء التشغيل.
         """
-        tokens = self.tokenizer.encode(text, return_tensors="pt").to(self.device)
-        return torch.cat([bot_input_ids, tokens], dim=-1)
+        def prewarm():
+            for i, prompt in enumerate(prompts):
+                session_id = f"__prewarm__{i}"
+                try:
+                    self.generate_response(prompt, session_id=session_id)
+                except Exception as error:
+                    print(f"Response cache prewarm failed for {prompt!r}: {error}")
+                finally:
+                    self.end_session(session_id)
 
-    def _handle_emergency(self, user_input, bot_input_ids):
+        if not background:
+            prewarm()
+            return None
+        thread = threading.Thread(target=prewarm, name="response-cache-prewarm", daemon=True)
+        thread.start()
+        return thread
+
+    def warm_up(self, prompt="Hello, I would like to talk about how I have been feeling."):
+        """
+        توليد رد تجريبي واحد (في جلسة مؤقتة) قبل استقبال المستخدمين، حتى لا يدفع أول مستخدم
+        تكلفة التشغيل الأول للنموذج (تهيئة الذاكرة والأنوية، جلسة ONNX Runtime، مُجدول الدفعات).
+        """
+        session_id = "__warm_up__"
+        try:
+            self.generate_response(prompt, session_id=session_id)
+        finally:
+            self.end_session(session_id)
+
+    def _encode_canned(self, text):
+        """
+        تحويل رد جاهز إلى توكنز مع حفظ النتيجة، لأن نفس الردود تتكرر في كل محادثة.
+        """
+        tokens = self._canned_ids.get(text)
+        if tokens is None:
+            tokens = self.tokenizer.encode(text + self.tokenizer.eos_token, return_tensors="pt").to(self.device)
+            self._canned_ids[text] = tokens
+            if len(self._canned_ids) > self.CANNED_CACHE_SIZE:
+                self._canned_ids.popitem(last=False)
+        return tokens
+
+    def _route(self, user_input, state, turn=None):
+        """
+        تصنيف الدور قبل أي تحويل إلى توكنز: تُرجع (المسار، الرد) حيث المسار أحد
+        "emergency" أو "specialist" أو "appointment" مع الرد الجاهز، أو ("model", None).
+        """
+        # التعامل مع الاستجابات الطارئة أولًا
+        with self.metrics.span("emergency", turn):
+            reply = self._handle_emergency(user_input, state)
+        if reply:
+            return "emergency", reply
+
+        # التعامل مع استفسارات المتخصصين والموقع
+        with self.metrics.span("specialist", turn):
+            reply = self._handle_specialists(user_input, state)
+        if reply:
+            return "specialist", reply
+
+        # التعامل مع طلبات تحديد المواعيد
+        with self.metrics.span("appointment", turn):
+            reply = self._handle_appointment_request(user_input, state)
+        if reply:
+            return "appointment", reply
+
+        return "model", None
+
+    def _handle_emergency(self, user_input, state):
         """
         التعامل مع الاستجابات الطارئة.
         إذا كان هناك رد طارئ، يتم التعامل معه وإرجاعه.
         """
-        emergency_response = EmergencyResponseHandler().check_and_respond(user_input)
+        emergency_response = self.emergency_handler.check_and_respond(
+            user_input, self.specialist_manager.experts_db, self.specialist_manager.locations)
         if emergency_response:
-            self.ask_to_location = True
-            # دمج الرد الطارئ مع المدخلات
-            bot_input_ids = self._encode_and_concat(emergency_response, bot_input_ids)
-            return emergency_response, bot_input_ids
-        return None, bot_input_ids
+            state.ask_to_location = True
+            return emergency_response
+        return None
 
-    def _handle_specialists(self, user_input, bot_input_ids):
+    def _handle_specialists(self, user_input, state):
         """
         التعامل مع الاستفسارات الخاصة بالموقع المتخصص.
         إذا تم طلب تحديد موقع المتخصص، يتم معالجة ذلك.
         """
-        if self.ask_to_location:
-            reply, is_location_existing = self.specialist_manager.handle_specialists(user_input)
+        if state.ask_to_location:
+            is_location_existing, location = self.specialist_manager.extract_location(user_input)
+            reply = self.specialist_manager.find_experts_by_location(is_location_existing, location)
             if is_location_existing:
-                self.asking_for_appointment = True
-            self.ask_to_location = False
-            # دمج الرد الخاص بالموقع مع المدخلات
-            bot_input_ids = self._encode_and_concat(reply, bot_input_ids)
-            return reply, bot_input_ids
-        return None, bot_input_ids
+                state.asking_for_appointment = True
+            state.ask_to_location = False
+            return reply
+        return None
 
-    def _handle_appointment_request(self, user_input, bot_input_ids):
+    def _handle_appointment_request(self, user_input, state):
         """
         التعامل مع طلبات تحديد المواعيد.
         إذا كان المستخدم يرغب في تحديد موعد، يتم معالجة ذلك.
         """
         if self.appointment_manager.detect_appointment_request(user_input):
-            self.asking_for_appointment = True
+            state.asking_for_appointment = True
         
-        if self.asking_for_appointment:
+        if state.asking_for_appointment:
             if "no" in user_input.lower():
                 # الرد في حالة رفض تقديم المعلومات
-                response = (
-                    "I understand that you may not want to provide your information right now, and we completely respect that.\n"
-                    "Providing these details helps us schedule an appointment with the specialist more accurately.\n"
-                    "If you need more time or would prefer to cancel the booking, we are here to assist you at any time.\n"
-                    "If you'd like any further assistance, we can direct you to support lines or additional help."
-                )
-                self.asking_for_appointment = False
-                # دمج الرد مع المدخلات
-                bot_input_ids = self._encode_and_concat(response, bot_input_ids)
-                return response, bot_input_ids
+                state.asking_for_appointment = False
+                state.asked_for_name = False
+                state.collected_data = {}
+                return self.DECLINE_APPOINTMENT_RESPONSE
             else:
-                # تخزين البيانات المتعلقة بالموعد
-                return self.appointment_manager.store_appointment_data(user_input), bot_input_ids
+                # جمع بيانات الموعد خطوة بخطوة ثم تخزينها
+                return self.appointment_manager.ask_for_appointment_details(user_input, state)
        
-        return None, bot_input_ids
+        return None
 
 
 
-    def generate_response(self, user_input, chat_history_ids=None):
+    def generate_response(self, user_input, chat_history_ids=None, session_id="default"):
         """
         توليد الردود باستخدام النموذج المدرب مع الإدخال الموجه.
+        يتم حفظ حالة المحادثة في جلسة مستقلة لكل session_id، مما يسمح بخدمة عدة مستخدمين بالتوازي.
+        """
+        state = self.sessions.get(session_id)
+        with self.sessions.turn(state), self.metrics.turn() as turn:
+            history = self._session_history(state, chat_history_ids)
+            response = self._generate_for_session(user_input, history, state, turn)
+            return response, history.turn_ids()
+
+    def _session_history(self, state, chat_history_ids=None):
         """
-        # إعداد النص الموجه
-        prompt = self.prepare_prompt(user_input)
-        inputs = self.tokenizer.encode(prompt + self.tokenizer.eos_token, return_tensors="pt").to(self.device)
+        إرجاع تاريخ المحادثة الخاص بالجلسة بعد التأكد من أنه يبدأ بالمقدمة الثابتة الحالية.
+        إذا مرّر المستدعي chat_history_ids صراحةً، يتم استخدامه بدلًا من التاريخ المحفوظ.
+        """
+        prefix_ids, _ = self.prefix_cache.get(self.prompt_engineering.prompt_prefix())
+        if state.history is None:
+            state.history = TokenHistory(prefix_ids, capacity=self.max_context,
+                                         budget=self.history_budget, device=self.device)
+        state.history.set_prefix(prefix_ids)
+        if chat_history_ids is not None:
+            state.history.reset()
+            state.history.start_turn(chat_history_ids)
+        return state.history
+
+    def generate_response_stream(self, user_input, session_id="default"):
+        """
+        توليد الرد على شكل أجزاء نصية متتالية أثناء عمل النموذج (بعد تنظيفها تدريجيًا).
+        ردود الطوارئ والمتخصصين والمواعيد تُرجع مباشرة كجزء واحد.
+        """
+        state = self.sessions.get(session_id)
+        with self.sessions.turn(state), self.metrics.turn() as turn:
+            history = self._session_history(state)
+            reply, cache_key = self._start_turn(user_input, history, state, turn)
+            if reply:
+                yield reply
+                return
 
-        bot_input_ids = chat_history_ids if chat_history_ids is not None else inputs
+            # تشغيل generate في خيط منفصل وقراءة النص من الـ streamer أثناء التوليد
+            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=False)
+            _, past_key_values = self.prefix_cache.get(self.prompt_engineering.prompt_prefix())
+            model_input_ids = history.ids()
+            result = {}
 
-        # التعامل مع الاستجابات الطارئة
-        emergency_response, bot_input_ids = self._handle_emergency(user_input, bot_input_ids)
-        if emergency_response:
-            return emergency_response, bot_input_ids
+            def run_generate():
+                try:
+                    with torch.no_grad():
+                        result["outputs"] = self._generate(
+                            model_input_ids,
+                            past_key_values=past_key_values,
+                            attention_mask=torch.ones_like(model_input_ids),
+                            streamer=streamer,
+                            **self.generation_kwargs
+                        )
+                except Exception as error:
+                    result["error"] = error
+                    streamer.end()
+                finally:
+                    self._release()
 
-        # التعامل مع استفسارات المتخصصين والموقع
-        reply, bot_input_ids = self._handle_specialists(user_input, bot_input_ids)
+            shed = self._admit(state, history, turn)
+            if shed:
+                yield shed
+                return
+            self.metrics.observe("chatbot_prompt_tokens", model_input_ids.shape[-1])
+            thread = threading.Thread(target=run_generate, daemon=True)
+            with self.metrics.span("generate", turn):
+                thread.start()
+                chunks = []
+                # (التحويل إلى نص والتنظيف يتمان أثناء التوليد، لذلك يقاسان ضمن generate)
+                for chunk in self.prompt_engineering.clean_stream(streamer):
+                    chunks.append(chunk)
+                    yield chunk
+                thread.join()
+
+            if "error" in result:
+                raise result["error"]
+            new_tokens = result["outputs"][:, model_input_ids.shape[-1]:]
+            self.metrics.observe("chatbot_output_tokens", new_tokens.shape[-1])
+            history.append(new_tokens)
+            self._cache_response(cache_key, "".join(chunks), new_tokens)
+
+    def _start_turn(self, user_input, history, state, turn=None):
+        """
+        تصنيف الدور أولًا؛ إذا كان له رد مبني على القواعد (الطوارئ، المتخصصين، المواعيد) يُضاف
+        الرد بتوكنزه المحفوظة إلى التاريخ ويُرجع مباشرة دون أي تحويل لرسالة المستخدم.
+        وإلا تُضاف رسالة المستخدم إلى التاريخ ويُرجع الرد من ذاكرة الردود إن وُجد.
+        تُرجع (الرد أو None إذا كان الدور يحتاج إلى النموذج، مفتاح ذاكرة الردود لحفظ رد النموذج أو None).
+        """
+        route, reply = self._route(user_input, state, turn)
+        if turn is not None:
+            turn.route = route
         if reply:
-            return reply, bot_input_ids
+            # الطوارئ والمتخصصين والمواعيد لا تمر أبدًا عبر ذاكرة الردود
+            history.start_turn(self._encode_canned(reply))
+            return reply, None
 
-        # التعامل مع طلبات تحديد المواعيد
-        response, bot_input_ids = self._handle_appointment_request(user_input, bot_input_ids)
-        if response:
-            return response, bot_input_ids
-
-        # توليد الرد العام باستخدام النموذج المدرب
-        with torch.no_grad():
-            outputs = self.model.generate(
-                bot_input_ids,
-                max_length=inputs.shape[1] + 100,
-                temperature=0.7,
-                do_sample=True,
-                top_p=0.9,
-                top_k=50,
-                pad_token_id=self.tokenizer.eos_token_id,
-                attention_mask=torch.ones_like(inputs)
-            )
+        # ذاكرة الردود فقط لأول دور في المحادثة (بدون أي سياق سابق يغيّر معنى الرسالة)
+        cache_key = None
+        if self.response_cache is not None and history.num_tokens() == 0:
+            cache_key = self.response_cache.key(user_input, self.model_id, self.prompt_engineering.prompt_version)
+
+        # إعداد الجزء المتغير من النص الموجه؛ المقدمة الثابتة محفوظة في بداية التاريخ
+        with self.metrics.span("prompt", turn):
+            prompt = self.prompt_engineering.prepare_turn(user_input)
+        with self.metrics.span("tokenize", turn):
+            inputs = self.tokenizer.encode(prompt + self.tokenizer.eos_token, return_tensors="pt").to(self.device)
+            history.start_turn(inputs)
+
+        if cache_key is not None:
+            with self.metrics.span("response_cache", turn):
+                cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                response, new_tokens = cached
+                history.append(new_tokens)
+                if turn is not None:
+                    turn.route = "cache"
+                return response, None
+        return None, cache_key
+
+    def _cache_response(self, cache_key, response, new_tokens):
+        """حفظ رد النموذج في ذاكرة الردود (الرد الاحتياطي لا يُحفظ حتى يُعاد التوليد في المرة القادمة)."""
+        if cache_key is not None and response != self.prompt_engineering.FALLBACK_RESPONSE:
+            self.response_cache.put(cache_key, response, new_tokens)
+
+    def _generate_for_session(self, user_input, history, state, turn=None):
+        """
+        توليد الرد لجلسة واحدة (يتم استدعاؤها مع قفل الجلسة).
+        """
+        reply, cache_key = self._start_turn(user_input, history, state, turn)
+        if reply:
+            return reply
 
-        chat_history_ids = outputs
-        response = self.tokenizer.decode(chat_history_ids[:, bot_input_ids.shape[-1]:][0], skip_special_tokens=False)
-        response = self.prompt_engineering.clean_response(response)
+        shed = self._admit(state, history, turn)
+        if shed:
+            return shed
+
+        # توليد الرد العام باستخدام النموذج المدرب، بدءًا من المقدمة الثابتة
+        # (التاريخ يبدأ دائمًا بالمقدمة، لذلك يُمرَّر كما هو دون نسخ)
+        try:
+            _, past_key_values = self.prefix_cache.get(self.prompt_engineering.prompt_prefix())
+            model_input_ids = history.ids()
+            self.metrics.observe("chatbot_prompt_tokens", model_input_ids.shape[-1])
+            if self.batch_generator is not None:
+                # تمرير الطلب إلى مُجدول الدفعات الذي يعيد الرد بعد فك الترميز والتنظيف
+                # (الحشو من اليسار يغيّر مواقع المقدمة، لذلك لا تُستخدم ذاكرة المقدمة في وضع الدفعات)
+                with self.metrics.span("generate", turn):
+                    response, new_tokens = self.batch_generator.submit(model_input_ids)
+            else:
+                with self.metrics.span("generate", turn), torch.no_grad():
+                    outputs = self._generate(
+                        model_input_ids,
+                        past_key_values=past_key_values,
+                        attention_mask=torch.ones_like(model_input_ids),
+                        **self.generation_kwargs
+                    )
+                new_tokens = outputs[:, model_input_ids.shape[-1]:]
+                with self.metrics.span("decode", turn):
+                    response = self.tokenizer.decode(new_tokens[0], skip_special_tokens=False)
+                with self.metrics.span("clean", turn):
+                    response = self.prompt_engineering.clean_response(response)
+        finally:
+            self._release()
 
-        return response, chat_history_ids
+        self.metrics.observe("chatbot_output_tokens", new_tokens.shape[-1])
+        history.append(new_tokens)
+        self._cache_response(cache_key, response, new_tokens)
+        return response
+
+    def _admit(self, state, history, turn=None):
+        """
+        طلب مكان على النموذج قبل التوليد. عند الرفض تُحذف رسالة المستخدم من التاريخ (حتى يعيد إرسالها)
+        ويُرجع رد الضغط العالي أو تحديد المعدل؛ عند القبول تُرجع None ويجب استدعاء _release بعد التوليد.
+        """
+        if self.admission is None:
+            return None
+        with self.metrics.span("admission", turn):
+            reason = self.admission.admit(state.session_id)
+        if reason is None:
+            return None
+        history.cancel_turn()
+        if turn is not None:
+            turn.route = "shed"
+        return self.RATE_LIMIT_RESPONSE if reason == AdmissionController.RATE_LIMITED else self.HIGH_LOAD_RESPONSE
+
+    def _release(self):
+        if self.admission is not None:
+            self.admission.release()
+
+    def _generate(self, input_ids, **kwargs):
+        """generate للنموذج، عبر نموذج المسودة إذا كان التوليد المساعد مفعّلًا."""
+        if self.assisted is not None:
+            return self.assisted.generate(input_ids, **kwargs)
+        return self.model.generate(input_ids, **kwargs)
+
+    def end_session(self, session_id):
+        """
+        حذف حالة الجلسة (عند مسح المحادثة).
+        """
+        self.sessions.remove(session_id)
+
+    def get_cache_stats(self):
+        """
+        إرجاع عدادات ذاكرة الردود (الإصابة، الإخفاق، الحجم) إذا كانت مفعّلة.
+        """
+        if self.response_cache is None:
+            return None
+        return self.response_cache.get_stats()
+
+    def get_admission_stats(self):
+        """
+        إرجاع إحصائيات التحكم في القبول (الأدوار العاملة والمنتظرة، المقبولة والمرفوضة حسب السبب) إذا كان مفعّلًا.
+        """
+        if self.admission is None:
+            return None
+        return self.admission.get_stats()
+
+    def get_assist_stats(self):
+        """
+        إرجاع إحصائيات التوليد المساعد (نسبة قبول توكنز المسودة، التوكنز لكل مرور للنموذج الرئيسي) إذا كان مفعّلًا.
+        """
+        if self.assisted is None:
+            return None
+        return self.assisted.get_stats()
+
+    def get_batch_stats(self):
+        """
+        إرجاع إحصائيات الدفعات إذا كان التوليد بالدفعات مفعّلًا.
+        """
+        if self.batch_generator is None:
+            return None
+        return self.batch_generator.get_stats()
@@ -0,0 +1,252 @@
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource  # غير متوفر على Windows
+except ImportError:
+    resource = None
+
+
+# حدود الفئات (buckets) للمدرجات التكرارية
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def peak_rss_mb():
+    """أعلى استهلاك للذاكرة (RSS) للعملية الحالية بالميجابايت، أو None إذا لم يكن القياس متاحًا."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss بالكيلوبايت على Linux وبالبايت على macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class _NullSpan:
+    """مقطع زمني لا يفعل شيئًا (عند تعطيل القياس): كائن واحد مشترك دون أي حساب للوقت."""
+    route = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __setattr__(self, name, value):
+        pass  # turn.route = ... يتم تجاهله
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """قياس زمن مرحلة واحدة وتسجيله في مدرج المراحل (وفي تفاصيل الدور إن وُجد)."""
+    __slots__ = ("metrics", "stage", "turn", "started")
+
+    def __init__(self, metrics, stage, turn):
+        self.metrics = metrics
+        self.stage = stage
+        self.turn = turn
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.started
+        self.metrics.observe("chatbot_stage_seconds", duration, stage=self.stage)
+        if self.turn is not None:
+            self.turn.stages.append((self.stage, duration))
+        return False
+
+
+class _Turn:
+    """
+    قياس دور محادثة كامل: الزمن الكلي حسب المسار، وعدد الأدوار والأخطاء،
+    وطباعة تفاصيل المراحل (سطر JSON) إذا تجاوز الدور الحد البطيء.
+    """
+    __slots__ = ("metrics", "route", "stages", "started")
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.route = "unknown"
+        self.stages = []
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.started
+        metrics = self.metrics
+        # GeneratorExit: المستخدم توقف عن قراءة الرد المتدفق، وليس خطأ
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            metrics.inc("chatbot_errors_total", route=self.route)
+        metrics.inc("chatbot_turns_total", route=self.route)
+        metrics.observe("chatbot_turn_seconds", duration, route=self.route)
+        if metrics.slow_turn_ms is not None and duration * 1000 >= metrics.slow_turn_ms:
+            print(json.dumps({
+                "slow_turn_ms": round(duration * 1000, 2),
+                "route": self.route,
+                "stages_ms": [[stage, round(seconds * 1000, 2)] for stage, seconds in self.stages],
+            }))
+        return False
+
+
+class Metrics:
+    """
+    قياسات مسار المحادثة: مقاطع زمنية لكل مرحلة (التصنيف، بناء النص الموجه، التحويل إلى توكنز، generate،
+    فك الترميز، التنظيف، إرسال الحجوزات)، عدادات الأدوار حسب المسار، ومدرجات لعدد التوكنز وحجم الدفعات،
+    مع قيم لحظية (طول قائمة الانتظار، عدد الجلسات) تُقرأ عند الطلب. التصدير بصيغة نصوص Prometheus.
+    عند التعطيل (enabled=False) تُرجع جميع الدوال فورًا ويكون المقطع الزمني كائنًا فارغًا مشتركًا.
+    """
+
+    # النوع والوصف وحدود الفئات لكل قياس
+    DEFINITIONS = {
+        "chatbot_turns_total": ("counter", "Chat turns by route.", None),
+        "chatbot_errors_total": ("counter", "Chat turns that raised an error, by route.", None),
+        "chatbot_turn_seconds": ("histogram", "End-to-end chat turn latency by route.", LATENCY_BUCKETS),
+        "chatbot_stage_seconds": ("histogram", "Time spent in each stage of the chat pipeline.", LATENCY_BUCKETS),
+        "chatbot_prompt_tokens": ("histogram", "Tokens passed to the model per generation (history and turn).",
+                                  TOKEN_BUCKETS),
+        "chatbot_output_tokens": ("histogram", "New tokens generated per model turn.", TOKEN_BUCKETS),
+        "chatbot_batch_size": ("histogram", "Requests per batched generate call.", BATCH_BUCKETS),
+        "chatbot_batch_wait_seconds": ("histogram", "Time a request waited in the batch queue.", LATENCY_BUCKETS),
+        "chatbot_sink_failures_total": ("counter", "Appointment records that failed to send.", None),
+        "chatbot_shed_total": ("counter", "Model turns rejected by admission control, by reason.", None),
+        "chatbot_admission_wait_seconds": ("histogram", "Time a model turn waited for a free slot.", LATENCY_BUCKETS),
+    }
+
+    def __init__(self, enabled=True, slow_turn_ms=None):
+        self.enabled = enabled
+        self.slow_turn_ms = slow_turn_ms  # طباعة تفاصيل المراحل للأدوار الأبطأ من هذا الحد (بالملي ثانية)
+        self._lock = threading.Lock()
+        self._values = {}  # (الاسم، التسميات) -> قيمة العداد أو [عدادات الفئات، المجموع، العدد]
+        self._callbacks = {}  # الاسم -> (النوع، الوصف، دالة تُرجع القيمة أو {التسميات: القيمة})
+        self._server = None
+
+    def span(self, stage, turn=None):
+        """مقطع زمني لمرحلة: with metrics.span("generate", turn): ..."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage, turn)
+
+    def turn(self):
+        """قياس دور محادثة كامل؛ يتم تحديد المسار داخله: turn.route = "model"."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Turn(self)
+
+    def inc(self, name, value=1, **labels):
+        """زيادة عداد."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """إضافة قيمة إلى مدرج تكراري."""
+        if not self.enabled:
+            return
+        buckets = self.DEFINITIONS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def register(self, name, kind, help_text, fn):
+        """
+        تسجيل قيمة تُقرأ عند التصدير فقط (مثل طول قائمة الانتظار أو عدد الجلسات)، بدون أي تكلفة أثناء المحادثة.
+        fn تُرجع رقمًا أو قاموسًا {التسميات (tuple من الأزواج): رقم}.
+        """
+        if self.enabled:
+            self._callbacks[name] = (kind, help_text, fn)
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return ""
+        escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+    def render(self):
+        """جميع القياسات بصيغة نصوص Prometheus (text exposition format 0.0.4)."""
+        with self._lock:
+            values = {key: (list(value[0]), value[1], value[2]) if isinstance(value, list) else value
+                      for key, value in self._values.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in self.DEFINITIONS.items():
+            series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+            if not series:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for labels, value in series:
+                if kind != "histogram":
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{self._format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {total}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        for name, (kind, help_text, fn) in self._callbacks.items():
+            try:
+                value = fn()
+            except Exception as error:
+                print(f"Failed to read metric {name}: {error}")
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            series = value.items() if isinstance(value, dict) else [((), value)]
+            lines += [f"{name}{self._format_labels(labels)} {number}" for labels, number in series]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9100, host="0.0.0.0"):
+        """تشغيل نقطة /metrics عبر HTTP في خيط بالخلفية (مرة واحدة)."""
+        if self._server is not None:
+            return self._server
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # عدم طباعة سطر لكل طلب
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# قياسات معطّلة مشتركة للمكونات التي لم يُمرَّر لها كائن قياسات
+DISABLED_METRICS = Metrics(enabled=False)
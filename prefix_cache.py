@@ -0,0 +1,70 @@
+import threading
+
+import torch
+
+
+class PrefixCache:
+    """
+    ذاكرة مؤقتة لمقدمة النص الموجه الثابتة (SYSTEM_PROMPT + FEW_SHOT_EXAMPLES).
+    يتم تحويل المقدمة إلى توكنز وتمريرها عبر النموذج مرة واحدة، ثم يبدأ كل توليد
+    من past_key_values المحفوظة بدلًا من إعادة حساب المقدمة في كل دور.
+    """
+
+    def __init__(self, model, tokenizer, device):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self._text = None  # نص المقدمة المحفوظة حاليًا
+        self._ids = None
+        self._legacy_cache = None  # past_key_values بصيغة tuple لكل طبقة
+        self._lock = threading.Lock()
+
+    def get(self, prefix_text):
+        """
+        إرجاع (توكنز المقدمة، past_key_values) جاهزة للتمرير إلى generate.
+        إذا تغيّر نص المقدمة (تعديل قالب النص الموجه) يتم إبطال الذاكرة وإعادة حسابها.
+        """
+        with self._lock:
+            if prefix_text != self._text:
+                self._compute(prefix_text)
+            return self._ids, self._fresh_cache()
+
+    def invalidate(self):
+        """إبطال الذاكرة المؤقتة يدويًا (مثلًا بعد تغيير النموذج)."""
+        with self._lock:
+            self._text = self._ids = self._legacy_cache = None
+
+    def prefix_length(self):
+        """عدد توكنز المقدمة المحفوظة."""
+        return 0 if self._ids is None else self._ids.shape[-1]
+
+    def _compute(self, prefix_text):
+        """تمرير المقدمة عبر النموذج مرة واحدة وحفظ past_key_values."""
+        ids = self.tokenizer.encode(prefix_text, return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            outputs = self.model(ids, use_cache=True)
+        self._text, self._ids = prefix_text, ids
+        self._legacy_cache = self._to_legacy(outputs.past_key_values)
+
+    @staticmethod
+    def _to_legacy(past):
+        """تحويل past_key_values إلى tuple من (keys, values) لكل طبقة، أيًا كان إصدار transformers."""
+        if hasattr(past, "to_legacy_cache"):
+            return past.to_legacy_cache()
+        if hasattr(past, "layers"):
+            return tuple((layer.keys, layer.values) for layer in past.layers)
+        return past
+
+    def _fresh_cache(self):
+        """
+        إنشاء كائن cache جديد يشير إلى نفس التنسورات المحفوظة.
+        generate يضيف التوكنز الجديدة إلى كائن الـ cache، لذلك نعطي كل استدعاء كائنًا مستقلًا
+        دون نسخ التنسورات نفسها.
+        """
+        try:
+            from transformers import DynamicCache
+        except ImportError:
+            return self._legacy_cache
+        if hasattr(DynamicCache, "from_legacy_cache"):
+            return DynamicCache.from_legacy_cache(self._legacy_cache)
+        return DynamicCache(self._legacy_cache)
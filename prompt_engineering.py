@@ -1,15 +1,18 @@
-import re
+import hashlib
+from response_cleaner import StreamingCleaner, normalize_response
 from specialist_manager import SpecialistManager
 
 
 class PromptEngineering:
-    
-    def prepare_prompt(self, user_input):
-        """
-        تحضير النص الموجه (prompt) باستخدام مدخلات المستخدم.
-        يتم تحديد دور المساعد، الحدود، الأسلوب، ومثالين سابقين لتمكين النموذج من توليد الردود بشكل مناسب.
-        """
-        SYSTEM_PROMPT = """
+    # الرد الاحتياطي عندما يكون رد النموذج قصيرًا جدًا أو فارغًا بعد التنظيف
+    FALLBACK_RESPONSE = "I understand you're going through something difficult. Can you help me understand what you're feeling right now?"
+
+    def __init__(self, specialist_manager=None):
+        # دليل المختصين المشترك (يُحمّل مرة واحدة بدلًا من إنشائه في كل دور)
+        self.specialist_manager = specialist_manager or SpecialistManager()
+
+    # النص الثابت الذي يحدد دور المساعد وحدوده وأسلوبه
+    SYSTEM_PROMPT = """
         [ROLE]
         You are an informational, empathetic, and calm support worker. Your mission: to listen, reflect feelings, and provide general, evidence-based information, links to credible resources, and simple exercises to calm anxiety.
 
@@ -26,7 +29,8 @@ class PromptEngineering:
         - Divide the response into 4 short paragraphs: (Sympathy) – (Summary) – (Practical Suggestion) – (Reminder and Limitations).
         """
 
-        FEW_SHOT_EXAMPLES = """
+    # أمثلة سابقة ثابتة لتوجيه النموذج
+    FEW_SHOT_EXAMPLES = """
         Example 1:
         Human: I've been feeling really anxious lately and can't seem to shake it off.
         Assistant: I understand that anxiety can be overwhelming. It's important to acknowledge these feelings rather than fighting them. Have you noticed any specific triggers for your anxiety? Some helpful techniques include deep breathing exercises, grounding techniques like the 5-4-3-2-1 method, or gentle physical activity. Would you like to explore what might be contributing to these feelings?
@@ -39,31 +43,66 @@ class PromptEngineering:
         Human: I'm having trouble sleeping and my mind won't stop racing.
         Assistant: Racing thoughts at bedtime are very common and can be exhausting. Creating a bedtime routine can help signal to your mind that it's time to wind down. Try writing down your worries before bed, practice progressive muscle relaxation, or try the 4-7-8 breathing technique. Limiting screen time an hour before bed can also help. What does your current bedtime routine look like?
         """
-        
-        # التعامل مع الرد من المتخصصين إذا كان موجودًا
-        specialist_response = SpecialistManager().handle_specialists(user_input)
-        if specialist_response:  
+
+    def prompt_prefix(self):
+        """
+        المقدمة الثابتة للنص الموجه (الدور والحدود والأمثلة).
+        لا تتغير بين الأدوار، لذلك يمكن حساب توكنزها وذاكرة الانتباه (KV cache) الخاصة بها مرة واحدة.
+        """
+        return self.SYSTEM_PROMPT + "\n\n" + self.FEW_SHOT_EXAMPLES
+
+    @property
+    def prompt_version(self):
+        """بصمة قصيرة للمقدمة الثابتة، تتغير عند تعديل قالب النص الموجه."""
+        return hashlib.sha1(self.prompt_prefix().encode("utf-8")).hexdigest()[:12]
+
+    def prepare_turn(self, user_input):
+        """
+        تحضير الجزء المتغير من النص الموجه (رسالة المستخدم الحالية)، والذي يُضاف بعد المقدمة الثابتة.
+        """
+        # التعامل مع الرد من المتخصصين إذا تم ذكر موقع معروف
+        specialist_manager = self.specialist_manager
+        is_existing, location = specialist_manager.extract_location(user_input)
+        if is_existing:
             # إذا كان هناك رد من المتخصص، يتم إضافته إلى النص الموجه
-            prompt = f"User: {user_input}\nExperts Info: {specialist_response}\nAssistant:"
-        else:
-            # إذا لم يكن هناك رد من المتخصص، نستخدم النص الأساسي مع أمثلة سابقه
-            prompt = SYSTEM_PROMPT + "\n\n" + FEW_SHOT_EXAMPLES + f"\nUser: {user_input}\nAssistant:"
-        
-        return prompt  # إرجاع النص الموجه النهائي
+            specialist_response = specialist_manager.find_experts_by_location(is_existing, location)
+            return f"\nUser: {user_input}\nExperts Info: {specialist_response}\nAssistant:"
+        return f"\nUser: {user_input}\nAssistant:"
+
+    def prepare_prompt(self, user_input):
+        """
+        تحضير النص الموجه (prompt) باستخدام مدخلات المستخدم.
+        يتم تحديد دور المساعد، الحدود، الأسلوب، ومثالين سابقين لتمكين النموذج من توليد الردود بشكل مناسب.
+        """
+        return self.prompt_prefix() + self.prepare_turn(user_input)  # إرجاع النص الموجه النهائي
+
+    def normalize_response(self, response):
+        """تنظيف وتنسيق الاستجابة من النموذج دون استبدالها بالرد الاحتياطي"""
+        # إزالة القوالب والعلامات والعبارات غير المرغوب فيها والمسافات الزائدة (أنماط مُجمّعة مسبقًا)
+        return normalize_response(response)
 
     def clean_response(self, response):
         """تنظيف وتنسيق الاستجابة من النموذج"""
-        # استبدال الرموز غير المرغوب فيها وتنظيف الاستجابة
-        response = response.replace("\xa0", " ").strip()  # إزالة مسافات غير مرئية
-        response = re.sub(r'<\|.*?\|>', '', response)  # إزالة النصوص داخل القوالب غير المرغوب فيها
-        response = response.replace("\'", "")  # إزالة العلامات غير المرغوب فيها
-        response = re.sub(r'(\n)+', '\n', response)  # دمج الأسطر المتعددة إلى سطر واحد
-        response = re.sub(r"\b(I wish you|I hope that)\b", "", response)  # إزالة العبارات غير المفيدة
-        response = re.sub(r"\bI will\b", "", response)  # إزالة العبارات المستقبلية غير المرغوب فيها
-        response = re.sub(r'\s+', ' ', response).strip()  # إزالة المسافات الزائدة بين الكلمات
+        response = self.normalize_response(response)
 
         # إذا كانت الاستجابة قصيرة جدًا أو فارغة، يتم إعادة توجيه المستخدم لشرح مشاعره
         if len(response) < 10 or not response:
-            return "I understand you're going through something difficult. Can you help me understand what you're feeling right now?"
+            return self.FALLBACK_RESPONSE
 
         return response  # إرجاع الاستجابة بعد تنظيفها
+
+    def clean_stream(self, chunks):
+        """
+        تنظيف رد يصل على شكل أجزاء متتالية (أثناء التوليد)، وإرجاع الأجزاء الجديدة فقط بعد التنظيف.
+        يتم تأجيل آخر كلمة غير مكتملة والقوالب غير المكتملة، ولا يبدأ الإرسال قبل أن يتجاوز النص الحد الأدنى للطول
+        حتى يبقى الرد الاحتياطي ممكنًا إذا كان الرد قصيرًا جدًا.
+        """
+        cleaner = StreamingCleaner(self.FALLBACK_RESPONSE)
+        for chunk in chunks:
+            # كل جزء يُنظَّف مرة واحدة فقط، ولا يُعاد تنظيف النص السابق
+            delta = cleaner.feed(chunk)
+            if delta:
+                yield delta
+        delta = cleaner.finish()
+        if delta:
+            yield delta
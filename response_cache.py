@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+from keyword_matcher import normalize_text
+
+
+class ResponseCache:
+    """
+    ذاكرة مؤقتة لردود النموذج على الرسائل المتكررة في بداية المحادثة (بدون سياق سابق)،
+    مثل الأسئلة التجريبية في الواجهة. المفتاح هو نص الرسالة بعد التوحيد مع معرّف النموذج
+    وإصدار النص الموجه، مع حذف الأقدم استخدامًا (LRU) وانتهاء الصلاحية (TTL) وحد أقصى للحجم.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # المفتاح -> (وقت الإضافة، الرد، توكنز الرد)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(user_input, model_id, prompt_version):
+        """مفتاح الذاكرة: الرسالة بعد التوحيد (حالة الأحرف، المسافات، علامات الترقيم) + النموذج + إصدار النص الموجه."""
+        return normalize_text(user_input), model_id, prompt_version
+
+    def get(self, key):
+        """إرجاع (الرد، توكنز الرد) أو None إذا لم يكن موجودًا أو انتهت صلاحيته."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key, response, new_tokens):
+        """حفظ رد النموذج وتوكنزه (حتى يبقى تاريخ المحادثة مطابقًا لما كان سيولده النموذج)."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), response, new_tokens.detach().cpu())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self):
+        """عدادات الإصابة والإخفاق وحجم الذاكرة."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,120 @@
+import re
+
+
+# القوالب مثل <|endoftext|> (داخل سطر واحد) والعلامات ' تُحذف معًا في مرور واحد
+_TEMPLATE_OR_QUOTE = re.compile(r"<\|.*?\|>|'")
+# العبارات غير المفيدة والمستقبلية في نمط واحد (لا يمكن أن تتداخل مطابقاتها، لذلك الترتيب لا يغيّر النتيجة)
+_PHRASES = re.compile(r"\b(?:I wish you|I hope that|I will)\b")
+# طول أطول عبارة محذوفة مع حرف الحد بعدها: آخر جزء من النص بهذا الطول قد يتغير مع الأجزاء القادمة
+_PHRASE_WINDOW = len("I hope that") + 1
+
+
+def normalize_response(response):
+    """
+    تنظيف رد النموذج بأنماط مُجمّعة مسبقًا، بنفس نتيجة الخطوات السبع في PromptEngineering:
+    حذف القوالب والعلامات ' ثم العبارات غير المرغوب فيها، ثم دمج المسافات والأسطر في مسافة واحدة.
+    الخطوات غير اللازمة لهذا النص (لا يحتوي على "<|" أو ' أو "I ") يتم تخطيها دون مرور على النص.
+    """
+    if "<|" in response or "'" in response:
+        response = _TEMPLATE_OR_QUOTE.sub("", response)
+    if "\xa0" in response:
+        response = response.replace("\xa0", " ")  # قبل العبارات: "I\xa0will" تُعامل مثل "I will"
+    if "I " in response:
+        response = _PHRASES.sub("", response)
+    # دمج كل المسافات (بما فيها الأسطر) في مسافة واحدة وحذفها من الطرفين
+    return " ".join(response.split())
+
+
+class StreamingCleaner:
+    """
+    تنظيف رد يصل على شكل أجزاء متتالية دون إعادة تنظيف النص كاملًا مع كل جزء.
+    الجزء الذي لم يعد يمكن أن يتغير (قبل قالب غير مكتمل، وقبل آخر مسافة خارج نافذة العبارات المحذوفة)
+    يُنظَّف مرة واحدة ويُضاف إلى النتيجة، ويبقى فقط الجزء الأخير القصير معلقًا.
+    لا يبدأ الإرسال قبل أن يصل النص إلى min_length حتى يبقى الرد الاحتياطي ممكنًا إذا كان الرد قصيرًا جدًا.
+    مجموع الأجزاء المُرسلة يساوي دائمًا clean_response للنص كاملًا.
+    """
+
+    def __init__(self, fallback, min_length=10):
+        self.fallback = fallback
+        self.min_length = min_length
+        self._raw = ""  # نص خام لم تُحذف منه القوالب بعد (قد يحتوي على قالب غير مكتمل)
+        self._text = ""  # نص بعد حذف القوالب والعلامات، ينتظر حذف العبارات
+        self._length = 0  # طول النتيجة النهائية حتى الآن
+        self._pending = ""  # نتيجة نهائية لم تُرسل بعد
+
+    def feed(self, chunk):
+        """إضافة جزء جديد؛ تُرجع النص الجديد الجاهز للإرسال (أو "")."""
+        self._raw += chunk
+        cut = self._template_safe_end(self._raw)
+        if cut:
+            self._text += self._remove_templates(self._raw[:cut])
+            self._raw = self._raw[cut:]
+        cut = self._phrase_safe_end(self._text)
+        if cut:
+            self._add_words(_PHRASES.sub("", self._text[:cut]).split())
+            self._text = self._text[cut:]
+        return self._take(self.min_length)
+
+    def finish(self):
+        """نهاية الرد: تنظيف ما تبقى وإرجاع آخر جزء (أو الرد الاحتياطي إذا كان الرد كله قصيرًا جدًا)."""
+        self._add_words(_PHRASES.sub("", self._text + self._remove_templates(self._raw)).split())
+        self._raw = self._text = ""
+        if self._length < self.min_length:
+            return self.fallback
+        return self._take(0)
+
+    @staticmethod
+    def _remove_templates(raw):
+        if "<|" in raw or "'" in raw:
+            raw = _TEMPLATE_OR_QUOTE.sub("", raw)
+        return raw.replace("\xa0", " ")
+
+    @staticmethod
+    def _template_safe_end(raw):
+        """
+        نهاية الجزء الذي يمكن حذف القوالب منه الآن: قبل أول "<|" لم يُغلق بعد في السطر الأخير
+        (القالب لا يمتد عبر الأسطر، فـ "<|" يليها سطر جديد قبل "|>" لن تُغلق أبدًا).
+        """
+        start = raw.find("<|")
+        while start != -1:
+            close = raw.find("|>", start + 2)
+            newline = raw.find("\n", start + 2)
+            if newline != -1 and (close == -1 or newline < close):
+                start = raw.find("<|", start + 1)  # لن يكتمل هذا القالب
+            elif close == -1:
+                return start  # قالب مفتوح قد يُغلق مع الأجزاء القادمة
+            else:
+                start = raw.find("<|", close + 2)
+        # "<" في النهاية قد يصبح بداية قالب مع الجزء التالي
+        return len(raw) - 1 if raw.endswith("<") else len(raw)
+
+    @staticmethod
+    def _phrase_safe_end(text):
+        """
+        موضع مسافة قبل آخر _PHRASE_WINDOW حرفًا لا تقع داخل عبارة محذوفة:
+        النص قبلها لن يتغير مع الأجزاء القادمة، والكلمات لا تنقسم عندها.
+        """
+        cut = len(text) - _PHRASE_WINDOW
+        while cut > 0:
+            while cut > 0 and not text[cut].isspace():
+                cut -= 1
+            inside = next((m for m in _PHRASES.finditer(text, 0, len(text)) if m.start() < cut < m.end()), None)
+            if inside is None:
+                return cut
+            cut = inside.start() - 1
+        return 0
+
+    def _add_words(self, words):
+        if not words:
+            return
+        joined = " ".join(words)
+        if self._length:
+            joined = " " + joined
+        self._pending += joined
+        self._length += len(joined)
+
+    def _take(self, min_length):
+        if not self._pending or self._length < min_length:
+            return ""
+        pending, self._pending = self._pending, ""
+        return pending
@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class SessionState:
+    """
+    حالة محادثة واحدة بشكل مضغوط (باستخدام __slots__ لتقليل استهلاك الذاكرة).
+    """
+    __slots__ = ("session_id", "ask_to_location", "asking_for_appointment", "asked_for_name", "collected_data",
+                 "history", "last_seen", "lock", "counted_tokens")
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.ask_to_location = False  # هل ننتظر من المستخدم تحديد موقعه؟
+        self.asking_for_appointment = False  # هل نحن في منتصف حجز موعد؟
+        self.asked_for_name = False  # هل طلبنا الاسم (أول تفاصيل الحجز)؟
+        self.collected_data = {}  # بيانات الحجز التي تم جمعها حتى الآن
+        self.history = None  # تاريخ المحادثة (TokenHistory) بميزانية توكنز ثابتة
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()  # منع معالجة رسالتين لنفس الجلسة في الوقت نفسه
+        self.counted_tokens = 0  # توكنز الجلسة المحسوبة حاليًا في مجموع المخزن
+
+    def num_tokens(self):
+        """عدد التوكنز المخزنة في تاريخ المحادثة."""
+        if self.history is None:
+            return 0
+        return self.history.num_tokens()
+
+    def reset(self):
+        """إعادة الجلسة إلى حالتها الأولية."""
+        self.ask_to_location = False
+        self.asking_for_appointment = False
+        self.asked_for_name = False
+        self.collected_data = {}
+        self.history = None
+
+
+class SessionStore:
+    """
+    مخزن الجلسات حسب معرّف الجلسة، مع حذف الجلسات الخاملة (TTL)
+    وحد أقصى لعدد الجلسات ولمجموع التوكنز المخزنة.
+    مجموع التوكنز يُحفظ كعدّاد يتم تحديثه عند انتهاء كل دور (turn) وعند حذف جلسة،
+    بدلًا من جمع توكنز كل الجلسات مع كل طلب.
+    """
+
+    def __init__(self, ttl_seconds=1800, max_sessions=1000, max_total_tokens=2_000_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_total_tokens = max_total_tokens
+        self._sessions = OrderedDict()  # مرتبة من الأقدم استخدامًا إلى الأحدث
+        self._total_tokens = 0
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """
+        إرجاع حالة الجلسة (أو إنشاؤها إذا لم تكن موجودة) وتحديث وقت آخر استخدام.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                state = SessionState(session_id)
+                self._sessions[session_id] = state
+            else:
+                self._sessions.move_to_end(session_id)
+            state.last_seen = now
+            self._evict(now)
+            return state
+
+    @contextmanager
+    def turn(self, state):
+        """
+        معالجة دور واحد في الجلسة: منع الأدوار المتزامنة لنفس الجلسة،
+        ثم تحديث مجموع التوكنز بالفرق في توكنز هذه الجلسة فقط (إضافة رد، حذف دور، إعادة تعيين).
+        """
+        with state.lock:
+            try:
+                yield state
+            finally:
+                with self._lock:
+                    # الجلسة قد تكون حُذفت أثناء الدور، وعندها خُصمت توكنزها المحسوبة من المجموع
+                    if self._sessions.get(state.session_id) is state:
+                        tokens = state.num_tokens()
+                        self._total_tokens += tokens - state.counted_tokens
+                        state.counted_tokens = tokens
+
+    def remove(self, session_id):
+        """حذف جلسة عند انتهاء المحادثة أو مسحها من الواجهة."""
+        with self._lock:
+            state = self._sessions.pop(session_id, None)
+            if state is not None:
+                self._total_tokens -= state.counted_tokens
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def total_tokens(self):
+        """مجموع التوكنز المخزنة في جميع الجلسات (حتى آخر دور منتهٍ في كل جلسة)."""
+        return self._total_tokens
+
+    def _pop_oldest(self):
+        _, state = self._sessions.popitem(last=False)
+        self._total_tokens -= state.counted_tokens
+
+    def _evict(self, now):
+        """
+        حذف الجلسات المنتهية الصلاحية، ثم الأقدم استخدامًا حتى العودة إلى حدود الذاكرة.
+        الجلسة الأحدث (الموجودة في نهاية القائمة) لا يتم حذفها أبدًا.
+        """
+        # حذف الجلسات الخاملة لفترة أطول من TTL
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_seen <= self.ttl_seconds:
+                break
+            self._pop_oldest()
+
+        # حذف الأقدم استخدامًا عند تجاوز الحد الأقصى لعدد الجلسات
+        while len(self._sessions) > self.max_sessions:
+            self._pop_oldest()
+
+        # حذف الأقدم استخدامًا عند تجاوز الحد الأقصى لمجموع التوكنز
+        while self._total_tokens > self.max_total_tokens and len(self._sessions) > 1:
+            self._pop_oldest()
@@ -1,14 +1,85 @@
+import csv
+import json
+import os
+import sqlite3
+
+from keyword_matcher import KeywordMatcher, normalize_text
+
+
 # تعريف فئة SpecialistManager لإدارة المتخصصين في المجال الطبي
 class SpecialistManager:
-    def __init__(self):
-        # قاعدة بيانات للمختصين تحتوي على معلومات مثل الاسم، التخصص، الهاتف، البريد الإلكتروني، ساعات العمل، والموقع
-        self.experts_db = [
-            {"name": "Dr. John Doe", "specialty": "Psychiatrist", "phone": "+1234567890", "email": "johndoe@example.com", "working_hours": "9 AM - 5 PM", "location": "New York"},
-            {"name": "Nurse Mary Smith", "specialty": "Mental Health Nurse", "phone": "+9876543210", "email": "marysmith@example.com", "working_hours": "8 AM - 4 PM", "location": "Los Angeles"},
-            {"name": "Dr. Alice Brown", "specialty": "Psychologist", "phone": "+1122334455", "email": "alicebrown@example.com", "working_hours": "10 AM - 6 PM", "location": "Chicago"}
-        ]
+    # قاعدة البيانات الافتراضية للمختصين تحتوي على معلومات مثل الاسم، التخصص، الهاتف، البريد الإلكتروني، ساعات العمل، والموقع
+    DEFAULT_EXPERTS = [
+        {"name": "Dr. John Doe", "specialty": "Psychiatrist", "phone": "+1234567890", "email": "johndoe@example.com", "working_hours": "9 AM - 5 PM", "location": "New York"},
+        {"name": "Nurse Mary Smith", "specialty": "Mental Health Nurse", "phone": "+9876543210", "email": "marysmith@example.com", "working_hours": "8 AM - 4 PM", "location": "Los Angeles"},
+        {"name": "Dr. Alice Brown", "specialty": "Psychologist", "phone": "+1122334455", "email": "alicebrown@example.com", "working_hours": "10 AM - 6 PM", "location": "Chicago"}
+    ]
+
+    # الحقول المطلوبة لكل مختص عند التحميل من ملف
+    FIELDS = ("name", "specialty", "phone", "email", "working_hours", "location")
+
+    def __init__(self, source=None, table="experts"):
+        """
+        تحميل دليل المختصين مرة واحدة من ملف CSV أو JSON أو قاعدة بيانات SQLite (أو القائمة الافتراضية)،
+        ثم بناء الفهارس حسب الموقع والتخصص والقوائم المنسقة مسبقًا.
+        """
+        self.experts_db = self.load_experts(source, table) if source else list(self.DEFAULT_EXPERTS)
+        self._build_indexes()
         # يتم تخزين البيانات في self.experts_db وتكون جاهزة للاستخدام في باقي الدوال
 
+    @classmethod
+    def load_experts(cls, source, table="experts"):
+        """
+        قراءة المختصين من الملف حسب امتداده: csv أو json أو db/sqlite/sqlite3.
+        """
+        extension = os.path.splitext(source)[1].lower()
+        if extension == ".csv":
+            with open(source, newline="", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f))
+        elif extension == ".json":
+            with open(source, encoding="utf-8") as f:
+                data = json.load(f)
+            rows = data["experts"] if isinstance(data, dict) else data
+        elif extension in (".db", ".sqlite", ".sqlite3"):
+            connection = sqlite3.connect(source)
+            connection.row_factory = sqlite3.Row
+            try:
+                rows = [dict(row) for row in connection.execute(f"SELECT {', '.join(cls.FIELDS)} FROM {table}")]
+            finally:
+                connection.close()
+        else:
+            raise ValueError(f"Unsupported specialists source: {source}")
+        return [{field: (row.get(field) or "").strip() for field in cls.FIELDS} for row in rows]
+
+    def _build_indexes(self):
+        """
+        بناء الفهارس مرة واحدة: المختصين حسب الموقع والتخصص (بعد التوحيد)، قائمة منسقة جاهزة لكل موقع،
+        وآلة مطابقة واحدة لجميع أسماء المواقع لاستخراج الموقع من النص في مرور واحد.
+        """
+        self.by_location = {}
+        self.by_specialty = {}
+        self.locations = []  # أسماء المواقع بترتيب ظهورها في الدليل
+        location_names = {}
+        for expert in self.experts_db:
+            location_key = normalize_text(expert["location"])
+            if location_key not in self.by_location:
+                self.by_location[location_key] = []
+                location_names[location_key] = expert["location"]
+                self.locations.append(expert["location"])
+            self.by_location[location_key].append(expert)
+            self.by_specialty.setdefault(normalize_text(expert["specialty"]), []).append(expert)
+
+        self._listings = {
+            key: self._format_listing(experts) for key, experts in self.by_location.items()
+        }
+        self._location_matcher = KeywordMatcher((name, name) for name in location_names.values())
+
+    @staticmethod
+    def _format_listing(experts_list):
+        """إعداد نص يحتوي على معلومات المختصين الموجودين في الموقع"""
+        experts_info = "\n".join([f"Name: {expert['name']}, Specialty: {expert['specialty']}" for expert in experts_list])
+        # إضافة رسالة تحتوي على تفاصيل المختصين في الموقع
+        return f"Here is the list of available specialists based on your location:\n{experts_info}\nWould you like me to schedule an appointment with a specialist to assist you?"
 
     def handle_specialists(self, user_input):
         """
@@ -25,13 +96,10 @@ class SpecialistManager:
         """
         دالة لاستخراج الموقع من النص المدخل بواسطة المستخدم
         """
-        # إنشاء مجموعة تحتوي على المواقع المختلفة للمختصين في قاعدة البيانات
-        locations = set(expert["location"] for expert in self.experts_db)
-        # البحث إذا كان أحد المواقع موجودًا في النص المدخل
-        for location in locations:
-            # التحقق من وجود الموقع في النص مع تجاهل حالة الأحرف (صغيرة أو كبيرة)
-            if location.lower() in text.lower():
-                return True, location  # إذا تم العثور على الموقع، إعادة True مع الموقع
+        # البحث عن أي من المواقع في النص في مرور واحد (مع تجاهل حالة الأحرف)
+        location = self._location_matcher.search(text)
+        if location is not None:
+            return True, location  # إذا تم العثور على الموقع، إعادة True مع الموقع
         return False, text  # إذا لم يتم العثور على الموقع، إعادة False مع النص كما هو
 
     def find_experts_by_location(self, is_existing, location):
@@ -39,15 +107,15 @@ class SpecialistManager:
         دالة للبحث عن المختصين بناءً على الموقع
         """
         if is_existing:
-            # إذا تم العثور على الموقع، نقوم بتصفية المختصين في ذلك الموقع
-            experts_list = [expert for expert in self.experts_db if expert["location"].lower() == location.lower()]
-            # إعداد نص يحتوي على معلومات المختصين الموجودين في الموقع
-            experts_info = "\n".join([f"Name: {expert['name']}, Specialty: {expert['specialty']}" for expert in experts_list])
+            # إرجاع القائمة المنسقة مسبقًا للمختصين في ذلك الموقع
+            experts_info = self._listings.get(normalize_text(location))
+            if experts_info is not None:
+                return experts_info  # إرجاع تفاصيل المختصين
+        # إذا لم يتم العثور على أي مختصين في الموقع، إرجاع رسالة اعتذار
+        return f"Sorry, we couldn't find any specialists in your location ({location})."
 
-            # إضافة رسالة تحتوي على تفاصيل المختصين في الموقع
-            experts_info = f"Here is the list of available specialists based on your location:\n{experts_info}\nWould you like me to schedule an appointment with a specialist to assist you?"
-
-            return experts_info  # إرجاع تفاصيل المختصين
-        else:
-            # إذا لم يتم العثور على أي مختصين في الموقع، إرجاع رسالة اعتذار
-            return f"Sorry, we couldn't find any specialists in your location ({location})."
+    def find_experts_by_specialty(self, specialty):
+        """
+        دالة للبحث عن المختصين حسب التخصص
+        """
+        return self.by_specialty.get(normalize_text(specialty), [])
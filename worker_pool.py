@@ -0,0 +1,212 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import FAST_LANE_THREADS
+
+
+def _worker_main(index, cores, threads, concurrency, chatbot_kwargs, requests, responses):
+    """
+    حلقة عملية العامل: تثبيت الخيوط على الأنوية المخصصة، تحميل روبوت المحادثة (بأوزان مشتركة عبر mmap)،
+    ثم تنفيذ الطلبات القادمة من الواجهة وإرسال أجزاء الرد أولًا بأول.
+    """
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # تم تحديده مسبقًا في هذه العملية
+    from mental_health_chatbot import MentalHealthChatbot
+
+    try:
+        chatbot = MentalHealthChatbot(**chatbot_kwargs)
+    except Exception as error:
+        responses.put((None, "failed", f"Worker {index} failed to start: {error!r}"))
+        return
+    responses.put((None, "ready", index))
+
+    def handle(request_id, kind, session_id, user_input):
+        try:
+            if kind == "stream":
+                for chunk in chatbot.generate_response_stream(user_input, session_id=session_id):
+                    responses.put((request_id, "chunk", chunk))
+            elif kind == "end_session":
+                chatbot.end_session(session_id)
+            elif kind == "warm_up":
+                chatbot.warm_up()
+            responses.put((request_id, "done", None))
+        except Exception as error:
+            responses.put((request_id, "error", repr(error)))
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"worker-{index}") as executor:
+        while True:
+            message = requests.get()
+            if message is None:
+                break
+            executor.submit(handle, *message)
+    chatbot.appointment_manager.outbox.close()
+
+
+class WorkerPool:
+    """
+    تشغيل روبوت المحادثة في عدة عمليات (workers) خلف واجهة المحادثة.
+    أوزان النموذج تُحفظ مرة واحدة في ملف يُقرأ بـ mmap من جميع العمليات (نسخة واحدة في الذاكرة)،
+    ولكل عامل عدد محدد من خيوط torch وأنوية خاصة به، وكل جلسة تُوجَّه دائمًا إلى نفس العامل
+    لأن حالة المحادثة (التاريخ، تقدم الحجز) محفوظة داخل العامل.
+    """
+
+    def __init__(self, num_workers=None, model_name="adanal/dialogpt-finetuned", backend="eager", threads_per_worker=None,
+                 pin_cores=True, shared_weights_dir="./shared_weights", start_timeout=600, **chatbot_kwargs):
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+        self.num_workers = num_workers or len(cores)
+        self.threads_per_worker = threads_per_worker or max(1, len(cores) // self.num_workers)
+        # عدد الطلبات المتزامنة داخل كل عامل (أكثر من طلب فقط عند تفعيل التوليد بالدفعات)
+        self.worker_concurrency = chatbot_kwargs.get("max_batch_size", 8) if chatbot_kwargs.get("enable_batching") else 1
+        self.concurrency = self.num_workers * self.worker_concurrency
+        # مع التحكم في القبول: خيوط إضافية للأدوار المنتظرة وللردود المبنية على القواعد (المسار السريع)،
+        # فالتحكم في القبول داخل العامل هو الذي يحدد عدد أدوار النموذج
+        self.worker_threads = self.worker_concurrency
+        if chatbot_kwargs.get("max_model_queue") is not None or chatbot_kwargs.get("session_rate") is not None:
+            self.worker_threads += (chatbot_kwargs.get("max_model_queue") or 0) + FAST_LANE_THREADS
+        self.model = self.tokenizer = None  # النموذج موجود داخل العمليات فقط
+        self.batch_generator = None
+        self.start_timeout = start_timeout
+
+        # حفظ الأوزان مرة واحدة في ملف مشترك (خلفيتا eager و int8؛ onnx يُحمّل ملفه الخاص)
+        chatbot_kwargs.update(model_name=model_name, backend=backend)
+        if backend in ("eager", "int8"):
+            from inference_backend import save_shared_weights
+
+            chatbot_kwargs["shared_weights"] = save_shared_weights(model_name, shared_weights_dir)
+
+        # spawn بدلًا من fork: لا يتم نسخ خيوط torch أو الأقفال من العملية الرئيسية
+        context = multiprocessing.get_context("spawn")
+        self._responses = context.Queue()
+        self._requests = []
+        self._processes = []
+        outbox_root, outbox_ext = os.path.splitext(chatbot_kwargs.pop("appointment_outbox_path", "appointments_outbox.db"))
+        metrics_port = chatbot_kwargs.pop("metrics_port", None)
+        for index in range(self.num_workers):
+            worker_cores = None
+            if pin_cores and len(cores) >= self.num_workers * self.threads_per_worker:
+                worker_cores = cores[index * self.threads_per_worker:(index + 1) * self.threads_per_worker]
+            # لكل عامل صندوق صادر خاص حتى لا يرسل عاملان نفس الحجز
+            worker_kwargs = dict(chatbot_kwargs, appointment_outbox_path=f"{outbox_root}-{index}{outbox_ext}")
+            if metrics_port is not None:
+                worker_kwargs["metrics_port"] = metrics_port + index  # نقطة /metrics لكل عامل على منفذ مختلف
+            requests = context.Queue()
+            process = context.Process(
+                target=_worker_main,
+                args=(index, worker_cores, self.threads_per_worker, self.worker_threads, worker_kwargs,
+                      requests, self._responses),
+                name=f"chatbot-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            self._requests.append(requests)
+            self._processes.append(process)
+
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._ready = queue.Queue()
+        self._dispatcher = threading.Thread(target=self._dispatch, name="worker-pool-dispatcher", daemon=True)
+        self._dispatcher.start()
+        self._wait_ready()
+
+    def _wait_ready(self):
+        """انتظار تحميل النموذج في جميع العمليات."""
+        for _ in range(self.num_workers):
+            try:
+                status, detail = self._ready.get(timeout=self.start_timeout)
+            except queue.Empty:
+                self.close()
+                raise RuntimeError("Timed out waiting for chatbot workers to start.")
+            if status == "failed":
+                self.close()
+                raise RuntimeError(detail)
+
+    def _dispatch(self):
+        """توزيع الرسائل القادمة من العمليات على الطلبات المنتظرة."""
+        while True:
+            message = self._responses.get()
+            if message is None:
+                return
+            request_id, kind, payload = message
+            if request_id is None:
+                self._ready.put((kind, payload))
+                continue
+            with self._pending_lock:
+                channel = self._pending.get(request_id)
+                if kind in ("done", "error"):
+                    self._pending.pop(request_id, None)
+            if channel is not None:
+                channel.put((kind, payload))
+
+    def worker_for(self, session_id):
+        """رقم العامل المسؤول عن الجلسة (ثابت لنفس session_id)."""
+        return zlib.crc32(session_id.encode("utf-8")) % self.num_workers
+
+    def _submit(self, kind, session_id, user_input=None, worker=None):
+        if worker is None:
+            worker = self.worker_for(session_id)
+        if not self._processes[worker].is_alive():
+            raise RuntimeError(f"Chatbot worker {worker} is not running.")
+        request_id = next(self._ids)
+        channel = queue.Queue()
+        with self._pending_lock:
+            self._pending[request_id] = channel
+        self._requests[worker].put((request_id, kind, session_id, user_input))
+        return worker, channel
+
+    def _results(self, worker, channel):
+        while True:
+            try:
+                kind, payload = channel.get(timeout=1.0)
+            except queue.Empty:
+                if not self._processes[worker].is_alive():
+                    raise RuntimeError(f"Chatbot worker {worker} exited while handling a request.")
+                continue
+            if kind == "chunk":
+                yield payload
+            elif kind == "error":
+                raise RuntimeError(payload)
+            else:
+                return
+
+    def generate_response_stream(self, user_input, session_id="default"):
+        """نفس واجهة MentalHealthChatbot.generate_response_stream، مع التنفيذ في عامل الجلسة."""
+        yield from self._results(*self._submit("stream", session_id, user_input))
+
+    def generate_response(self, user_input, session_id="default"):
+        """الرد كاملًا كنص (التاريخ بالتوكنز يبقى داخل العامل)."""
+        return "".join(self.generate_response_stream(user_input, session_id=session_id))
+
+    def end_session(self, session_id):
+        """حذف حالة الجلسة من العامل المسؤول عنها."""
+        for _ in self._results(*self._submit("end_session", session_id)):
+            pass
+
+    def warm_up(self):
+        """توليد رد تجريبي في جميع العمليات بالتوازي قبل استقبال المستخدمين."""
+        submitted = [self._submit("warm_up", "__warm_up__", worker=index) for index in range(self.num_workers)]
+        for worker, channel in submitted:
+            for _ in self._results(worker, channel):
+                pass
+
+    def close(self, timeout=10):
+        """إيقاف جميع العمليات."""
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._responses.put(None)